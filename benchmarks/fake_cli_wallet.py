@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Stand-in for cli_wallet for benchmarks. Takes the same command line as the real one (so it can be set as wallet:path
+and be started by the wallet supervisor), serves JSON-RPC 2.0 over HTTP on the -H endpoint and keeps its accounts in
+memory. Calls are handled one at a time, like the real wallet.
+
+Latency and error injection come from the options below, each also read from an environment variable so they reach
+the wallet started by the gunicorn workers:
+
+    FAKE_WALLET_LATENCY_MS            time every call takes
+    FAKE_WALLET_JITTER_MS             up to this much more, uniformly distributed
+    FAKE_WALLET_BROADCAST_LATENCY_MS  added to calls that broadcast a transaction
+    FAKE_WALLET_LOCK_RATE             chance the wallet is found locked ("is_locked" error)
+    FAKE_WALLET_INVALID_STATE_RATE    chance the wallet loses its node, every call fails with "invalid state" until
+                                      it is restarted
+    FAKE_WALLET_TAKEN_RATE            chance register_account fails with "rec && rec->name"
+    FAKE_WALLET_BAD_KEY_RATE          chance register_account fails with "base58str.size() > prefix_len"
+    FAKE_WALLET_PASSWORD              unlock fails with "during aes 256" for any other password, any is accepted
+                                      when empty
+    FAKE_WALLET_ACCOUNTS              comma separated accounts that exist from the start
+    FAKE_WALLET_BALANCE               core asset balance the registrar pays account creation fees from, every
+                                      account reports it as its balance
+    FAKE_WALLET_ACCOUNT_FEE           account creation fee, registrations fail with "Insufficient Balance" once the
+                                      balance cannot cover it
+    FAKE_WALLET_ACCEPT_BATCH          answer JSON-RPC batch (array) bodies when 1, by default they get HTTP 500 with
+                                      no body like from the real cli_wallet
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import datetime
+import threading
+import http.server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tusc_api import account_validator  # noqa: E402
+
+SUCCESSFULLY_STARTED_MESSAGE = "Listening for incoming HTTP and WS RPC requests"
+BRAIN_KEY_WORDS = ["ABAFT", "BEDROCK", "CAPSULE", "DIVAN", "EMBLAZE", "FLOTSAM", "GANTRY", "HOMINY", "INKHORN",
+                   "JOSTLE", "KILTER", "LANYARD", "MOTLEY", "NOSTRUM", "OUTRUN", "PIGGIN", "QUINTAL", "RAFFISH"]
+
+
+def base58_encode(data: bytes) -> str:
+    value = int.from_bytes(data, 'big')
+    encoded = ""
+    while value > 0:
+        value, remainder = divmod(value, 58)
+        encoded = account_validator.BASE58_ALPHABET[remainder] + encoded
+    leading_zeros = len(data) - len(data.lstrip(b'\x00'))
+    return account_validator.BASE58_ALPHABET[0] * leading_zeros + encoded
+
+
+def random_public_key() -> str:
+    """A public key account_validator accepts. It is not a point on the curve, the fake wallet does not care."""
+    key_data = bytes([random.choice((2, 3))]) + os.urandom(32)
+    return account_validator.PUBLIC_KEY_PREFIX + base58_encode(key_data + account_validator.ripemd160(key_data)[:4])
+
+
+def _fc_error(method: str, format_str: str, data: dict, name: str = "assert_exception") -> dict:
+    # The shape of an fc::exception as cli_wallet returns it
+    return {
+        "code": 1,
+        "message": format_str,
+        "data": {
+            "code": 10 if name == "assert_exception" else 0,
+            "name": name,
+            "message": "Assert Exception" if name == "assert_exception" else "unspecified",
+            "stack": [{
+                "context": {
+                    "level": "error",
+                    "file": "wallet.cpp",
+                    "line": 0,
+                    "method": method,
+                    "hostname": "",
+                    "thread_name": "th_a",
+                    "timestamp": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S"),
+                },
+                "format": format_str,
+                "data": data,
+            }],
+        },
+    }
+
+
+def is_locked_error(method: str) -> dict:
+    return _fc_error(method, "!is_locked(): ", {})
+
+
+def invalid_state_error(method: str) -> dict:
+    return _fc_error(method, "${msg}", {"msg": "invalid state"}, "exception")
+
+
+def account_taken_error(method: str) -> dict:
+    return _fc_error(method, "rec && rec->name == account_name_or_id: ", {})
+
+
+def base58_error(method: str) -> dict:
+    return _fc_error(method, "base58str.size() > prefix_len: ", {})
+
+
+def insufficient_balance_error(method: str) -> dict:
+    return _fc_error(method, "Insufficient Balance: ${a}'s balance of ${b} is less than required ${r}", {})
+
+
+def wrong_password_error(method: str) -> dict:
+    return _fc_error(method, "error during aes 256 cbc decrypt final", {}, "exception")
+
+
+class FakeWallet:
+    def __init__(self, options: argparse.Namespace):
+        self._options = options
+        self._lock = threading.Lock()
+        self._locked = True
+        self._invalid_state = False
+        self._accounts = {}
+        self._account_keys = {}
+        self._next_account_instance = 100
+        self._builder_transactions = {}
+        self._next_builder_handle = 0
+        self._balance = options.balance
+        for account_name in options.accounts.split(","):
+            if account_name != "":
+                self._create_account(account_name)
+
+    def accepts_batch(self) -> bool:
+        return self._options.accept_batch
+
+    def handle(self, req: dict) -> dict:
+        method = req.get("method", "")
+        params = req.get("params", [])
+        response = {"id": req.get("id"), "jsonrpc": "2.0"}
+
+        # Calls are processed one at a time, like in the single threaded cli_wallet
+        with self._lock:
+            time.sleep(self._latency(method, params))
+            try:
+                result = self._call(method, params)
+            except _WalletError as err:
+                response["error"] = err.error
+            else:
+                response["result"] = result
+        return response
+
+    def _latency(self, method: str, params: list) -> float:
+        latency = self._options.latency_ms + random.uniform(0, self._options.jitter_ms)
+        if method in ("register_account", "sign_builder_transaction") and len(params) > 0 and params[-1] is True:
+            latency += self._options.broadcast_latency_ms
+        return latency / 1000
+
+    def _call(self, method: str, params: list):
+        if not self._invalid_state and random.random() < self._options.invalid_state_rate:
+            self._invalid_state = True
+        if self._invalid_state:
+            raise _WalletError(invalid_state_error(method))
+
+        if method == "is_locked":
+            return self._locked
+        if method == "unlock":
+            if self._options.password != "" and params[0] != self._options.password:
+                raise _WalletError(wrong_password_error(method))
+            self._locked = False
+            return None
+        if method == "lock":
+            self._locked = True
+            return None
+        if method == "suggest_brain_key":
+            return {
+                "brain_priv_key": " ".join(random.choice(BRAIN_KEY_WORDS) for x in range(16)),
+                "wif_priv_key": "5" + base58_encode(os.urandom(36)),
+                "pub_key": random_public_key(),
+            }
+        if method == "list_accounts":
+            names = sorted(name for name in self._accounts if name >= params[0])[:params[1]]
+            return [[name, self._accounts[name]] for name in names]
+        if method == "get_account":
+            if params[0] not in self._accounts:
+                raise _WalletError(_fc_error(method, "rec: Unknown account", {}))
+            authority = {"weight_threshold": 1, "account_auths": [], "address_auths": [],
+                         "key_auths": [[self._account_keys[params[0]], 1]]}
+            return {"id": self._accounts[params[0]], "name": params[0], "owner": authority, "active": authority}
+        if method == "list_account_balances":
+            if params[0] not in self._accounts:
+                raise _WalletError(_fc_error(method, "rec: Unknown account", {}))
+            return [{"amount": self._balance, "asset_id": "1.3.0"}]
+        if method == "get_global_properties":
+            fee_parameters = {"basic_fee": self._options.account_fee, "premium_fee": self._options.account_fee * 50,
+                              "price_per_kbyte": 0}
+            return {"parameters": {"current_fees": {"parameters": [[5, fee_parameters]], "scale": 10000}}}
+        if method == "register_account":
+            return self._register_account(method, params)
+        if method == "begin_builder_transaction":
+            handle = self._next_builder_handle
+            self._next_builder_handle += 1
+            self._builder_transactions[handle] = []
+            return handle
+        if method == "add_operation_to_builder_transaction":
+            self._builder_transaction(method, params[0]).append(params[1])
+            return None
+        if method == "set_fees_on_builder_transaction":
+            self._builder_transaction(method, params[0])
+            return {"amount": 0, "asset_id": params[1]}
+        if method == "sign_builder_transaction":
+            self._require_unlocked(method)
+            operations = self._builder_transaction(method, params[0])
+            for operation in operations:
+                if operation[1]["name"] in self._accounts:
+                    raise _WalletError(account_taken_error(method))
+            self._pay_fees(method, len(operations))
+            for operation in operations:
+                self._create_account(operation[1]["name"], operation[1]["owner"]["key_auths"][0][0])
+            return self._transaction(operations)
+        if method == "remove_builder_transaction":
+            self._builder_transactions.pop(params[0], None)
+            return None
+
+        raise _WalletError(_fc_error(method, "Method not found: " + method, {}, "exception"))
+
+    def _register_account(self, method: str, params: list) -> dict:
+        account_name, owner_key, active_key, registrar, referrer = params[:5]
+        self._require_unlocked(method)
+        if account_name in self._accounts or random.random() < self._options.taken_rate:
+            raise _WalletError(account_taken_error(method))
+        if not account_validator.is_valid_public_key(owner_key) or random.random() < self._options.bad_key_rate:
+            raise _WalletError(base58_error(method))
+        if registrar not in self._accounts or referrer not in self._accounts:
+            raise _WalletError(account_taken_error(method))
+
+        self._pay_fees(method, 1)
+        self._create_account(account_name, owner_key)
+        return self._transaction([[5, {"name": account_name, "registrar": self._accounts[registrar],
+                                       "referrer": self._accounts[referrer]}]])
+
+    def _require_unlocked(self, method: str):
+        if not self._locked and random.random() < self._options.lock_rate:
+            self._locked = True
+        if self._locked:
+            raise _WalletError(is_locked_error(method))
+
+    def _pay_fees(self, method: str, count: int):
+        if self._balance < self._options.account_fee * count:
+            raise _WalletError(insufficient_balance_error(method))
+        self._balance -= self._options.account_fee * count
+
+    def _builder_transaction(self, method: str, handle: int) -> list:
+        if handle not in self._builder_transactions:
+            raise _WalletError(_fc_error(method, "_builder_transactions.count(handle): ", {}))
+        return self._builder_transactions[handle]
+
+    def _create_account(self, account_name: str, public_key: str = ""):
+        self._accounts[account_name] = f"1.2.{self._next_account_instance}"
+        self._account_keys[account_name] = public_key or random_public_key()
+        self._next_account_instance += 1
+
+    @staticmethod
+    def _transaction(operations: list) -> dict:
+        return {
+            "ref_block_num": random.randrange(65536),
+            "ref_block_prefix": random.randrange(2 ** 32),
+            "expiration": (datetime.datetime.utcnow() + datetime.timedelta(seconds=30)).strftime("%Y-%m-%dT%H:%M:%S"),
+            "operations": operations,
+            "extensions": [],
+            "signatures": [hashlib.sha256(os.urandom(32)).hexdigest() * 2],
+        }
+
+
+class _WalletError(Exception):
+    def __init__(self, error: dict):
+        super().__init__(error["message"])
+        self.error = error
+
+
+class _RpcHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wallet = None
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            req = json.loads(body)
+        except ValueError:
+            self.send_error(400)
+            return
+
+        if isinstance(req, list):
+            if not self.wallet.accepts_batch():
+                self.send_response(500)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            response = [self.wallet.handle(r) for r in req]
+        else:
+            response = self.wallet.handle(req)
+
+        data = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _env(name: str, default: str) -> str:
+    return os.environ.get("FAKE_WALLET_" + name, default)
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fake cli_wallet JSON-RPC server for benchmarks")
+    # The real cli_wallet's options, only -H is used
+    parser.add_argument("-s", "--server-rpc-endpoint", default="")
+    parser.add_argument("--chain-id", default="")
+    parser.add_argument("-H", "--rpc-http-endpoint", default="127.0.0.1:5071")
+    parser.add_argument("-w", "--wallet-file", default="")
+
+    parser.add_argument("--latency-ms", type=float, default=float(_env("LATENCY_MS", "5")))
+    parser.add_argument("--jitter-ms", type=float, default=float(_env("JITTER_MS", "0")))
+    parser.add_argument("--broadcast-latency-ms", type=float, default=float(_env("BROADCAST_LATENCY_MS", "20")))
+    parser.add_argument("--lock-rate", type=float, default=float(_env("LOCK_RATE", "0")))
+    parser.add_argument("--invalid-state-rate", type=float, default=float(_env("INVALID_STATE_RATE", "0")))
+    parser.add_argument("--taken-rate", type=float, default=float(_env("TAKEN_RATE", "0")))
+    parser.add_argument("--bad-key-rate", type=float, default=float(_env("BAD_KEY_RATE", "0")))
+    parser.add_argument("--password", default=_env("PASSWORD", ""))
+    parser.add_argument("--accounts", default=_env("ACCOUNTS", "registration-faucet"))
+    parser.add_argument("--balance", type=int, default=int(_env("BALANCE", "100000000000")))
+    parser.add_argument("--account-fee", type=int, default=int(_env("ACCOUNT_FEE", "50000")))
+    parser.add_argument("--accept-batch", action="store_true", default=_env("ACCEPT_BATCH", "0") == "1")
+    return parser.parse_args(argv)
+
+
+def main(argv: list):
+    options = parse_args(argv)
+    host, port = options.rpc_http_endpoint.rsplit(":", 1)
+
+    _RpcHandler.wallet = FakeWallet(options)
+    server = http.server.ThreadingHTTPServer((host, int(port)), _RpcHandler)
+    server.daemon_threads = True
+
+    # The wallet supervisor waits for this line on stderr
+    print(SUCCESSFULLY_STARTED_MESSAGE, file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the reCAPTCHA siteverify endpoint for benchmarks. Answers every POST with a successful verification
+after --latency-ms (plus up to --jitter-ms), --fail-rate of them are answered as failed instead.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import http.server
+import urllib.parse
+
+
+class _SiteverifyHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    options = None
+
+    def do_POST(self):
+        form = urllib.parse.parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+        time.sleep((self.options.latency_ms + random.uniform(0, self.options.jitter_ms)) / 1000)
+
+        if "response" not in form or random.random() < self.options.fail_rate:
+            content = {"success": False, "error-codes": ["invalid-input-response"]}
+        else:
+            content = {"success": True,
+                       "challenge_ts": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                       "hostname": "localhost"}
+
+        data = json.dumps(content).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fake reCAPTCHA siteverify server for benchmarks")
+    parser.add_argument("--bind", default="127.0.0.1:5081")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--fail-rate", type=float, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv: list):
+    options = parse_args(argv)
+    host, port = options.bind.rsplit(":", 1)
+
+    _SiteverifyHandler.options = options
+    server = http.server.ThreadingHTTPServer((host, int(port)), _SiteverifyHandler)
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Load driver for the registrar. For every worker configuration it starts gunicorn with registrar_wsgi:app against
+fake_cli_wallet.py and fake_siteverify.py, sends POST /wallet/register_account and GET /wallet/suggest_brain_key
+from --concurrency client threads for --duration seconds and reports throughput and p50/p95/p99 latency.
+
+The registrar still needs the Postgres database from configs/local_config.yaml. Results can be written with --output
+and compared against an earlier run with --baseline.
+
+    python benchmarks/run_benchmark.py --workers 1,3 --threads 1,4 --duration 30 --output after.json \\
+        --baseline before.json
+"""
+import os
+import sys
+import json
+import time
+import copy
+import math
+import random
+import shutil
+import signal
+import string
+import socket
+import argparse
+import tempfile
+import itertools
+import glob
+import threading
+import subprocess
+import yaml
+import requests
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from fake_cli_wallet import random_public_key  # noqa: E402
+
+REGISTER_ACCOUNT = "register_account"
+SUGGEST_BRAIN_KEY = "suggest_brain_key"
+PERCENTILES = (50, 95, 99)
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the registrar against a fake wallet and reCAPTCHA")
+    parser.add_argument("--workers", default="3", help="comma separated gunicorn worker counts")
+    parser.add_argument("--threads", default="1", help="comma separated gunicorn thread counts per worker")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads")
+    parser.add_argument("--duration", type=float, default=30, help="seconds measured per configuration")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of load before measuring")
+    parser.add_argument("--register-ratio", type=float, default=0.5,
+                        help="share of requests that are registrations, the rest ask for brain keys")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--wallet-instances", default="1", help="comma separated numbers of fake wallets")
+    parser.add_argument("--wallet-port", type=int, default=5071, help="port of the first fake wallet")
+    parser.add_argument("--siteverify-port", type=int, default=5081)
+    parser.add_argument("--siteverify-latency-ms", type=float, default=50)
+    parser.add_argument("--siteverify-fail-rate", type=float, default=0)
+    parser.add_argument("--wallet-latency-ms", type=float, default=5)
+    parser.add_argument("--wallet-jitter-ms", type=float, default=0)
+    parser.add_argument("--wallet-broadcast-latency-ms", type=float, default=20)
+    parser.add_argument("--wallet-lock-rate", type=float, default=0)
+    parser.add_argument("--wallet-invalid-state-rate", type=float, default=0)
+    parser.add_argument("--wallet-taken-rate", type=float, default=0)
+    parser.add_argument("--wallet-bad-key-rate", type=float, default=0)
+    parser.add_argument("--set", action="append", default=[], metavar="SECTION.KEY=VALUE",
+                        help="override a local_config.yaml setting, the value is parsed as YAML")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare against")
+    return parser.parse_args(argv)
+
+
+def benchmark_config(options: argparse.Namespace, work_dir: str, wallet_instances: int) -> dict:
+    with open(os.path.join(REPO_DIR, "configs", "local_config.yaml")) as f:
+        cfg = yaml.safe_load(f)
+
+    cfg["wallet"]["path"] = os.path.join(BENCHMARKS_DIR, "fake_cli_wallet.py")
+    cfg["wallet"]["pid_file"] = os.path.join(work_dir, "wallet.pid")
+    cfg["wallet"]["lock_file"] = os.path.join(work_dir, "wallet.lock")
+    cfg["wallet"]["instances"] = [{"port": options.wallet_port + i,
+                                   "wallet_config_file": os.path.join(work_dir, f"wallet-{i}.json")}
+                                  for i in range(wallet_instances)]
+    cfg["tusc_api"]["tusc_wallet_ip"] = "127.0.0.1"
+    cfg["general"]["captcha_verify_url"] = f"http://127.0.0.1:{options.siteverify_port}/recaptcha/api/siteverify"
+    cfg["general"]["disable_recaptcha"] = False
+    cfg["general"]["disable_ip_blocking"] = True
+
+    for setting in options.set:
+        path, value = setting.split("=", 1)
+        section, key = path.split(".", 1)
+        cfg[section][key] = yaml.safe_load(value)
+    return cfg
+
+
+def wallet_env(options: argparse.Namespace) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "FAKE_WALLET_LATENCY_MS": str(options.wallet_latency_ms),
+        "FAKE_WALLET_JITTER_MS": str(options.wallet_jitter_ms),
+        "FAKE_WALLET_BROADCAST_LATENCY_MS": str(options.wallet_broadcast_latency_ms),
+        "FAKE_WALLET_LOCK_RATE": str(options.wallet_lock_rate),
+        "FAKE_WALLET_INVALID_STATE_RATE": str(options.wallet_invalid_state_rate),
+        "FAKE_WALLET_TAKEN_RATE": str(options.wallet_taken_rate),
+        "FAKE_WALLET_BAD_KEY_RATE": str(options.wallet_bad_key_rate),
+    })
+    return env
+
+
+class Registrar:
+    """gunicorn serving registrar_wsgi:app from a scratch directory with its own local_config.yaml."""
+
+    def __init__(self, options: argparse.Namespace, workers: int, threads: int, wallet_instances: int):
+        self._options = options
+        self._workers = workers
+        self._threads = threads
+        self._wallet_instances = wallet_instances
+        self._work_dir = None
+        self._proc = None
+        self._cfg = None
+
+    def __enter__(self):
+        self._work_dir = tempfile.mkdtemp(prefix="registrar-benchmark-")
+        os.makedirs(os.path.join(self._work_dir, "configs"))
+        os.makedirs(os.path.join(self._work_dir, "registrar"))
+        self._cfg = benchmark_config(self._options, self._work_dir, self._wallet_instances)
+        with open(os.path.join(self._work_dir, "configs", "local_config.yaml"), 'w') as f:
+            yaml.safe_dump(self._cfg, f)
+
+        self._proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn",
+             "--workers", str(self._workers),
+             "--threads", str(self._threads),
+             "--bind", f"127.0.0.1:{self._options.port}",
+             "--pythonpath", REPO_DIR,
+             "registrar_wsgi:app"],
+            cwd=self._work_dir,
+            env=wallet_env(self._options),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+        wait_for_port(self._options.port, 30, self._proc)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._proc.send_signal(signal.SIGTERM)
+        try:
+            self._proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+
+        # The wallets were started by the workers and outlive them, every instance has its own pid file
+        for path in glob.glob(os.path.join(self._work_dir, "wallet-*.pid")):
+            try:
+                with open(path) as pid_file:
+                    os.kill(int(pid_file.read().strip()), signal.SIGTERM)
+            except (OSError, ValueError):
+                pass
+        shutil.rmtree(self._work_dir, ignore_errors=True)
+        return False
+
+
+def wait_for_port(port: int, timeout: float, proc: subprocess.Popen = None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"Process exited with code {proc.returncode} before listening on port {port}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Nothing is listening on port {port} after {timeout} seconds")
+
+
+def random_account_name() -> str:
+    return "bench-" + "".join(random.choice(string.ascii_lowercase) for x in range(12))
+
+
+def random_ip() -> str:
+    return ".".join(str(random.randrange(1, 255)) for x in range(4))
+
+
+def send_request(session: requests.Session, base_url: str, endpoint: str) -> bool:
+    """Sends one request, returns whether it got a result."""
+    headers = {"X-Real-IP": random_ip()}
+    if endpoint == REGISTER_ACCOUNT:
+        r = session.post(base_url + "/wallet/register_account", headers=headers, timeout=60, json={
+            "account_name": random_account_name(),
+            "public_key": random_public_key(),
+            "recaptcha_response": "benchmark-" + os.urandom(16).hex(),
+        })
+    else:
+        r = session.get(base_url + "/wallet/suggest_brain_key", headers=headers, timeout=60)
+
+    if r.status_code != 200:
+        return False
+    try:
+        return "result" in r.json()
+    except ValueError:
+        return False
+
+
+def client(options: argparse.Namespace, measure_from: float, stop_at: float, samples: list, samples_lock):
+    base_url = f"http://127.0.0.1:{options.port}"
+    session = requests.Session()
+    own_samples = []
+    while True:
+        started = time.monotonic()
+        if started >= stop_at:
+            break
+        endpoint = REGISTER_ACCOUNT if random.random() < options.register_ratio else SUGGEST_BRAIN_KEY
+        try:
+            ok = send_request(session, base_url, endpoint)
+        except requests.RequestException:
+            ok = False
+        if started >= measure_from:
+            own_samples.append((endpoint, time.monotonic() - started, ok))
+
+    with samples_lock:
+        samples.extend(own_samples)
+
+
+def run_load(options: argparse.Namespace) -> list:
+    samples = []
+    samples_lock = threading.Lock()
+    measure_from = time.monotonic() + options.warmup
+    stop_at = measure_from + options.duration
+    threads = [threading.Thread(target=client, args=(options, measure_from, stop_at, samples, samples_lock))
+               for x in range(options.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    # Nearest rank
+    if len(sorted_values) == 0:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(samples: list, duration: float) -> dict:
+    summary = {}
+    for endpoint in (REGISTER_ACCOUNT, SUGGEST_BRAIN_KEY):
+        latencies = sorted(latency for e, latency, ok in samples if e == endpoint)
+        summary[endpoint] = {
+            "requests": len(latencies),
+            "errors": sum(1 for e, latency, ok in samples if e == endpoint and not ok),
+            "throughput": len(latencies) / duration,
+        }
+        for p in PERCENTILES:
+            summary[endpoint][f"p{p}_ms"] = percentile(latencies, p) * 1000
+    return summary
+
+
+def config_name(workers: int, threads: int, wallet_instances: int) -> str:
+    name = f"workers={workers} threads={threads}"
+    if wallet_instances > 1:
+        name += f" wallets={wallet_instances}"
+    return name
+
+
+def print_results(results: dict, baseline: dict):
+    header = f"{'configuration':<32}{'endpoint':<20}{'requests':>9}{'errors':>8}{'req/s':>9}" + \
+             "".join(f"{'p' + str(p) + ' ms':>10}" for p in PERCENTILES)
+    print(header)
+    print("-" * len(header))
+    for name, summary in results.items():
+        for endpoint, stats in summary.items():
+            line = f"{name:<32}{endpoint:<20}{stats['requests']:>9}{stats['errors']:>8}{stats['throughput']:>9.1f}" + \
+                   "".join(f"{stats[f'p{p}_ms']:>10.1f}" for p in PERCENTILES)
+            print(line)
+
+            base = baseline.get(name, {}).get(endpoint)
+            if base is not None and base["requests"] > 0:
+                print(f"{'':<32}{'vs baseline':<20}{'':>9}{'':>8}{_change(stats['throughput'], base['throughput']):>9}" +
+                      "".join(f"{_change(stats[f'p{p}_ms'], base[f'p{p}_ms']):>10}" for p in PERCENTILES))
+
+
+def _change(value: float, base: float) -> str:
+    if base == 0:
+        return "-"
+    return f"{(value - base) / base * 100:+.0f}%"
+
+
+def main(argv: list):
+    options = parse_args(argv)
+    baseline = {}
+    if options.baseline is not None:
+        with open(options.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    siteverify = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS_DIR, "fake_siteverify.py"),
+                                   "--bind", f"127.0.0.1:{options.siteverify_port}",
+                                   "--latency-ms", str(options.siteverify_latency_ms),
+                                   "--fail-rate", str(options.siteverify_fail_rate)])
+    results = {}
+    try:
+        wait_for_port(options.siteverify_port, 10, siteverify)
+        for workers, threads, wallet_instances in itertools.product(
+                [int(w) for w in options.workers.split(",")],
+                [int(t) for t in options.threads.split(",")],
+                [int(n) for n in options.wallet_instances.split(",")]):
+            name = config_name(workers, threads, wallet_instances)
+            print(f"Running {name} for {options.duration:g}s", file=sys.stderr)
+            with Registrar(options, workers, threads, wallet_instances):
+                results[name] = summarize(run_load(options), options.duration)
+    finally:
+        siteverify.terminate()
+        siteverify.wait()
+
+    print_results(results, baseline)
+    if options.output is not None:
+        run_options = copy.copy(vars(options))
+        run_options.pop("baseline")
+        run_options.pop("output")
+        with open(options.output, 'w') as f:
+            json.dump({"options": run_options, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,162 @@
+import logging
+import json
+import datetime
+import functools
+import typing
+import asyncpg
+import db_access.db as db
+from tusc_api import registration_export
+from config import cfg
+import metrics
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+db_cfg = cfg["db"]
+general_cfg = cfg["general"]
+
+# asyncpg versions of the queries the ASGI app runs on the request path, see db.py for the rest
+pool = None
+
+
+def _timed(func):
+    @functools.wraps(func)
+    async def timed(*args, **kwargs):
+        with metrics.db_seconds.time(func.__name__):
+            return await func(*args, **kwargs)
+    return timed
+
+
+async def initiate_database_connection():
+    global pool
+    try:
+        pool = await asyncpg.create_pool(host=db_cfg["host"],
+                                         port=db_cfg["port"],
+                                         user=db_cfg["user"],
+                                         password=db_cfg["password"],
+                                         database=db_cfg["database"],
+                                         min_size=db_cfg["min_connections"],
+                                         max_size=db_cfg["max_connections"],
+                                         timeout=db_cfg["connect_timeout_seconds"])
+    except:
+        raise Exception("No DB connection could be established. Exiting")
+
+
+async def close_database_connection():
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+
+def get_database_connection():
+    return pool.acquire(timeout=db_cfg["acquire_timeout_seconds"])
+
+
+@_timed
+async def get_stats() -> dict:
+    try:
+        async with get_database_connection() as conn:
+            day_rows = await conn.fetch("select registration_date, sum(registration_count) as reg_count "
+                                        "from tusc_registration_daily_counts "
+                                        "where registration_date > (now() at time zone 'utc')::date - $1::int "
+                                        "group by registration_date order by registration_date",
+                                        general_cfg["stats_days"])
+            referrer_rows = await conn.fetch("select referrer, sum(registration_count) as reg_count "
+                                             "from tusc_registration_daily_counts "
+                                             "group by referrer order by referrer")
+    except:
+        logger.exception('Failed to get registration stats')
+        return {}
+
+    return db.format_stats(day_rows, referrer_rows)
+
+
+# Returns True if the registration was saved, False if it was already saved before (or could not be saved)
+@_timed
+async def save_completed_registration(tusc_account_name: str,
+                                      tusc_public_key: str,
+                                      referrer: str = "") -> bool:
+    try:
+        async with get_database_connection() as conn:
+            row = await conn.fetchrow("insert into tusc_account_registrations "
+                                      "(tusc_account_name, tusc_public_key, referrer) "
+                                      "values ($1, $2, $3) "
+                                      "on conflict (tusc_account_name) do nothing "
+                                      "returning id",
+                                      tusc_account_name, tusc_public_key, referrer)
+    except:
+        logger.exception('Failed save_completed_registration: tusc_account_name = %s, tusc_public_key = %s',
+                         tusc_account_name, tusc_public_key)
+        return False
+
+    return row is not None
+
+
+# Registration jobs, see db.enqueue_registration_job and db.get_registration_job. These raise on failure.
+@_timed
+async def enqueue_registration_job(job_id: str,
+                                   account_name: str,
+                                   public_key: str,
+                                   referrer: str,
+                                   ip_address: str,
+                                   rate_limit_reservations: list,
+                                   max_queued: int) -> bool:
+    async with get_database_connection() as conn:
+        row = await conn.fetchrow("insert into tusc_registration_jobs "
+                                  "(id, account_name, public_key, referrer, ip_address, rate_limit_reservations) "
+                                  "select $1, $2, $3, $4, $5, $6::jsonb "
+                                  "where (select count(*) from tusc_registration_jobs where status = 'queued') < $7 "
+                                  "returning id",
+                                  job_id, account_name, public_key, referrer, ip_address,
+                                  json.dumps(rate_limit_reservations), max_queued)
+    return row is not None
+
+
+@_timed
+async def get_registration_job(job_id: str) -> typing.Optional[dict]:
+    async with get_database_connection() as conn:
+        row = await conn.fetchrow("select id, status, response from tusc_registration_jobs where id = $1", job_id)
+    if row is None:
+        return None
+
+    job = dict(row)
+    # asyncpg returns jsonb as text unless a codec is set up
+    if isinstance(job['response'], str):
+        job['response'] = json.loads(job['response'])
+    return job
+
+
+# See db.get_registrations_page, raises on failure
+@_timed
+async def get_registrations_page(created_from: typing.Optional[datetime.datetime],
+                                 created_to: typing.Optional[datetime.datetime],
+                                 after: typing.Optional[typing.Tuple[datetime.datetime, int]],
+                                 limit: int) -> list:
+    after_created_at, after_id = after if after is not None else (None, None)
+    async with get_database_connection() as conn:
+        return await conn.fetch("select id, tusc_account_name, tusc_public_key, referrer, created_at "
+                                "from tusc_account_registrations "
+                                "where created_at >= coalesce($1::timestamp, '-infinity') "
+                                "and created_at < coalesce($2::timestamp, 'infinity') "
+                                "and (created_at, id) > (coalesce($3::timestamp, '-infinity'), coalesce($4::int, 0)) "
+                                "order by created_at, id "
+                                "limit $5",
+                                created_from, created_to, after_created_at, after_id, limit)
+
+
+# See db.iter_registration_pages
+async def iter_registration_pages(created_from: typing.Optional[datetime.datetime],
+                                  created_to: typing.Optional[datetime.datetime],
+                                  batch_size: int) -> typing.AsyncIterator[list]:
+    after = None
+    while True:
+        rows = await get_registrations_page(created_from, created_to, after, batch_size)
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        after = registration_export.next_after(rows)
+
+
+logger.debug('loaded')
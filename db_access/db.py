@@ -1,8 +1,16 @@
 import logging
+import datetime
+import functools
+import threading
+import typing
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
 import psycopg2.errors
+from db_access.pool import ConnectionPool
+from tusc_api import registration_export
 from config import cfg
+import metrics
 
 logger = logging.getLogger('root')
 logger.debug('loading')
@@ -10,39 +18,73 @@ logger.debug('loading')
 db_cfg = cfg["db"]
 general_cfg = cfg["general"]
 
-global_conn = None
+pool = None
+pool_lock = threading.Lock()
+
+dsn = psycopg2.extensions.make_dsn(
+    dbname=db_cfg["database"],
+    user=db_cfg["user"],
+    host=db_cfg["host"],
+    password=db_cfg["password"],
+    port=db_cfg["port"],
+    connect_timeout=db_cfg["connect_timeout_seconds"])
+
+
+# Records how long the decorated database operation took, under its function name
+def _timed(func):
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        with metrics.db_seconds.time(func.__name__):
+            return func(*args, **kwargs)
+    return timed
 
 
 def initiate_database_connection():
-    get_database_connection()
+    get_connection_pool()
 
 
-def get_database_connection():
-    global global_conn
-    constring = "dbname='{}' user='{}' host='{}' password='{}'".format(
-        db_cfg["database"], db_cfg["user"], db_cfg["host"], db_cfg["password"])
+def get_connection_pool() -> ConnectionPool:
+    global pool
+    if pool is not None:
+        return pool
+
+    with pool_lock:
+        if pool is None:
+            try:
+                pool = ConnectionPool(dsn,
+                                      db_cfg["min_connections"],
+                                      db_cfg["max_connections"],
+                                      db_cfg["acquire_timeout_seconds"],
+                                      db_cfg["validation_interval_seconds"])
+            except:
+                raise Exception("No DB connection could be established. Exiting")
+    return pool
 
-    if global_conn is None:
-        try:
-            global_conn = psycopg2.connect(constring)
-            logger.debug('DB Connection established')
-            return global_conn
-        except:
-            raise Exception("No DB connection could be established. Exiting")
-    else:
-        return global_conn
+
+def get_pool_stats() -> dict:
+    if pool is None:
+        return {}
+    return pool.stats()
+
+
+# Checks a connection out of the pool for the duration of a with block:
+#     with get_database_connection() as conn:
+def get_database_connection():
+    return get_connection_pool().connection()
 
 
+@_timed
 def get_account_registration_count() -> int:
-    conn = get_database_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     try:
-        cur.execute("""select count(*) as reg_count from tusc_account_registrations""")
+        with get_database_connection() as conn:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            # tusc_registration_daily_counts is kept up to date by a trigger, see 0003-registration-stats.sql
+            cur.execute("""select sum(registration_count) as reg_count from tusc_registration_daily_counts""")
+            rows = cur.fetchall()
     except:
         logger.exception('Failed get_account_registration_count')
         return 0
 
-    rows = cur.fetchall()
     if len(rows) < 1:
         return 0
 
@@ -51,77 +93,221 @@ def get_account_registration_count() -> int:
 
     return int(rows[0]['reg_count'])
 
-# TODO
-# def get_stats() -> dict:
-#     conn = get_database_connection()
-#     cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-#     try:
-#         cur.execute("select sum(CAST(occ_amount AS NUMERIC)) as occ_swapped, "
-#                     "sum(CAST(tusc_amount AS NUMERIC)) as tusc_swapped from transfers")
-#     except:
-#         logger.exception('Failed to get swap stats')
-#         return {}
-#
-#     rows = cur.fetchall()
-#
-#     occ_swapped = 0
-#     tusc_swapped = 0
-#
-#     number_of_registrations = get_account_registration_count()
-#
-#     if len(rows) < 1:
-#         return {"occ_swapped": str(occ_swapped),
-#                 "tusc_swapped": str(tusc_swapped),
-#                 "occ_left_to_swap": format(Decimal(general_cfg["maximum_occ"]), 'f'),
-#                 "end_of_swap_date": str(general_cfg["shut_off_date"]),
-#                 "number_of_registrations": str(number_of_registrations)
-#                 }
-#
-#     if rows[0]["occ_swapped"] is not None:
-#         occ_swapped = rows[0]["occ_swapped"]
-#
-#     if rows[0]["tusc_swapped"] is not None:
-#         tusc_swapped = rows[0]["tusc_swapped"]
-#
-#     occ_left_to_swap = Decimal(general_cfg["maximum_occ"]) - occ_swapped
-#
-#     return {
-#         "occ_swapped": str(occ_swapped),
-#         "tusc_swapped": str(tusc_swapped),
-#         "occ_left_to_swap": format(occ_left_to_swap, 'f'),
-#         "end_of_swap_date": str(general_cfg["shut_off_date"]),
-#         "number_of_registrations": str(number_of_registrations)
-#     }
 
-
-def save_completed_registration(tusc_account_name: str,
-                                tusc_public_key: str,):
-    conn = get_database_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+@_timed
+def get_stats() -> dict:
     try:
-        cur.execute("select * from tusc_account_registrations "
-                    "where tusc_account_name='" + tusc_account_name + "';")
+        with get_database_connection() as conn:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cur.execute("select registration_date, sum(registration_count) as reg_count "
+                        "from tusc_registration_daily_counts "
+                        "where registration_date > (now() at time zone 'utc')::date - %s "
+                        "group by registration_date order by registration_date",
+                        (general_cfg["stats_days"],))
+            day_rows = cur.fetchall()
+
+            cur.execute("select referrer, sum(registration_count) as reg_count "
+                        "from tusc_registration_daily_counts "
+                        "group by referrer order by referrer")
+            referrer_rows = cur.fetchall()
     except:
-        logger.exception('Failed to get swap stats')
+        logger.exception('Failed to get registration stats')
         return {}
 
-    rows = cur.fetchall()
-    if len(rows) < 1: # account registration does not exist
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    return format_stats(day_rows, referrer_rows)
+
+
+# Shared with async_db, rows only need to support row['column']
+def format_stats(day_rows: list, referrer_rows: list) -> dict:
+    number_of_registrations = sum(int(row['reg_count']) for row in referrer_rows)
 
-        q = "insert into tusc_account_registrations (tusc_account_name, tusc_public_key) " \
-            "values ('{}','{}');".\
-            format(tusc_account_name, tusc_public_key)
+    return {
+        "number_of_registrations": str(number_of_registrations),
+        "registrations_per_day": {str(row['registration_date']): str(row['reg_count']) for row in day_rows},
+        "registrations_per_referrer": {row['referrer']: str(row['reg_count']) for row in referrer_rows}
+    }
 
-        try:
-            cur.execute(q)
+
+# Returns True if the registration was saved, False if it was already saved before (or could not be saved)
+@_timed
+def save_completed_registration(tusc_account_name: str,
+                                tusc_public_key: str,
+                                referrer: str = "") -> bool:
+    try:
+        with get_database_connection() as conn:
+            cur = conn.cursor()
+            # Relies on the unique index on tusc_account_name from 0002-registration-indexes.sql
+            cur.execute("insert into tusc_account_registrations (tusc_account_name, tusc_public_key, referrer) "
+                        "values (%s, %s, %s) "
+                        "on conflict (tusc_account_name) do nothing "
+                        "returning id",
+                        (tusc_account_name, tusc_public_key, referrer))
+            inserted = cur.fetchone() is not None
             conn.commit()
-        except:
-            logger.exception('Failed save_completed_registration: tusc_account_name = ' + tusc_account_name +
-                             ', tusc_public_key = ' + tusc_public_key)
+    except:
+        logger.exception('Failed save_completed_registration: tusc_account_name = %s, tusc_public_key = %s',
+                         tusc_account_name, tusc_public_key)
+        return False
+
+    return inserted
+
+
+# Saves many registrations in one round trip, rows are (tusc_account_name, tusc_public_key, referrer) tuples. Unlike
+# save_completed_registration this raises on failure so callers can retry.
+@_timed
+def save_completed_registrations(rows: list):
+    with get_database_connection() as conn:
+        cur = conn.cursor()
+        psycopg2.extras.execute_values(
+            cur,
+            "insert into tusc_account_registrations (tusc_account_name, tusc_public_key, referrer) "
+            "values %s "
+            "on conflict (tusc_account_name) do nothing",
+            rows)
+        conn.commit()
+
+
+# Streams every registered name through a server-side cursor so the whole table is never held in memory
+def iter_registered_account_names(batch_size: int = 10000) -> typing.Iterator[str]:
+    with get_database_connection() as conn:
+        cur = conn.cursor(name="registered_account_names")
+        cur.itersize = batch_size
+        cur.execute("select tusc_account_name from tusc_account_registrations")
+        for row in cur:
+            yield row[0]
+        cur.close()
+        conn.commit()
+
+
+# Keyset pagination over the (created_at, id) index from 0006-registration-export-index.sql, which also makes
+# created_at not null so no row is skipped. Returns up to limit (id, tusc_account_name, tusc_public_key, referrer,
+# created_at) rows created in [created_from, created_to) that come after the (created_at, id) pair after, in that
+# order. Any of the bounds may be None. Raises on failure.
+@_timed
+def get_registrations_page(created_from: typing.Optional[datetime.datetime],
+                           created_to: typing.Optional[datetime.datetime],
+                           after: typing.Optional[typing.Tuple[datetime.datetime, int]],
+                           limit: int) -> list:
+    after_created_at, after_id = after if after is not None else (None, None)
+    with get_database_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("select id, tusc_account_name, tusc_public_key, referrer, created_at "
+                    "from tusc_account_registrations "
+                    "where created_at >= coalesce(%s::timestamp, '-infinity') "
+                    "and created_at < coalesce(%s::timestamp, 'infinity') "
+                    "and (created_at, id) > (coalesce(%s::timestamp, '-infinity'), coalesce(%s::int, 0)) "
+                    "order by created_at, id "
+                    "limit %s",
+                    (created_from, created_to, after_created_at, after_id, limit))
+        rows = cur.fetchall()
+        conn.commit()
+    return rows
+
+
+# Pages through the registrations in [created_from, created_to) for exports. Every page is its own short transaction
+# on a connection that goes back to the pool in between, so an export of any size neither holds more than one page in
+# memory nor keeps a snapshot open that would hold back vacuum while registrations are inserted.
+def iter_registration_pages(created_from: typing.Optional[datetime.datetime],
+                            created_to: typing.Optional[datetime.datetime],
+                            batch_size: int) -> typing.Iterator[list]:
+    after = None
+    while True:
+        rows = get_registrations_page(created_from, created_to, after, batch_size)
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
             return
+        after = registration_export.next_after(rows)
+
+
+# Registration jobs, see 0005-registration-jobs.sql. These raise on failure, callers decide how to report it.
+
+# Returns False without queueing the job when max_queued jobs are already waiting. rate_limit_reservations are the
+# reservations the job releases if it fails, see rate_limiter.Reservation.
+@_timed
+def enqueue_registration_job(job_id: str,
+                             account_name: str,
+                             public_key: str,
+                             referrer: str,
+                             ip_address: str,
+                             rate_limit_reservations: list,
+                             max_queued: int) -> bool:
+    with get_database_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("insert into tusc_registration_jobs "
+                    "(id, account_name, public_key, referrer, ip_address, rate_limit_reservations) "
+                    "select %s, %s, %s, %s, %s, %s "
+                    "where (select count(*) from tusc_registration_jobs where status = 'queued') < %s "
+                    "returning id",
+                    (job_id, account_name, public_key, referrer, ip_address,
+                     psycopg2.extras.Json(rate_limit_reservations), max_queued))
+        inserted = cur.fetchone() is not None
+        conn.commit()
+    return inserted
+
+
+# Marks the oldest queued job as running and returns it, skip locked lets every worker claim jobs concurrently
+@_timed
+def claim_registration_job() -> typing.Optional[dict]:
+    with get_database_connection() as conn:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute("update tusc_registration_jobs set status = 'running', updated_at = (now() at time zone 'utc') "
+                    "where id = (select id from tusc_registration_jobs where status = 'queued' "
+                    "            order by created_at for update skip locked limit 1) "
+                    "returning id, account_name, public_key, referrer, ip_address, rate_limit_reservations")
+        row = cur.fetchone()
+        conn.commit()
+    return dict(row) if row is not None else None
+
+
+@_timed
+def finish_registration_job(job_id: str, status: str, response: dict):
+    with get_database_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("update tusc_registration_jobs "
+                    "set status = %s, response = %s, updated_at = (now() at time zone 'utc') "
+                    "where id = %s",
+                    (status, psycopg2.extras.Json(response), job_id))
+        conn.commit()
+
+
+@_timed
+def get_registration_job(job_id: str) -> typing.Optional[dict]:
+    with get_database_connection() as conn:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute("select id, status, response from tusc_registration_jobs where id = %s", (job_id,))
+        row = cur.fetchone()
+        conn.commit()
+    return dict(row) if row is not None else None
+
+
+# Fails jobs left running by a worker that died and deletes finished jobs older than retention_hours. Returns the
+# failed jobs so their rate limit reservations can be released.
+@_timed
+def expire_registration_jobs(stale_seconds: float, retention_hours: float, response: dict) -> typing.List[dict]:
+    with get_database_connection() as conn:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute("update tusc_registration_jobs "
+                    "set status = 'failed', response = %s, updated_at = (now() at time zone 'utc') "
+                    "where status = 'running' "
+                    "and updated_at < (now() at time zone 'utc') - make_interval(secs => %s) "
+                    "returning id, account_name, public_key, referrer, ip_address, rate_limit_reservations",
+                    (psycopg2.extras.Json(response), stale_seconds))
+        rows = cur.fetchall()
+        cur.execute("delete from tusc_registration_jobs "
+                    "where status in ('succeeded', 'failed') "
+                    "and updated_at < (now() at time zone 'utc') - make_interval(hours => %s)",
+                    (int(retention_hours),))
+        conn.commit()
+    return [dict(row) for row in rows]
+
 
-    return
+metrics.registry.gauge("tusc_db_pool_open_connections", "Open database connections of the worker",
+                       lambda: get_pool_stats().get("open_connections", 0))
+metrics.registry.gauge("tusc_db_pool_idle_connections", "Idle database connections of the worker",
+                       lambda: get_pool_stats().get("idle_connections", 0))
+metrics.registry.gauge("tusc_db_pool_acquire_timeouts", "Times the worker timed out waiting for a connection",
+                       lambda: get_pool_stats().get("acquire_timeouts", 0))
 
 
 logger.debug('loaded')
@@ -0,0 +1,168 @@
+import time
+import logging
+import threading
+import contextlib
+import collections
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    At most max_connections are open at once, callers wait up to acquire_timeout for one to be checked back in.
+    Idle connections that have not been used for validation_interval seconds are checked with a `select 1` before
+    being handed out, dead ones are replaced with a fresh connection.
+    """
+
+    def __init__(self,
+                 dsn: str,
+                 min_connections: int,
+                 max_connections: int,
+                 acquire_timeout: float,
+                 validation_interval: float):
+        self._dsn = dsn
+        self._max_connections = max_connections
+        self._acquire_timeout = acquire_timeout
+        self._validation_interval = validation_interval
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        # (connection, time it was checked in)
+        self._idle = collections.deque()
+        self._open_connections = 0
+
+        self._acquire_count = 0
+        self._acquire_timeouts = 0
+        self._acquire_wait_total = 0.0
+        self._acquire_wait_max = 0.0
+        self._reconnects = 0
+
+        for x in range(min_connections):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # The connection itself is broken, make sure it never goes back into the pool
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard)
+
+    def getconn(self) -> psycopg2.extensions.connection:
+        started = time.monotonic()
+        acquired = self._slots.acquire(timeout=self._acquire_timeout)
+        waited = time.monotonic() - started
+
+        with self._lock:
+            self._acquire_count += 1
+            self._acquire_wait_total += waited
+            self._acquire_wait_max = max(self._acquire_wait_max, waited)
+            if not acquired:
+                self._acquire_timeouts += 1
+
+        if not acquired:
+            logger.error("Timed out after %.3fs waiting for a DB connection", waited)
+            raise PoolTimeoutError("Timed out waiting for a DB connection")
+
+        try:
+            return self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn: psycopg2.extensions.connection, discard=False):
+        try:
+            if not discard and not conn.closed:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+                return
+
+            self._close(conn)
+        except psycopg2.Error:
+            logger.exception('Failed to return DB connection to the pool')
+            self._close(conn)
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_connections": self._max_connections,
+                "open_connections": self._open_connections,
+                "idle_connections": len(self._idle),
+                "acquire_count": self._acquire_count,
+                "acquire_timeouts": self._acquire_timeouts,
+                "acquire_wait_total_seconds": self._acquire_wait_total,
+                "acquire_wait_max_seconds": self._acquire_wait_max,
+                "reconnects": self._reconnects,
+            }
+
+    def _checkout(self) -> psycopg2.extensions.connection:
+        while True:
+            with self._lock:
+                if len(self._idle) == 0:
+                    break
+                conn, checked_in = self._idle.pop()
+
+            if self._is_alive(conn, checked_in):
+                return conn
+
+            logger.warning('Discarding dead DB connection')
+            self._close(conn)
+            with self._lock:
+                self._reconnects += 1
+
+        return self._connect()
+
+    def _is_alive(self, conn: psycopg2.extensions.connection, checked_in: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - checked_in < self._validation_interval:
+            return True
+
+        try:
+            cur = conn.cursor()
+            cur.execute("select 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _connect(self) -> psycopg2.extensions.connection:
+        try:
+            conn = psycopg2.connect(self._dsn)
+        except psycopg2.Error as e:
+            logger.error("Failed to open DB connection: %s", e)
+            raise
+
+        with self._lock:
+            self._open_connections += 1
+        logger.debug('DB Connection established')
+        return conn
+
+    def _close(self, conn: psycopg2.extensions.connection):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._lock:
+            self._open_connections -= 1
+
+
+logger.debug('loaded')
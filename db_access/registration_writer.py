@@ -0,0 +1,210 @@
+import os
+import glob
+import json
+import time
+import fcntl
+import queue
+import logging
+import threading
+import typing
+import db_access.db as db
+from config import cfg
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+db_cfg = cfg["db"]
+
+SPOOL_FILE_PATTERN = "registrations-*.jsonl"
+
+
+class RegistrationWriter:
+    """
+    Write-behind persistence for completed registrations.
+
+    submit() appends the registration to this process's spool file and puts it on a bounded queue, a background
+    thread writes the queue to Postgres in batches and retries with backoff while the database is unavailable. The
+    spool is truncated once everything in it has been saved. Spool files left behind by processes that died (their
+    lock is released) are replayed by whichever process finds them first. Inserts ignore names that are already
+    saved, so replaying a registration twice is harmless.
+    """
+
+    def __init__(self,
+                 spool_dir: str,
+                 queue_size: int,
+                 batch_size: int,
+                 flush_interval: float,
+                 max_retry_backoff: float,
+                 fsync: bool):
+        self._spool_dir = spool_dir
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_retry_backoff = max_retry_backoff
+        self._fsync = fsync
+
+        os.makedirs(spool_dir, exist_ok=True)
+        self._spool_path = os.path.join(spool_dir, SPOOL_FILE_PATTERN.replace("*", str(os.getpid())))
+        self._spool_file = open(self._spool_path, 'a')
+        fcntl.flock(self._spool_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._spool_lock = threading.Lock()
+        # Set when a record made it into the spool but not onto the queue, the flusher then reloads the spool. A
+        # leftover spool from an earlier process with the same pid is handled the same way.
+        self._overflowed = self._spool_file.tell() > 0
+        self._next_orphan_scan = 0.0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, tusc_account_name: str, tusc_public_key: str, referrer: str):
+        record = (tusc_account_name, tusc_public_key, referrer)
+        with self._spool_lock:
+            self._spool_file.write(json.dumps(record) + "\n")
+            self._spool_file.flush()
+            if self._fsync:
+                os.fsync(self._spool_file.fileno())
+
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                logger.warning("Registration write-behind queue is full, the flusher will reload the spool")
+                self._overflowed = True
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            try:
+                self._replay_orphaned_spools()
+                batch = self._collect_batch()
+                if len(batch) > 0:
+                    self._save_with_retry(batch)
+                self._truncate_spool_if_saved()
+            except Exception:
+                logger.exception("Registration write-behind flusher failed")
+                time.sleep(self._flush_interval)
+
+    def _collect_batch(self) -> list:
+        with self._spool_lock:
+            if self._overflowed:
+                # Everything still queued is in the spool too, so reload the whole spool instead
+                self._overflowed = False
+                self._drain_queue()
+                return _read_spool(self._spool_path)
+
+        try:
+            batch = [self._queue.get(timeout=self._flush_interval)]
+        except queue.Empty:
+            return []
+
+        while len(batch) < self._batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain_queue(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _save_with_retry(self, records: list):
+        backoff = self._flush_interval
+        for start in range(0, len(records), self._batch_size):
+            rows = records[start:start + self._batch_size]
+            while True:
+                try:
+                    db.save_completed_registrations(rows)
+                    logger.debug("Saved %d registrations", len(rows))
+                    backoff = self._flush_interval
+                    break
+                except Exception as e:
+                    logger.error("Failed to save %d registrations, retrying in %ss: %s", len(rows), backoff, e)
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, self._max_retry_backoff)
+
+    def _truncate_spool_if_saved(self):
+        with self._spool_lock:
+            # Anything submitted since the last batch was collected is still queued (or flagged as overflowed)
+            if self._overflowed or not self._queue.empty() or self._spool_file.tell() == 0:
+                return
+            self._spool_file.truncate(0)
+            self._spool_file.seek(0)
+
+    def _replay_orphaned_spools(self):
+        if time.monotonic() < self._next_orphan_scan:
+            return
+        self._next_orphan_scan = time.monotonic() + db_cfg["write_behind_orphan_scan_seconds"]
+
+        for path in glob.glob(os.path.join(self._spool_dir, SPOOL_FILE_PATTERN)):
+            if path == self._spool_path:
+                continue
+
+            with open(path, 'a+') as spool_file:
+                try:
+                    # Only succeeds once the process that owned the spool is gone
+                    fcntl.flock(spool_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+
+                records = _read_spool(path)
+                logger.info("Replaying %d registrations from %s", len(records), path)
+                self._save_with_retry(records)
+                os.remove(path)
+
+
+def _read_spool(path: str) -> typing.List[tuple]:
+    records = []
+    with open(path, 'r') as spool_file:
+        for line in spool_file:
+            try:
+                records.append(tuple(json.loads(line)))
+            except ValueError:
+                # A partial last line from a process that died mid-write
+                logger.warning("Skipping unreadable line in %s", path)
+    return records
+
+
+writer = None
+writer_lock = threading.Lock()
+
+
+def get_writer() -> RegistrationWriter:
+    global writer
+    if writer is not None:
+        return writer
+
+    with writer_lock:
+        if writer is None:
+            writer = RegistrationWriter(os.path.join(os.getcwd(), db_cfg["write_behind_spool_dir"]),
+                                        db_cfg["write_behind_queue_size"],
+                                        db_cfg["write_behind_batch_size"],
+                                        db_cfg["write_behind_flush_interval_seconds"],
+                                        db_cfg["write_behind_max_retry_backoff_seconds"],
+                                        db_cfg["write_behind_fsync"])
+    return writer
+
+
+def initiate_registration_writer():
+    if db_cfg["write_behind_enabled"]:
+        get_writer()
+
+
+def record_completed_registration(tusc_account_name: str, tusc_public_key: str, referrer: str):
+    if not db_cfg["write_behind_enabled"]:
+        db.save_completed_registration(tusc_account_name, tusc_public_key, referrer)
+        return
+
+    try:
+        get_writer().submit(tusc_account_name, tusc_public_key, referrer)
+    except Exception:
+        logger.exception('Failed to spool registration, saving it directly: tusc_account_name = %s, '
+                         'tusc_public_key = %s', tusc_account_name, tusc_public_key)
+        db.save_completed_registration(tusc_account_name, tusc_public_key, referrer)
+
+
+logger.debug('loaded')
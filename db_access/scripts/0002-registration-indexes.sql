@@ -0,0 +1,12 @@
+-- Remove duplicate registrations so the unique index can be built, keeping the earliest row for each name
+delete from tusc_account_registrations a
+    using tusc_account_registrations b
+    where a.tusc_account_name = b.tusc_account_name
+      and a.id > b.id;
+
+-- concurrently so the indexes can be built on a live database without blocking registrations
+create unique index concurrently tusc_account_registrations_name_idx
+    on tusc_account_registrations (tusc_account_name);
+
+create index concurrently tusc_account_registrations_created_at_idx
+    on tusc_account_registrations (created_at);
@@ -0,0 +1,42 @@
+alter table tusc_account_registrations add column referrer text not null default '';
+
+-- Maintained by the trigger below so stats never have to count tusc_account_registrations
+create table tusc_registration_daily_counts (
+    registration_date       date not null,
+    referrer                text not null default '',
+    registration_count      bigint not null default 0,
+    primary key (registration_date, referrer)
+);
+
+create or replace function tusc_registration_daily_counts_update() returns trigger as $$
+begin
+    if (tg_op = 'INSERT') then
+        insert into tusc_registration_daily_counts (registration_date, referrer, registration_count)
+            values (coalesce(new.created_at, now() at time zone 'utc')::date, new.referrer, 1)
+            on conflict (registration_date, referrer)
+            do update set registration_count = tusc_registration_daily_counts.registration_count + 1;
+        return new;
+    elsif (tg_op = 'DELETE') then
+        update tusc_registration_daily_counts
+            set registration_count = registration_count - 1
+            where registration_date = coalesce(old.created_at, now() at time zone 'utc')::date
+              and referrer = old.referrer;
+        return old;
+    end if;
+    return null;
+end;
+$$ language plpgsql;
+
+-- Inserts are blocked until commit so no registration is counted twice or missed by the backfill
+begin;
+lock table tusc_account_registrations in share mode;
+
+create trigger tusc_registration_daily_counts_trigger
+    after insert or delete on tusc_account_registrations
+    for each row execute procedure tusc_registration_daily_counts_update();
+
+insert into tusc_registration_daily_counts (registration_date, referrer, registration_count)
+    select coalesce(created_at, now() at time zone 'utc')::date, referrer, count(*)
+    from tusc_account_registrations
+    group by 1, 2;
+commit;
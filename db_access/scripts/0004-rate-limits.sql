@@ -0,0 +1,12 @@
+-- Only used when general:ip_rate_limiter_backend is "postgres"
+create table tusc_rate_limit_reservations (
+    id                      BIGSERIAL primary key,
+    reservation_key         text not null,
+    expires_at              timestamp without time zone not null
+);
+
+create index tusc_rate_limit_reservations_key_idx
+    on tusc_rate_limit_reservations (reservation_key, expires_at);
+
+create index tusc_rate_limit_reservations_expires_at_idx
+    on tusc_rate_limit_reservations (expires_at);
@@ -0,0 +1,15 @@
+-- Only used when tusc_api:registration_jobs_enabled is set
+create table tusc_registration_jobs (
+    id                      text primary key,
+    status                  text not null default 'queued',
+    account_name            text not null,
+    public_key              text not null,
+    referrer                text not null default '',
+    ip_address              text not null default '',
+    response                jsonb,
+    created_at              timestamp without time zone not null default (now() at time zone 'utc'),
+    updated_at              timestamp without time zone not null default (now() at time zone 'utc')
+);
+
+create index tusc_registration_jobs_status_idx
+    on tusc_registration_jobs (status, created_at);
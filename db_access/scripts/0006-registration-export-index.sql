@@ -0,0 +1,31 @@
+-- Keyset pagination of registrations by (created_at, id) for the listing and export endpoints needs created_at on
+-- every row, a row with a null created_at would never be returned. Rows inserted with an explicit null get the
+-- created_at of the row registered before them (ids are assigned in insertion order), or the earliest created_at.
+--
+-- The update does not go through the daily counts trigger from 0003-registration-stats.sql, which counted these rows
+-- on the day they were inserted or deleted. That day is not known anymore, so the counts are rebuilt from the
+-- registrations. Inserts are blocked until commit so none is counted twice or missed by the rebuild.
+begin;
+lock table tusc_account_registrations in share mode;
+
+update tusc_account_registrations a
+    set created_at = coalesce(
+        (select max(b.created_at) from tusc_account_registrations b where b.id < a.id),
+        (select min(b.created_at) from tusc_account_registrations b),
+        now() at time zone 'utc')
+    where a.created_at is null;
+
+-- Scans the table once under an exclusive lock, registrations wait for it
+alter table tusc_account_registrations
+    alter column created_at set not null;
+
+delete from tusc_registration_daily_counts;
+insert into tusc_registration_daily_counts (registration_date, referrer, registration_count)
+    select created_at::date, referrer, count(*)
+    from tusc_account_registrations
+    group by 1, 2;
+commit;
+
+-- The created_at index from 0002-registration-indexes.sql is kept, it is smaller for the queries on created_at alone
+create index concurrently tusc_account_registrations_created_at_id_idx
+    on tusc_account_registrations (created_at, id);
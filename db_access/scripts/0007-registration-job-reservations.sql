@@ -0,0 +1,4 @@
+-- The rate limit reservations a registration job releases if it fails, a list of [reservation_key, id] pairs.
+-- Jobs queued before this column existed release nothing, their reservations expire with the window.
+alter table tusc_registration_jobs
+    add column rate_limit_reservations jsonb not null default '[]';
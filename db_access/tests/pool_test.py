@@ -0,0 +1,81 @@
+import pytest
+import psycopg2
+import psycopg2.extensions
+from db_access import pool as db_pool
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture()
+def fake_connect(monkeypatch):
+    connections = []
+
+    def connect(dsn):
+        conn = FakeConnection()
+        connections.append(conn)
+        return conn
+
+    monkeypatch.setattr(db_pool.psycopg2, "connect", connect)
+    yield connections
+
+
+class TestConnectionPool:
+    def test_reuses_connections(self, fake_connect):
+        pool = db_pool.ConnectionPool("", 1, 2, 0.1, 30)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+        assert first is second
+        assert len(fake_connect) == 1
+
+    def test_times_out_when_exhausted(self, fake_connect):
+        pool = db_pool.ConnectionPool("", 0, 1, 0.05, 30)
+        with pool.connection():
+            with pytest.raises(db_pool.PoolTimeoutError):
+                pool.getconn()
+        assert pool.stats()["acquire_timeouts"] == 1
+
+    def test_replaces_dead_connection(self, fake_connect):
+        pool = db_pool.ConnectionPool("", 1, 1, 0.1, 0)
+        fake_connect[0].broken = True
+        with pool.connection() as conn:
+            assert conn is not fake_connect[0]
+        assert pool.stats()["reconnects"] == 1
+        assert pool.stats()["open_connections"] == 1
+
+    def test_discards_connection_broken_during_use(self, fake_connect):
+        pool = db_pool.ConnectionPool("", 0, 1, 0.1, 30)
+        with pytest.raises(psycopg2.OperationalError):
+            with pool.connection():
+                raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        assert fake_connect[0].closed
+        assert pool.stats()["idle_connections"] == 0
@@ -0,0 +1,65 @@
+import os
+import json
+import time
+import pytest
+from db_access import registration_writer
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture()
+def saved(monkeypatch):
+    rows = []
+    monkeypatch.setattr(registration_writer.db, "save_completed_registrations", lambda batch: rows.extend(batch))
+    yield rows
+
+
+class TestRegistrationWriter:
+    def test_saves_and_truncates_spool(self, tmp_path, saved):
+        writer = registration_writer.RegistrationWriter(str(tmp_path), 10, 5, 0.01, 0.05, False)
+        writer.submit("someaccountname", "TUSCkey", "registration-faucet")
+
+        assert wait_for(lambda: len(saved) == 1)
+        assert saved[0] == ("someaccountname", "TUSCkey", "registration-faucet")
+        assert wait_for(lambda: os.path.getsize(writer._spool_path) == 0)
+
+    def test_retries_until_saved(self, tmp_path, monkeypatch):
+        rows = []
+        failures = [Exception("connection refused"), Exception("connection refused")]
+
+        def save(batch):
+            if len(failures) > 0:
+                raise failures.pop()
+            rows.extend(batch)
+
+        monkeypatch.setattr(registration_writer.db, "save_completed_registrations", save)
+        writer = registration_writer.RegistrationWriter(str(tmp_path), 10, 5, 0.01, 0.05, False)
+        writer.submit("someaccountname", "TUSCkey", "")
+
+        assert wait_for(lambda: len(rows) == 1)
+
+    def test_overflow_reloads_spool(self, tmp_path, monkeypatch):
+        rows = []
+        monkeypatch.setattr(registration_writer.db, "save_completed_registrations", lambda batch: rows.extend(batch))
+        writer = registration_writer.RegistrationWriter(str(tmp_path), 1, 5, 0.01, 0.05, False)
+        for x in range(5):
+            writer.submit(f"someaccountname{x}", "TUSCkey", "")
+
+        assert wait_for(lambda: set(r[0] for r in rows) == set(f"someaccountname{x}" for x in range(5)))
+
+    def test_replays_orphaned_spool(self, tmp_path, saved):
+        with open(os.path.join(str(tmp_path), "registrations-999999.jsonl"), 'w') as orphan:
+            orphan.write(json.dumps(["orphanedaccount", "TUSCkey", ""]) + "\n")
+            orphan.write('["partial')
+
+        registration_writer.RegistrationWriter(str(tmp_path), 10, 5, 0.01, 0.05, False)
+
+        assert wait_for(lambda: ("orphanedaccount", "TUSCkey", "") in saved)
+        assert wait_for(lambda: not os.path.exists(os.path.join(str(tmp_path), "registrations-999999.jsonl")))
@@ -1,8 +1,19 @@
 import logging
+import logging.handlers
 import sys
 import os
+import copy
+import json
+import time
+import queue
+import fcntl
+import atexit
+import threading
+from config import general_cfg
 __all__ = ["setup_custom_logger"]
 
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(module)s - %(message)s'
+
 
 class LoggerWriter:
     def __init__(self, level):
@@ -23,20 +34,173 @@ class LoggerWriter:
         # to work properly for me.
         self.level(sys.stderr)
 
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "module": record.module,
+            "process": record.process,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+
+_exception_formatter = logging.Formatter()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread without waiting. When the queue is full (the disk cannot keep up) records
+    are dropped and counted, the listener logs how many were lost once it catches up.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # QueueHandler.prepare() would format the traceback into the message and clear it. It is kept as exc_text
+        # instead, the listener's formatter appends it for text logs and JsonFormatter writes its "exception" field.
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self._dropped += 1
+
+    def take_dropped(self) -> int:
+        with self._dropped_lock:
+            dropped = self._dropped
+            self._dropped = 0
+        return dropped
+
+
+class _SharedRotationMixin:
+    # Every gunicorn worker has the log file open. The worker that rotates takes a flock so only one of them renames
+    # the files, the others notice the file they have open was moved away and reopen the new one.
+
+    def _rotated_elsewhere(self) -> bool:
+        if self.stream is None:
+            return False
+        try:
+            path_stat = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            return True
+        stream_stat = os.fstat(self.stream.fileno())
+        return (path_stat.st_dev, path_stat.st_ino) != (stream_stat.st_dev, stream_stat.st_ino)
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        return self._rotated_elsewhere() or super().shouldRollover(record)
+
+    def doRollover(self):
+        with open(self.baseFilename + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if self._rotated_elsewhere():
+                self.stream.close()
+                self.stream = self._open()
+                self._rolled_over_elsewhere()
+            else:
+                super().doRollover()
+
+    def _rolled_over_elsewhere(self):
+        pass
+
+
+class SharedRotatingFileHandler(_SharedRotationMixin, logging.handlers.RotatingFileHandler):
+    pass
+
+
+class SharedTimedRotatingFileHandler(_SharedRotationMixin, logging.handlers.TimedRotatingFileHandler):
+    def _rolled_over_elsewhere(self):
+        self.rolloverAt = self.computeRollover(int(time.time()))
+
+
 def setup_custom_logger(name, subdir):
-    formatter = logging.Formatter(fmt='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
+    if general_cfg["log_format"] == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(fmt=TEXT_FORMAT)
 
     s_handler = logging.StreamHandler()
     s_handler.setFormatter(formatter)
-    f_handler = logging.FileHandler(filename=os.path.join(os.getcwd(), subdir, name + '.log'))
+    f_handler = _file_handler(os.path.join(os.getcwd(), subdir, name + '.log'))
     f_handler.setFormatter(formatter)
 
     inner_logger = logging.getLogger(name)
-    inner_logger.setLevel(logging.DEBUG)
+    inner_logger.setLevel(general_cfg["log_level"])
     # sys.stdout = LoggerWriter(inner_logger.debug)
     # sys.stderr = LoggerWriter(inner_logger.debug)
     # inner_logger.addHandler(s_handler)
     # inner_logger.addHandler(f_handler)
-    logging.root.handlers = [s_handler, f_handler]
+    if general_cfg["log_async"]:
+        logging.root.handlers = [_start_listener(s_handler, f_handler)]
+    else:
+        logging.root.handlers = [s_handler, f_handler]
 
     return inner_logger
+
+
+def _file_handler(filename: str) -> logging.Handler:
+    rotation = general_cfg["log_rotation"]
+    backup_count = general_cfg["log_backup_count"]
+    if rotation == "size":
+        return SharedRotatingFileHandler(filename, maxBytes=general_cfg["log_max_bytes"], backupCount=backup_count)
+    if rotation == "time":
+        return SharedTimedRotatingFileHandler(filename, when=general_cfg["log_rotate_when"], backupCount=backup_count)
+    return logging.FileHandler(filename=filename)
+
+
+class _DropReportingListener(logging.handlers.QueueListener):
+    def __init__(self, queue_handler: DroppingQueueHandler, *handlers: logging.Handler):
+        super().__init__(queue_handler.queue, *handlers, respect_handler_level=True)
+        self._queue_handler = queue_handler
+
+    def handle(self, record: logging.LogRecord):
+        dropped = self._queue_handler.take_dropped()
+        if dropped > 0:
+            super().handle(logging.makeLogRecord({
+                "name": record.name, "levelno": logging.WARNING, "levelname": "WARNING", "module": "log",
+                "msg": "Logging queue was full, dropped %d log records", "args": (dropped,)}))
+        super().handle(record)
+
+
+_listener = None
+
+
+# Request threads only put records on the queue, the listener thread does all the stream and file writes.
+# QueueHandler merges the message arguments in the calling thread, records of disabled levels never get that far.
+def _start_listener(*handlers: logging.Handler) -> logging.Handler:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    queue_handler = DroppingQueueHandler(queue.Queue(general_cfg["log_queue_size"]))
+    _listener = _DropReportingListener(queue_handler, *handlers)
+    _listener.start()
+    return queue_handler
+
+
+# Writes out whatever is still queued when the worker exits
+@atexit.register
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
@@ -0,0 +1,347 @@
+import os
+import glob
+import json
+import time
+import uuid
+import fcntl
+import bisect
+import logging
+import threading
+import contextlib
+import typing
+from config import general_cfg
+
+__all__ = [
+    "registry",
+    "initiate_metrics",
+    "render_metrics",
+    "CONTENT_TYPE",
+]
+
+logger = logging.getLogger('root')
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SNAPSHOT_FILE_PATTERN = "metrics-*.json"
+# Counters and histograms of workers that exited, see MetricsRegistry.merge_exited_workers
+EXITED_WORKERS_FILE = "exited-workers.json"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(labelvalues), value] for labelvalues, value in self._values.items()]
+
+
+class Histogram:
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labelnames: typing.Sequence[str],
+                 buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labelvalues -> [count per bucket (the last one is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(labelvalues)
+            if values is None:
+                values = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            values[0][index] += 1
+            values[1] += value
+
+    @contextlib.contextmanager
+    def time(self, *labelvalues: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(labelvalues), list(counts), total] for labelvalues, (counts, total) in self._values.items()]
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms are kept in memory by each process, recording one is a dict update under a lock. A
+    background thread writes this process's values to metrics_dir every flush_interval seconds, render() adds up the
+    files of every worker on the host. Counters of workers that exited keep counting towards the totals, render()
+    merges them into one file and removes their snapshots. Gauges are read when the snapshot is written and only live
+    workers' gauges are shown.
+    """
+
+    def __init__(self):
+        self._counters = []
+        self._histograms = []
+        self._gauges = []
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        # (pid, worker id), the id tells a worker apart from an earlier one that had the same pid
+        self._worker = None
+
+    def counter(self, name: str, documentation: str, labelnames: typing.Sequence[str] = ()) -> Counter:
+        counter = Counter(name, documentation, labelnames)
+        self._counters.append(counter)
+        return counter
+
+    def histogram(self, name: str, documentation: str, labelnames: typing.Sequence[str] = (),
+                  buckets: typing.Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        histogram = Histogram(name, documentation, labelnames, buckets)
+        self._histograms.append(histogram)
+        return histogram
+
+    def gauge(self, name: str, documentation: str, read: typing.Callable[[], float]):
+        """read() is called whenever a snapshot is written, it must be cheap and must not raise."""
+        self._gauges.append((name, documentation, read))
+
+    def start(self, metrics_dir: str, flush_interval: float):
+        with self._thread_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(metrics_dir, flush_interval), daemon=True)
+            self._thread.start()
+
+    def _run(self, metrics_dir: str, flush_interval: float):
+        while True:
+            time.sleep(flush_interval)
+            try:
+                self.write_snapshot(metrics_dir)
+            except Exception:
+                logger.exception('Failed to write metrics snapshot')
+
+    def snapshot(self) -> dict:
+        gauges = {}
+        for name, documentation, read in self._gauges:
+            try:
+                gauges[name] = read()
+            except Exception:
+                logger.exception("Failed to read gauge %s", name)
+
+        return {
+            "pid": os.getpid(),
+            "worker_id": self._worker_id(),
+            "counters": {counter.name: counter.snapshot() for counter in self._counters},
+            "histograms": {histogram.name: histogram.snapshot() for histogram in self._histograms},
+            "gauges": gauges,
+        }
+
+    def write_snapshot(self, metrics_dir: str):
+        os.makedirs(metrics_dir, exist_ok=True)
+        path = os.path.join(metrics_dir, SNAPSHOT_FILE_PATTERN.replace("*", f"{os.getpid()}-{self._worker_id()}"))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _worker_id(self) -> str:
+        # Generated again after a fork, e.g. gunicorn workers of an app loaded with --preload
+        if self._worker is None or self._worker[0] != os.getpid():
+            self._worker = (os.getpid(), uuid.uuid4().hex)
+        return self._worker[1]
+
+    def merge_exited_workers(self, metrics_dir: str) -> typing.Tuple[typing.List[dict], typing.Optional[dict]]:
+        """
+        Adds the counters and histograms of workers that exited to EXITED_WORKERS_FILE and removes their snapshots, so
+        the directory does not grow with every worker restart. Returns the snapshots of the live workers and the
+        totals of the exited ones (None if no worker exited yet), read under the same lock so a worker merging at
+        the same time cannot make a snapshot count twice.
+        """
+        with open(os.path.join(metrics_dir, EXITED_WORKERS_FILE + ".lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            live, exited = [], []
+            for path, snapshot in _read_snapshots(metrics_dir):
+                (live if self._is_live_worker(snapshot) else exited).append((path, snapshot))
+
+            totals_path = os.path.join(metrics_dir, EXITED_WORKERS_FILE)
+            totals = _read_json(totals_path)
+            if len(exited) > 0:
+                totals = totals or {"counters": {}, "histograms": {}}
+                for path, snapshot in exited:
+                    _add_snapshot(totals, snapshot)
+                tmp_path = totals_path + ".tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(totals, f)
+                os.replace(tmp_path, totals_path)
+
+                for path, snapshot in exited:
+                    os.remove(path)
+                    logger.debug("Merged metrics of exited worker %s", snapshot["pid"])
+
+        return [snapshot for path, snapshot in live], totals
+
+    def _is_live_worker(self, snapshot: dict) -> bool:
+        if snapshot["pid"] == os.getpid():
+            # A worker that had this process's pid before
+            return snapshot.get("worker_id") == self._worker_id()
+        return _is_alive(snapshot["pid"])
+
+    def render(self, metrics_dir: str) -> str:
+        """Prometheus text format for every worker on this host, with this process's values as of now."""
+        self.write_snapshot(metrics_dir)
+        live_snapshots, totals = self.merge_exited_workers(metrics_dir)
+        snapshots = live_snapshots + ([totals] if totals is not None else [])
+
+        lines = []
+        for counter in self._counters:
+            totals = {}
+            for snapshot in snapshots:
+                for labelvalues, value in snapshot["counters"].get(counter.name, []):
+                    key = tuple(labelvalues)
+                    totals[key] = totals.get(key, 0) + value
+            lines.append(f"# HELP {counter.name} {counter.documentation}")
+            lines.append(f"# TYPE {counter.name} counter")
+            for labelvalues, value in sorted(totals.items()):
+                lines.append(f"{counter.name}{_labels(counter.labelnames, labelvalues)} {_number(value)}")
+
+        for histogram in self._histograms:
+            totals = {}
+            for snapshot in snapshots:
+                for labelvalues, counts, total in snapshot["histograms"].get(histogram.name, []):
+                    key = tuple(labelvalues)
+                    if key not in totals:
+                        totals[key] = [[0] * (len(histogram.buckets) + 1), 0.0]
+                    # Bucket boundaries could have changed between deploys, skip snapshots that do not match
+                    if len(counts) == len(totals[key][0]):
+                        totals[key][0] = [a + b for a, b in zip(totals[key][0], counts)]
+                        totals[key][1] += total
+            lines.append(f"# HELP {histogram.name} {histogram.documentation}")
+            lines.append(f"# TYPE {histogram.name} histogram")
+            for labelvalues, (counts, total) in sorted(totals.items()):
+                cumulative = 0
+                for bound, count in zip(list(histogram.buckets) + [float('inf')], counts):
+                    cumulative += count
+                    bucket_labels = _labels(histogram.labelnames + ("le",), labelvalues + (_number(bound),))
+                    lines.append(f"{histogram.name}_bucket{bucket_labels} {cumulative}")
+                labels = _labels(histogram.labelnames, labelvalues)
+                lines.append(f"{histogram.name}_sum{labels} {_number(total)}")
+                lines.append(f"{histogram.name}_count{labels} {cumulative}")
+
+        for name, documentation, read in self._gauges:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for snapshot in sorted(live_snapshots, key=lambda s: s["pid"]):
+                if name in snapshot["gauges"]:
+                    lines.append(f"{name}{_labels(('pid',), (str(snapshot['pid']),))} "
+                                 f"{_number(snapshot['gauges'][name])}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _read_json(path: str) -> typing.Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _read_snapshots(metrics_dir: str) -> typing.List[typing.Tuple[str, dict]]:
+    snapshots = []
+    for path in glob.glob(os.path.join(metrics_dir, SNAPSHOT_FILE_PATTERN)):
+        snapshot = _read_json(path)
+        if snapshot is not None:
+            snapshots.append((path, snapshot))
+    return snapshots
+
+
+# Adds the counters and histograms of snapshot to totals, which has the same layout
+def _add_snapshot(totals: dict, snapshot: dict):
+    for name, values in snapshot["counters"].items():
+        counter_totals = {tuple(labelvalues): value for labelvalues, value in totals["counters"].get(name, [])}
+        for labelvalues, value in values:
+            key = tuple(labelvalues)
+            counter_totals[key] = counter_totals.get(key, 0) + value
+        totals["counters"][name] = [[list(key), value] for key, value in counter_totals.items()]
+
+    for name, values in snapshot["histograms"].items():
+        histogram_totals = {tuple(labelvalues): [counts, total]
+                            for labelvalues, counts, total in totals["histograms"].get(name, [])}
+        for labelvalues, counts, total in values:
+            key = tuple(labelvalues)
+            if key not in histogram_totals:
+                histogram_totals[key] = [list(counts), total]
+            # Bucket boundaries could have changed between deploys, like in render()
+            elif len(counts) == len(histogram_totals[key][0]):
+                histogram_totals[key] = [[a + b for a, b in zip(histogram_totals[key][0], counts)],
+                                         histogram_totals[key][1] + total]
+        totals["histograms"][name] = [[list(key), counts, total] for key, (counts, total) in histogram_totals.items()]
+
+
+def _labels(labelnames: typing.Sequence[str], labelvalues: typing.Sequence[str]) -> str:
+    if len(labelnames) == 0:
+        return ""
+    pairs = []
+    for labelname, labelvalue in zip(labelnames, labelvalues):
+        escaped = str(labelvalue).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{labelname}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+registry = MetricsRegistry()
+
+wallet_rpc_seconds = registry.histogram(
+    "tusc_wallet_rpc_duration_seconds", "TUSC wallet JSON-RPC calls, batches are labelled method=\"batch\"",
+    ["method"])
+wallet_start_seconds = registry.histogram(
+    "tusc_wallet_start_duration_seconds", "Time to start the cli_wallet process")
+wallet_unlock_seconds = registry.histogram(
+    "tusc_wallet_unlock_duration_seconds", "Time to unlock the TUSC wallet")
+captcha_seconds = registry.histogram(
+    "tusc_captcha_verify_duration_seconds", "reCAPTCHA siteverify calls")
+db_seconds = registry.histogram(
+    "tusc_db_operation_duration_seconds", "Database operations", ["operation"])
+wallet_errors = registry.counter(
+    "tusc_wallet_errors_total", "TUSC wallet error responses by classification", ["kind"])
+rate_limit_rejections = registry.counter(
+    "tusc_rate_limit_rejections_total", "Requests rejected by the ip and network rate limits", ["scope"])
+wallet_unavailable = registry.counter(
+    "tusc_wallet_unavailable_total",
+    "Requests answered with a 503 by admission control, the circuit breaker or the funds check")
+invalid_referrers = registry.counter(
+    "tusc_invalid_referrers_total", "Registrations whose referrer is not an account, by action taken", ["action"])
+
+
+def initiate_metrics():
+    if general_cfg["metrics_enabled"]:
+        registry.start(general_cfg["metrics_dir"], general_cfg["metrics_flush_interval_seconds"])
+
+
+def render_metrics() -> str:
+    return registry.render(general_cfg["metrics_dir"])
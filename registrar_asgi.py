@@ -0,0 +1,48 @@
+# Entry point to program for an ASGI server, e.g. `hypercorn --bind 0.0.0.0:8080 registrar_asgi:app`.
+# Serves the same routes as registrar_wsgi.py, but wallet, reCAPTCHA and DB calls are awaited so one process can hold
+# many registrations while they wait on the wallet.
+from quart import Quart
+from quart_cors import cors
+
+app = Quart(__name__)
+
+# TODO: change to specific origins for production
+app = cors(app)
+import log
+
+logger = log.setup_custom_logger('root', 'registrar')
+logger.debug('Starting OCC to TUSC registration server (ASGI)')
+
+from tusc_api.webctrl_tusc_api_async import tusc_api, close_clients
+from tusc_api.webctrl_tusc_api import registration_job_runner
+import db_access.db as db
+import db_access.async_db as async_db
+import db_access.registration_writer as registration_writer
+import metrics
+from config import cfg
+
+general_cfg = cfg["general"]
+tusc_api_cfg = cfg["tusc_api"]
+
+
+@app.before_serving
+async def startup():
+    logger.debug('Starting server')
+    await async_db.initiate_database_connection()
+    # The write-behind flusher, registration jobs and taken names seeding still use the sync pool
+    db.initiate_database_connection()
+    registration_writer.initiate_registration_writer()
+    metrics.initiate_metrics()
+    if tusc_api_cfg["registration_jobs_enabled"]:
+        registration_job_runner.start()
+
+
+@app.after_serving
+async def shutdown():
+    await close_clients()
+    await async_db.close_database_connection()
+    logger.debug('Shutting down server')
+
+
+app.logger = logger
+app.register_blueprint(tusc_api)
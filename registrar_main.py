@@ -12,24 +12,31 @@ import log
 logger = log.setup_custom_logger('root', 'registrar')
 logger.debug('Starting TUSC registration server')
 
-from tusc_api.webctrl_tusc_api import tusc_api
+from tusc_api.webctrl_tusc_api import tusc_api, registration_job_runner
 import db_access.db as db
+import db_access.registration_writer as registration_writer
+import metrics
 from config import cfg
 
 # REMOVE ME
 from tusc_api import gate_tusc_api
 
 general_cfg = cfg["general"]
+tusc_api_cfg = cfg["tusc_api"]
 
 if __name__ == '__main__':
     logger.debug('Starting server')
     try:
         db.initiate_database_connection()
+        registration_writer.initiate_registration_writer()
+        metrics.initiate_metrics()
+        if tusc_api_cfg["registration_jobs_enabled"]:
+            registration_job_runner.start()
         app.logger = logger
         app.register_blueprint(tusc_api)
         app.run(host='0.0.0.0', port=8080)
     except Exception as e:
-        logger.error(f'Server experienced an error: {e}')
+        logger.error('Server experienced an error: %s', e)
         logger.debug('Shutting down server')
         raise e
     logger.debug('Shutting down server')
@@ -12,14 +12,21 @@ import log
 logger = log.setup_custom_logger('root', 'registrar')
 logger.debug('Starting OCC to TUSC registration server')
 
-from tusc_api.webctrl_tusc_api import tusc_api
+from tusc_api.webctrl_tusc_api import tusc_api, registration_job_runner
 import db_access.db as db
+import db_access.registration_writer as registration_writer
+import metrics
 from config import cfg
 
 general_cfg = cfg["general"]
+tusc_api_cfg = cfg["tusc_api"]
 logger.debug('Starting server')
 
 db.initiate_database_connection()
+registration_writer.initiate_registration_writer()
+metrics.initiate_metrics()
+if tusc_api_cfg["registration_jobs_enabled"]:
+    registration_job_runner.start()
 app.logger = logger
 app.register_blueprint(tusc_api)
 
@@ -0,0 +1,65 @@
+import logging
+import typing
+from tusc_api.cache import TTLCache
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+_missing = object()
+
+
+class AccountLookupError(Exception):
+    pass
+
+
+class AccountLookup:
+    """
+    Cached on-chain account lookups through the wallet. Both found and unknown names are cached, at most maxsize
+    names. Found names are kept for ttl seconds, unknown names for negative_ttl seconds (ttl when not given) since
+    they can be registered at any moment.
+    """
+
+    def __init__(self,
+                 send_request: typing.Callable[[str, list], dict],
+                 ttl: float,
+                 maxsize: int,
+                 negative_ttl: typing.Optional[float] = None):
+        self._send_request = send_request
+        self._cache = TTLCache(ttl, maxsize)
+        self._negative_ttl = negative_ttl
+
+    def get_account_id(self, account_name: str) -> typing.Optional[str]:
+        """Returns the account's id, or None if there is no such account."""
+        account_id = self._cache.get(account_name, _missing)
+        if account_id is not _missing:
+            return account_id
+
+        # list_accounts returns the accounts from the given name onwards, unlike get_account it does not throw for
+        # unknown names
+        api_response_json = self._send_request("list_accounts", [account_name, 1])
+        if "result" not in api_response_json:
+            raise AccountLookupError(f"Failed to look up account '{account_name}'")
+
+        result = api_response_json["result"]
+        account_id = None
+        if len(result) > 0 and result[0][0] == account_name:
+            account_id = result[0][1]
+
+        self._cache.set(account_name, account_id, self._negative_ttl if account_id is None else None)
+        return account_id
+
+    def exists(self, account_name: str) -> bool:
+        return self.get_account_id(account_name) is not None
+
+    def cached_exists(self, account_name: str) -> typing.Optional[bool]:
+        """Whether the account exists as far as the cache knows, None when that takes a lookup."""
+        account_id = self._cache.get(account_name, _missing)
+        if account_id is _missing:
+            return None
+        return account_id is not None
+
+    def forget(self, account_name: str):
+        self._cache.pop(account_name)
+
+
+logger.debug('loaded')
@@ -0,0 +1,179 @@
+import hashlib
+import logging
+import struct
+import typing
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+PUBLIC_KEY_PREFIX = "TUSC"
+MIN_ACCOUNT_NAME_LENGTH = 8
+MAX_ACCOUNT_NAME_LENGTH = 63
+
+AccountNameRestrictions = "Account names must be more than 7 and less than 64 characters. " \
+                          "They must consist of lower case characters, numbers, and '-'. " \
+                          "They cannot start with a number."
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+BASE58_VALUES = {c: i for i, c in enumerate(BASE58_ALPHABET)}
+
+
+def validate_registration(account_name: str, public_key: str) -> typing.Optional[dict]:
+    """
+    Returns the error response for an account name or public key the chain would reject, None if both are fine.
+    The messages are the same ones _register_account_error_handler_imp gives for the wallet's errors.
+    """
+    if not isinstance(account_name, str) or not isinstance(public_key, str):
+        return {"error": "Expected account_name and public_key in json string"}
+
+    account_name_error = validate_account_name(account_name)
+    if account_name_error is not None:
+        return account_name_error
+
+    if not is_valid_public_key(public_key):
+        return {"error": "The public key '" + public_key + "' is invalid. Please double check "
+                                                           "that it is correct and resubmit."}
+    return None
+
+
+def validate_account_name(account_name: str) -> typing.Optional[dict]:
+    if len(account_name) < MIN_ACCOUNT_NAME_LENGTH:
+        return {"error": "Account name '" + account_name + "' is too short. " + AccountNameRestrictions}
+    if len(account_name) > MAX_ACCOUNT_NAME_LENGTH:
+        return {"error": "Account name '" + account_name + "' is too long. " + AccountNameRestrictions}
+    if not is_valid_name(account_name):
+        return {"error": "Account name '" + account_name + "' is invalid. " + AccountNameRestrictions}
+    return None
+
+
+def is_valid_name(name: str) -> bool:
+    """
+    The chain's is_valid_name: up to 63 characters of '.' separated labels, each label at least 1 character long,
+    starting with a lower case letter, ending with a lower case letter or a digit, and otherwise made of lower case
+    letters, digits and '-'.
+    """
+    if len(name) < 1 or len(name) > MAX_ACCOUNT_NAME_LENGTH:
+        return False
+
+    for label in name.split('.'):
+        if len(label) < 1:
+            return False
+        if not ('a' <= label[0] <= 'z'):
+            return False
+        if not ('a' <= label[-1] <= 'z' or '0' <= label[-1] <= '9'):
+            return False
+        for c in label[1:-1]:
+            if not ('a' <= c <= 'z' or '0' <= c <= '9' or c == '-'):
+                return False
+
+    return True
+
+
+def is_valid_public_key(public_key: str, prefix: str = PUBLIC_KEY_PREFIX) -> bool:
+    """
+    A public key is the prefix followed by the base58 encoding of a 33 byte compressed secp256k1 point and the first
+    4 bytes of its ripemd160 digest.
+    """
+    if not public_key.startswith(prefix):
+        return False
+
+    data = base58_decode(public_key[len(prefix):])
+    if data is None or len(data) != 37:
+        return False
+
+    key_data, checksum = data[:33], data[33:]
+    if key_data[0] not in (2, 3):
+        return False
+
+    return ripemd160(key_data)[:4] == checksum
+
+
+def base58_decode(encoded: str) -> typing.Optional[bytes]:
+    if len(encoded) == 0:
+        return None
+
+    value = 0
+    for c in encoded:
+        if c not in BASE58_VALUES:
+            return None
+        value = value * 58 + BASE58_VALUES[c]
+
+    decoded = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    leading_zeros = len(encoded) - len(encoded.lstrip(BASE58_ALPHABET[0]))
+    return b'\x00' * leading_zeros + decoded
+
+
+def ripemd160(data: bytes) -> bytes:
+    try:
+        return hashlib.new('ripemd160', data).digest()
+    except ValueError:
+        # OpenSSL 3 builds may not provide ripemd160
+        return _ripemd160(data)
+
+
+_RIPEMD_R1 = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
+              7, 4, 13, 1, 10, 6, 15, 3, 12, 0, 9, 5, 2, 14, 11, 8,
+              3, 10, 14, 4, 9, 15, 8, 1, 2, 7, 0, 6, 13, 11, 5, 12,
+              1, 9, 11, 10, 0, 8, 12, 4, 13, 3, 7, 15, 14, 5, 6, 2,
+              4, 0, 5, 9, 7, 12, 2, 10, 14, 1, 3, 8, 11, 6, 15, 13]
+_RIPEMD_R2 = [5, 14, 7, 0, 9, 2, 11, 4, 13, 6, 15, 8, 1, 10, 3, 12,
+              6, 11, 3, 7, 0, 13, 5, 10, 14, 15, 8, 12, 4, 9, 1, 2,
+              15, 5, 1, 3, 7, 14, 6, 9, 11, 8, 12, 2, 10, 0, 4, 13,
+              8, 6, 4, 1, 3, 11, 15, 0, 5, 12, 2, 13, 9, 7, 10, 14,
+              12, 15, 10, 4, 1, 5, 8, 7, 6, 2, 13, 14, 0, 3, 9, 11]
+_RIPEMD_S1 = [11, 14, 15, 12, 5, 8, 7, 9, 11, 13, 14, 15, 6, 7, 9, 8,
+              7, 6, 8, 13, 11, 9, 7, 15, 7, 12, 15, 9, 11, 7, 13, 12,
+              11, 13, 6, 7, 14, 9, 13, 15, 14, 8, 13, 6, 5, 12, 7, 5,
+              11, 12, 14, 15, 14, 15, 9, 8, 9, 14, 5, 6, 8, 6, 5, 12,
+              9, 15, 5, 11, 6, 8, 13, 12, 5, 12, 13, 14, 11, 8, 5, 6]
+_RIPEMD_S2 = [8, 9, 9, 11, 13, 15, 15, 5, 7, 7, 8, 11, 14, 14, 12, 6,
+              9, 13, 15, 7, 12, 8, 9, 11, 7, 7, 12, 7, 6, 15, 13, 11,
+              9, 7, 15, 11, 8, 6, 6, 14, 12, 13, 5, 14, 13, 13, 7, 5,
+              15, 5, 8, 11, 14, 14, 6, 14, 6, 9, 12, 9, 12, 5, 15, 8,
+              8, 5, 12, 9, 12, 5, 14, 6, 8, 13, 6, 5, 15, 13, 11, 11]
+_RIPEMD_K1 = [0x00000000, 0x5A827999, 0x6ED9EBA1, 0x8F1BBCDC, 0xA953FD4E]
+_RIPEMD_K2 = [0x50A28BE6, 0x5C4DD124, 0x6D703EF3, 0x7A6D76E9, 0x00000000]
+
+
+def _ripemd160_f(j: int, x: int, y: int, z: int) -> int:
+    if j < 16:
+        return x ^ y ^ z
+    if j < 32:
+        return (x & y) | (~x & z)
+    if j < 48:
+        return (x | ~y) ^ z
+    if j < 64:
+        return (x & z) | (y & ~z)
+    return x ^ (y | ~z)
+
+
+def _rotl(x: int, n: int) -> int:
+    return ((x << n) | (x >> (32 - n))) & 0xffffffff
+
+
+def _ripemd160(data: bytes) -> bytes:
+    h = [0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476, 0xC3D2E1F0]
+    padded = data + b'\x80' + b'\x00' * ((55 - len(data)) % 64) + struct.pack('<Q', len(data) * 8)
+
+    for block_start in range(0, len(padded), 64):
+        x = struct.unpack('<16I', padded[block_start:block_start + 64])
+        a1, b1, c1, d1, e1 = h
+        a2, b2, c2, d2, e2 = h
+        for j in range(80):
+            t = _rotl((a1 + _ripemd160_f(j, b1, c1, d1) + x[_RIPEMD_R1[j]] + _RIPEMD_K1[j // 16]) & 0xffffffff,
+                      _RIPEMD_S1[j]) + e1
+            a1, b1, c1, d1, e1 = e1, t & 0xffffffff, b1, _rotl(c1, 10), d1
+            t = _rotl((a2 + _ripemd160_f(79 - j, b2, c2, d2) + x[_RIPEMD_R2[j]] + _RIPEMD_K2[j // 16]) & 0xffffffff,
+                      _RIPEMD_S2[j]) + e2
+            a2, b2, c2, d2, e2 = e2, t & 0xffffffff, b2, _rotl(c2, 10), d2
+        t = (h[1] + c1 + d2) & 0xffffffff
+        h[1] = (h[2] + d1 + e2) & 0xffffffff
+        h[2] = (h[3] + e1 + a2) & 0xffffffff
+        h[3] = (h[4] + a1 + b2) & 0xffffffff
+        h[4] = (h[0] + b1 + c2) & 0xffffffff
+        h[0] = t
+
+    return struct.pack('<5I', *h)
+
+
+logger.debug('loaded')
@@ -0,0 +1,170 @@
+import os
+import math
+import asyncio
+import time
+import fcntl
+import random
+import logging
+import threading
+import contextlib
+import typing
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+SLOT_POLL_SECONDS = 0.01
+
+
+class WalletUnavailableError(Exception):
+    """Raised instead of calling the wallet, the request should be answered with a 503 and Retry-After."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """
+    Lets at most max_concurrent requests of all worker processes on this host call the wallet at once, with at most
+    max_queued more waiting for up to queue_timeout seconds. Anything beyond that is rejected right away.
+
+    Both the running and the waiting requests hold a flock'd slot file in lock_dir, so slots are shared between
+    processes and are released when a process dies. Each acquire opens its own files, flock conflicts between
+    separate open() calls, so this works between threads of one process too.
+    """
+
+    def __init__(self, lock_dir: str, max_concurrent: int, max_queued: int, queue_timeout: float, retry_after: int):
+        self._lock_dir = lock_dir
+        self._max_concurrent = max_concurrent
+        self._max_queued = max_queued
+        self._queue_timeout = queue_timeout
+        self._retry_after = retry_after
+
+    @contextlib.contextmanager
+    def slot(self):
+        os.makedirs(self._lock_dir, exist_ok=True)
+        slot_file = self._try_lock("slot", self._max_concurrent)
+        if slot_file is None:
+            slot_file = self._wait_for_slot()
+
+        try:
+            yield
+        finally:
+            slot_file.close()
+
+    @contextlib.asynccontextmanager
+    async def slot_async(self):
+        """slot() for the ASGI app, waits for a slot without blocking the event loop."""
+        os.makedirs(self._lock_dir, exist_ok=True)
+        slot_file = self._try_lock("slot", self._max_concurrent)
+        if slot_file is None:
+            queue_file = self._take_queue_place()
+            try:
+                deadline = time.monotonic() + self._queue_timeout
+                while slot_file is None and time.monotonic() < deadline:
+                    await asyncio.sleep(SLOT_POLL_SECONDS)
+                    slot_file = self._try_lock("slot", self._max_concurrent)
+            finally:
+                queue_file.close()
+            if slot_file is None:
+                self._timed_out()
+
+        try:
+            yield
+        finally:
+            slot_file.close()
+
+    def _wait_for_slot(self):
+        queue_file = self._take_queue_place()
+        try:
+            deadline = time.monotonic() + self._queue_timeout
+            while time.monotonic() < deadline:
+                time.sleep(SLOT_POLL_SECONDS)
+                slot_file = self._try_lock("slot", self._max_concurrent)
+                if slot_file is not None:
+                    return slot_file
+        finally:
+            queue_file.close()
+
+        self._timed_out()
+
+    def _take_queue_place(self) -> typing.IO:
+        queue_file = self._try_lock("queue", self._max_queued)
+        if queue_file is None:
+            logger.warning('Wallet request queue is full, rejecting request')
+            raise WalletUnavailableError("The service is busy. Please try again later.", self._retry_after)
+        return queue_file
+
+    def _timed_out(self):
+        logger.warning('Timed out waiting for a wallet request slot')
+        raise WalletUnavailableError("The service is busy. Please try again later.", self._retry_after)
+
+    # Returns the open, locked file of a free slot, or None if all count slots are taken
+    def _try_lock(self, kind: str, count: int) -> typing.Optional[typing.IO]:
+        start = random.randrange(count) if count > 0 else 0
+        for i in range(count):
+            slot_file = open(os.path.join(self._lock_dir, f"wallet-{kind}-{(start + i) % count}.lock"), 'a')
+            try:
+                fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot_file
+            except BlockingIOError:
+                slot_file.close()
+        return None
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold wallet failures in a row and rejects requests for open_seconds. After that one
+    request at a time is let through to try the wallet (which restarts it if needed), the first success closes the
+    breaker again and a failure keeps it open for another open_seconds.
+    """
+
+    def __init__(self, failure_threshold: int, open_seconds: float):
+        self._failure_threshold = failure_threshold
+        self._open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_started_at = None
+
+    def check(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+
+            now = time.monotonic()
+            retry_after = self._opened_at + self._open_seconds - now
+            if retry_after <= 0:
+                # A trial that never reported back (it did not reach the wallet) does not block the next one forever
+                if self._trial_started_at is None or now - self._trial_started_at > self._open_seconds:
+                    self._trial_started_at = now
+                    return
+                retry_after = self._trial_started_at + self._open_seconds - now
+
+        raise WalletUnavailableError("The TUSC wallet is unavailable. Please try again later.",
+                                     max(1, math.ceil(retry_after)))
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info('Wallet recovered, closing circuit breaker')
+            self._failures = 0
+            self._opened_at = None
+            self._trial_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._opened_at is not None:
+                if self._trial_started_at is not None:
+                    self._opened_at = time.monotonic()
+                    self._trial_started_at = None
+            elif self._failures >= self._failure_threshold:
+                logger.error("%d wallet failures in a row, opening circuit breaker", self._failures)
+                self._opened_at = time.monotonic()
+
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+
+logger.debug('loaded')
@@ -0,0 +1,85 @@
+import time
+import logging
+import threading
+import collections
+import typing
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+
+class BrainKeyPool:
+    """
+    Bounded, in-memory only pool of suggest_brain_key results.
+
+    A background thread tops the pool up in batches of refill_batch whenever it drops below low_water, so requests
+    normally take a key without touching the wallet. take() pops a key, so every key is handed out exactly once.
+    Keys are never logged or written anywhere. The thread is started by start() or the first take(), so it runs in
+    the worker process rather than in whatever process imported this module.
+    """
+
+    def __init__(self,
+                 generate_batch: typing.Callable[[int], typing.List[dict]],
+                 size: int,
+                 low_water: int,
+                 refill_batch: int,
+                 retry_seconds: float):
+        self._generate_batch = generate_batch
+        self._size = size
+        self._low_water = low_water
+        self._refill_batch = refill_batch
+        self._retry_seconds = retry_seconds
+        self._keys = collections.deque(maxlen=size)
+        self._refill_needed = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def take(self) -> typing.Optional[dict]:
+        self.start()
+        try:
+            brain_key = self._keys.popleft()
+        except IndexError:
+            brain_key = None
+
+        if len(self._keys) < self._low_water:
+            self._refill_needed.set()
+        return brain_key
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._refill_needed.set()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._refill_needed.wait()
+            self._refill_needed.clear()
+
+            while len(self._keys) < self._size:
+                count = min(self._refill_batch, self._size - len(self._keys))
+                try:
+                    brain_keys = self._generate_batch(count)
+                except Exception as e:
+                    logger.error("Failed to refill brain key pool: %s", e)
+                    brain_keys = []
+
+                if len(brain_keys) == 0:
+                    time.sleep(self._retry_seconds)
+                    break
+
+                self._keys.extend(brain_keys)
+                logger.debug("Brain key pool refilled to %d", len(self._keys))
+
+            if len(self._keys) < self._low_water:
+                # The refill failed, try again later even if no request comes in
+                self._refill_needed.set()
+
+
+logger.debug('loaded')
@@ -0,0 +1,94 @@
+import time
+import logging
+import threading
+import collections
+import typing
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+_missing = object()
+
+
+class TTLCache:
+    """
+    Thread-safe in-process cache whose entries expire ttl seconds after being set. When maxsize is given the least
+    recently used entry is evicted once the cache is full.
+    """
+
+    def __init__(self, ttl: float, maxsize: typing.Optional[int] = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _missing)
+            if entry is _missing:
+                return default
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _missing) is not _missing
+
+    def set(self, key, value, ttl: typing.Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, _missing)
+        if entry is _missing or entry[1] <= time.monotonic():
+            return default
+        return entry[0]
+
+    def get_or_load(self, key, loader: typing.Callable[[], typing.Any]):
+        """
+        Returns the cached value for key, calling loader to fill it when missing. Concurrent callers for the same key
+        wait for a single load instead of all calling loader. A None result from loader is not cached.
+        """
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            value = self.get(key, _missing)
+            if value is not _missing:
+                return value
+
+            try:
+                value = loader()
+                if value is not None:
+                    self.set(key, value)
+                return value
+            finally:
+                with self._lock:
+                    self._load_locks.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+logger.debug('loaded')
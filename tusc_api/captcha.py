@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import logging
+import typing
+import requests
+import requests.adapters
+from tusc_api.cache import TTLCache
+from config import general_cfg
+import metrics
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+
+class CaptchaVerifier:
+    """
+    Verifies reCAPTCHA responses against general:captcha_verify_url over a pooled keep-alive session with strict
+    timeouts. Tokens siteverify already answered for are rejected without a network call, they are single use anyway.
+    When the verifier cannot be reached the result is general:captcha_fail_open, and the token can be tried again.
+    """
+
+    def __init__(self,
+                 verify_url: str,
+                 secret: str,
+                 connect_timeout: float,
+                 read_timeout: float,
+                 fail_open: bool,
+                 token_cache_seconds: float,
+                 token_cache_size: int):
+        self.verify_url = verify_url
+        self._secret = secret
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._fail_open = fail_open
+        self._seen_tokens = TTLCache(token_cache_seconds, token_cache_size)
+        self._session = None
+
+    def verify(self, captcha_response: str, ip: str) -> bool:
+        token_key = self._new_token_key(captcha_response, ip)
+        if token_key is None:
+            return False
+
+        try:
+            with metrics.captcha_seconds.time():
+                content = self._get_session().post(
+                    self.verify_url,
+                    data=self._verify_form(captcha_response, ip),
+                    timeout=(self._connect_timeout, self._read_timeout)
+                ).json()
+        except (requests.RequestException, ValueError) as e:
+            logger.error("reCAPTCHA verification failed, fail_open=%s: %s", self._fail_open, e)
+            return self._fail_open
+
+        self._seen_tokens.set(token_key, True)
+        return _is_success(content)
+
+    def _get_session(self) -> requests.Session:
+        if self._session is None:
+            self._session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=0)
+            self._session.mount("https://", adapter)
+            self._session.mount("http://", adapter)
+        return self._session
+
+    # Returns the key the token is remembered under once siteverify answered for it, None if the token is empty or
+    # was already answered for. A token is only remembered after the answer, a timed out verification can be retried.
+    def _new_token_key(self, captcha_response: str, ip: str) -> typing.Optional[str]:
+        if not isinstance(captcha_response, str) or captcha_response == "":
+            return None
+
+        # Only a digest of the token is kept
+        token_key = hashlib.sha256(captcha_response.encode()).hexdigest()
+        if token_key in self._seen_tokens:
+            logger.warning('handle_captcha: rejecting reused reCAPTCHA response from ip "%s"', ip)
+            return None
+        return token_key
+
+    def _verify_form(self, captcha_response: str, ip: str) -> dict:
+        return {
+            'secret': self._secret,
+            'response': captcha_response,
+            'remoteip': ip,
+        }
+
+
+class AsyncCaptchaVerifier(CaptchaVerifier):
+    """CaptchaVerifier for the ASGI app, verify_async() makes the siteverify call with aiohttp."""
+
+    def __init__(self, *args):
+        if aiohttp is None:
+            raise ImportError("The ASGI app needs the aiohttp package")
+        super().__init__(*args)
+        self._async_session = None
+
+    async def verify_async(self, captcha_response: str, ip: str) -> bool:
+        token_key = self._new_token_key(captcha_response, ip)
+        if token_key is None:
+            return False
+
+        try:
+            with metrics.captcha_seconds.time():
+                async with self._get_async_session().post(self.verify_url,
+                                                          data=self._verify_form(captcha_response, ip)) as r:
+                    content = await r.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error("reCAPTCHA verification failed, fail_open=%s: %s", self._fail_open, e)
+            return self._fail_open
+
+        self._seen_tokens.set(token_key, True)
+        return _is_success(content)
+
+    async def close(self):
+        if self._async_session is not None:
+            await self._async_session.close()
+            self._async_session = None
+
+    def _get_async_session(self):
+        if self._async_session is None:
+            self._async_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=10),
+                timeout=aiohttp.ClientTimeout(sock_connect=self._connect_timeout, sock_read=self._read_timeout))
+        return self._async_session
+
+
+def _is_success(content) -> bool:
+    return isinstance(content, dict) and bool(content.get('success'))
+
+
+def create_captcha_verifier(verifier_class=CaptchaVerifier) -> CaptchaVerifier:
+    return verifier_class(general_cfg["captcha_verify_url"],
+                          general_cfg["captcha_secret"],
+                          general_cfg["captcha_connect_timeout_seconds"],
+                          general_cfg["captcha_read_timeout_seconds"],
+                          general_cfg["captcha_fail_open"],
+                          general_cfg["captcha_token_cache_seconds"],
+                          general_cfg["captcha_token_cache_size"])
+
+
+logger.debug('loaded')
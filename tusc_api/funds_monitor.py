@@ -0,0 +1,126 @@
+import time
+import logging
+import threading
+import typing
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+# Fee parameters are in units of the core asset scaled by current_fees.scale, 10000 being 100%
+FeeScaleOne = 10000
+
+
+class FundsMonitor:
+    """
+    Keeps the registrar account's core asset balance and the account creation fee, polled from the wallet by a
+    background thread every interval seconds (or sooner after wake()). Requests only read the last poll, so checking
+    costs no wallet call.
+
+    is_depleted() is True while the last poll found a balance that does not cover min_registrations registrations.
+    Without a poll from the last max_age seconds (the wallet is down, the thread has not polled yet) nothing is known
+    and registrations go ahead as before. The thread is started by start() or the first is_depleted(), so it runs in
+    the worker process rather than in whatever process imported this module.
+    """
+
+    def __init__(self,
+                 poll: typing.Callable[[], typing.Tuple[int, int]],
+                 interval: float,
+                 max_age: float,
+                 min_registrations: int):
+        self._poll = poll
+        self._interval = interval
+        self._max_age = max_age
+        self._min_registrations = min_registrations
+        # (balance, fee, monotonic time of the poll), replaced as a whole so readers need no lock
+        self._funds = None
+        self._poll_needed = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def is_depleted(self) -> bool:
+        self.start()
+        funds = self._current_funds()
+        if funds is None:
+            return False
+        balance, fee, polled_at = funds
+        return not self._covers(balance, fee)
+
+    def state(self) -> dict:
+        self.start()
+        funds = self._current_funds()
+        if funds is None:
+            return {"registrations_available": True, "balance": None, "account_creation_fee": None,
+                    "seconds_since_poll": None}
+
+        balance, fee, polled_at = funds
+        return {"registrations_available": self._covers(balance, fee),
+                "balance": balance,
+                "account_creation_fee": fee,
+                "seconds_since_poll": round(time.monotonic() - polled_at, 1)}
+
+    def wake(self):
+        """Polls again right away, e.g. after the chain rejected a registration for lack of funds."""
+        self._poll_needed.set()
+
+    def refresh(self) -> bool:
+        try:
+            balance, fee = self._poll()
+        except Exception as e:
+            logger.error("Failed to poll registrar funds: %s", e)
+            return False
+
+        was_covered = self._funds is None or self._covers(self._funds[0], self._funds[1])
+        self._funds = (balance, fee, time.monotonic())
+        if was_covered and not self._covers(balance, fee):
+            logger.error("Registrar balance %d does not cover the account creation fee %d, registrations are "
+                         "unavailable", balance, fee)
+        elif not was_covered and self._covers(balance, fee):
+            logger.info("Registrar balance %d covers the account creation fee %d again", balance, fee)
+        return True
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _covers(self, balance: int, fee: int) -> bool:
+        return balance >= fee * self._min_registrations
+
+    def _current_funds(self) -> typing.Optional[typing.Tuple[int, int, float]]:
+        funds = self._funds
+        if funds is None or time.monotonic() - funds[2] > self._max_age:
+            return None
+        return funds
+
+    def _run(self):
+        while True:
+            self.refresh()
+            self._poll_needed.wait(self._interval)
+            self._poll_needed.clear()
+
+
+def core_balance(balances: typing.List[dict], asset_id: str) -> int:
+    """The asset_id amount from a list_account_balances result, 0 when the account has none."""
+    for balance in balances:
+        if balance["asset_id"] == asset_id:
+            return int(balance["amount"])
+    return 0
+
+
+def account_create_fee(global_properties: dict, operation_id: int) -> int:
+    """
+    The fee for an account_create operation with a non-premium name from a get_global_properties result, plus one
+    kilobyte of transaction data.
+    """
+    current_fees = global_properties["parameters"]["current_fees"]
+    for fee_operation_id, fee_parameters in current_fees["parameters"]:
+        if fee_operation_id == operation_id:
+            fee = int(fee_parameters["basic_fee"]) + int(fee_parameters.get("price_per_kbyte", 0))
+            return fee * int(current_fees["scale"]) // FeeScaleOne
+    raise ValueError(f"No fee parameters for operation {operation_id}")
+
+
+logger.debug('loaded')
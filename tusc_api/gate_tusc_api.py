@@ -1,10 +1,22 @@
 import os
-import requests
-import json
 import logging
+import contextlib
 import typing
 import db_access.db as db
+import metrics
+import db_access.registration_writer as registration_writer
 import subprocess
+from tusc_api.wallet_rpc import create_wallet_rpc_client
+from tusc_api.wallet_supervisor import WalletSupervisor, WalletReadyResponse
+from tusc_api.wallet_router import WalletRouter, WalletInstance
+from tusc_api.brain_key_pool import BrainKeyPool
+from tusc_api import account_validator
+from tusc_api.taken_names import TakenNamesIndex
+from tusc_api.account_lookup import AccountLookup
+from tusc_api.registration_batcher import RegistrationBatcher
+from tusc_api.request_coalescer import RequestCoalescer
+from tusc_api.admission import ConcurrencyLimiter, CircuitBreaker, WalletUnavailableError
+from tusc_api.funds_monitor import FundsMonitor, core_balance, account_create_fee
 from config import tusc_api_cfg, wallet_cfg
 
 logger = logging.getLogger('root')
@@ -13,72 +25,409 @@ logger.debug('loading')
 DefaultErrorResponse = {"error": "Something went wrong, please contact tusc support"}
 InternalServerErrorResponse = {"error": "Internal server error"}
 WalletUnlockResponseNoneResult = {'result': None}
+RegistrationsUnavailableMessage = "Registrations are temporarily unavailable. Please try again later."
 
+# Chain constants used when building account_create operations ourselves
+AccountCreateOperationId = 5
+CoreAssetId = "1.3.0"
+ProxyToSelfAccountId = "1.2.5"
+OnePercent = 100
+ReferrerPercent = 75
 
-def build_request_dict(method_name: str, params: list) -> dict:
-    tusc_wallet_command_structure = {
-        "jsonrpc": tusc_api_cfg["tusc_wallet_rpc_version"],
-        "method": method_name,
-        "params": params,
-        "id": 1
-    }
-    return tusc_wallet_command_structure
 
+def suggest_brain_key() -> dict:
+    if tusc_api_cfg["brain_key_pool_enabled"]:
+        brain_key = brain_key_pool.take()
+        if brain_key is not None:
+            return {"result": brain_key}
 
-def get_tusc_url() -> str:
-    return f'http://{tusc_api_cfg["tusc_wallet_ip"]}:{tusc_api_cfg["tusc_wallet_port"]}' \
-           f'{tusc_api_cfg["tusc_wallet_rpc_endpoint"]}'
+    with _wallet_admission():
+        wallet_response = start_and_unlock_wallet()
+        if wallet_response != WalletUnlockResponseNoneResult:
+            return wallet_response
 
+        def suggest_brain_key_error_handler(api_response_json: dict, do_not_log_data: bool) -> dict:
+            pass
 
-def suggest_brain_key() -> dict:
-    wallet_response = start_and_unlock_wallet()
-    if wallet_response != WalletUnlockResponseNoneResult:
-        return wallet_response
+        api_response_json = _send_request("suggest_brain_key", [], True)
+        response = handle_generic_wallet_response(api_response_json, True, suggest_brain_key_error_handler)
+        return response
 
-    def suggest_brain_key_error_handler(api_response_json: dict, do_not_log_data: bool) -> dict:
-        pass
 
-    api_response_json = _send_request("suggest_brain_key", [], True)
-    response = handle_generic_wallet_response(api_response_json, True, suggest_brain_key_error_handler)
-    return response
+# Used by the brain key pool, results are never logged
+def _generate_brain_keys(count: int) -> typing.List[dict]:
+    with _wallet_admission():
+        wallet_response = start_and_unlock_wallet()
+        if wallet_response != WalletUnlockResponseNoneResult:
+            raise Exception("TUSC Wallet is not ready")
+
+        api_responses = _send_batch_request([("suggest_brain_key", [])] * count, True)
+    return [api_response_json["result"] for api_response_json in api_responses if "result" in api_response_json]
 
 
 def register_account(account_name: str, public_key: str, referrer: str) -> dict:
     # register_account <account_name> <owner-public_key> <active-public_key> <registrar_account>
     # <referrer_account> <referrer_percent> <broadcast>
-    account_name_restrictions = "Account names must be more than 7 and less than 64 characters. " \
-                                "They must consist of lower case characters, numbers, and '-'. " \
-                                "They cannot start with a number."
-    if len(account_name) < 8:
-        return {"error": "Account name '" + account_name + "' is too short. " + account_name_restrictions}
-    if len(account_name) > 63:
-        return {"error": "Account name '" + account_name + "' is too long. " + account_name_restrictions}
-
-    ref = tusc_api_cfg["registrar_account_name"]
-    if referrer != "":
-        ref = referrer
 
+    validation_error = check_registration_request(account_name, public_key)
+    if validation_error is not None:
+        return validation_error
+
+    if tusc_api_cfg["request_coalescing_enabled"]:
+        # Duplicate in-flight requests (double clicks, client retries) wait for and share the first one's response
+        return request_coalescer.coalesce(registration_coalescing_key(account_name, public_key),
+                                          lambda: _register_account(account_name, public_key, referrer))
+    return _register_account(account_name, public_key, referrer)
+
+
+# The checks every registration goes through before it is registered or queued, shared with gate_tusc_api_async and
+# the registration jobs. Rejects anything the chain would reject before spending a wallet round trip on it, raises
+# WalletUnavailableError while the registrar cannot pay for registrations.
+def check_registration_request(account_name: str, public_key: str) -> typing.Optional[dict]:
+    validation_error = account_validator.validate_registration(account_name, public_key)
+    if validation_error is not None:
+        return validation_error
+
+    check_funds()
+    return None
+
+
+def registration_coalescing_key(account_name: str, public_key: str) -> str:
+    return account_name + "\n" + public_key
+
+
+# Raises WalletUnavailableError while the last poll of the registrar account found it unable to pay for a
+# registration, rather than letting every registration fail at the broadcast
+def check_funds():
+    if tusc_api_cfg["funds_check_enabled"] and funds_monitor.is_depleted():
+        raise WalletUnavailableError(RegistrationsUnavailableMessage, tusc_api_cfg["funds_poll_interval_seconds"])
+
+
+# Used by the funds monitor, returns the registrar account's core asset balance and the account creation fee
+def _poll_registrar_funds() -> typing.Tuple[int, int]:
+    with _wallet_admission():
+        wallet_response = start_and_unlock_wallet()
+        if wallet_response != WalletUnlockResponseNoneResult:
+            raise Exception("TUSC Wallet is not ready")
+
+        api_responses = _send_batch_request([("list_account_balances", [tusc_api_cfg["registrar_account_name"]]),
+                                             ("get_global_properties", [])], True)
+
+    for api_response_json in api_responses:
+        if "result" not in api_response_json:
+            raise Exception(f"Error in response from TUSC api: {str(api_response_json)}")
+    balances, global_properties = (api_response_json["result"] for api_response_json in api_responses)
+    return core_balance(balances, CoreAssetId), account_create_fee(global_properties, AccountCreateOperationId)
+
+
+# Served by /health from what this worker already knows, it never calls the wallet
+def health() -> dict:
+    funds = funds_monitor.state() if tusc_api_cfg["funds_check_enabled"] else None
+    circuit_breaker_open = wallet_circuit_breaker.is_open()
+    return {"result": {
+        "registrations_available": not circuit_breaker_open and (funds is None or funds["registrations_available"]),
+        "funds": funds,
+        "wallet": {
+            "instances": len(wallet_router.instances),
+            "instances_in_rotation": wallet_router.in_rotation_count(),
+            "circuit_breaker_open": circuit_breaker_open
+        }
+    }}
+
+
+def _register_account(account_name: str, public_key: str, referrer: str) -> dict:
+    if tusc_api_cfg["registration_batch_enabled"]:
+        with _wallet_admission():
+            ref, error = _check_registration(account_name, referrer)
+        if error is not None:
+            return error
+        # Waiting for the batch holds no admission slot, _register_account_batch takes one to run the whole batch
+        response = registration_batcher.submit((account_name, public_key, ref))
+    else:
+        with _wallet_admission():
+            ref, error = _check_registration(account_name, referrer)
+            if error is not None:
+                return error
+            response = _register_single_account(account_name, public_key, ref)
+
+    if 'error' not in response:
+        registration_writer.record_completed_registration(account_name, public_key, ref)
+        _remember_registered_account(account_name)
+
+    return response
+
+
+# The name is taken from now on, whatever the caches learned about it before
+def _remember_registered_account(account_name: str):
+    taken_names.add(account_name)
+    account_lookup.forget(account_name)
+
+
+# Returns the referrer to register with, or the error response for a registration that cannot succeed
+def _check_registration(account_name: str, referrer: str) -> typing.Tuple[str, typing.Optional[dict]]:
+    if _is_account_name_taken(account_name, False):
+        return referrer, _account_name_taken_response(account_name)
+
+    return _resolve_referrer(referrer)
+
+
+def _register_single_account(account_name: str, public_key: str, ref: str) -> dict:
     wallet_response = start_and_unlock_wallet()
     if wallet_response != WalletUnlockResponseNoneResult:
         return wallet_response
 
-    wallet_api_response = _send_request("register_account",
-                             [account_name,
-                              public_key,  # Owner
-                              public_key,  # Active
-                              tusc_api_cfg["registrar_account_name"],  # Registrar
-                              ref,  # Referrer
-                              75,
-                              True], False)
+    wallet_api_response = _send_request("register_account", _register_account_params(account_name, public_key, ref),
+                                        False)
+    return _register_account_response(wallet_api_response, account_name, public_key)
+
+
+def _register_account_params(account_name: str, public_key: str, ref: str) -> list:
+    return [account_name,
+            public_key,  # Owner
+            public_key,  # Active
+            tusc_api_cfg["registrar_account_name"],  # Registrar
+            ref,  # Referrer
+            ReferrerPercent,
+            True]
 
+
+def _register_account_response(wallet_api_response: dict, account_name: str, public_key: str) -> dict:
     def register_account_error_handler(api_response_json: dict, do_not_log_data: bool) -> dict:
-        return _register_account_error_handler_imp(api_response_json, account_name, account_name_restrictions, public_key)
+        return _register_account_error_handler_imp(api_response_json, account_name,
+                                                   account_validator.AccountNameRestrictions, public_key)
 
-    response = handle_generic_wallet_response(wallet_api_response, False, register_account_error_handler)
-    if 'error' not in response:
-        db.save_completed_registration(account_name, public_key)
+    return handle_generic_wallet_response(wallet_api_response, False, register_account_error_handler)
 
-    return response
+
+# Registers (account_name, public_key, ref) tuples with one transaction of account_create operations. A transaction
+# is applied all or nothing, so when it fails each registration is retried on its own through register_account,
+# which gives every caller the error for their own registration. The batch runs in one admission slot, the
+# registrations waiting for it hold none.
+def _register_account_batch(registrations: typing.List[typing.Tuple[str, str, str]]) -> typing.List[dict]:
+    with _wallet_admission():
+        return _register_account_batch_imp(registrations)
+
+
+def _register_account_batch_imp(registrations: typing.List[typing.Tuple[str, str, str]]) -> typing.List[dict]:
+    if len(registrations) == 1:
+        return [_register_single_account(*registrations[0])]
+
+    wallet_response = start_and_unlock_wallet()
+    if wallet_response != WalletUnlockResponseNoneResult:
+        return [wallet_response] * len(registrations)
+
+    responses = [None] * len(registrations)
+    operations = []
+    for index, (account_name, public_key, ref) in enumerate(registrations):
+        operation = _account_create_operation(account_name, public_key, ref)
+        if operation is None:
+            responses[index] = _register_single_account(account_name, public_key, ref)
+        else:
+            operations.append((index, operation))
+
+    if len(operations) == 0:
+        return responses
+
+    try:
+        api_response_json = _send_builder_transaction([operation for index, operation in operations])
+    except Exception as e:
+        # The broadcast may still have gone through, e.g. when the wallet timed out after sending it
+        logger.error("Error sending batched registration: %s", e)
+        api_response_json = None
+
+    if api_response_json is not None and "result" in api_response_json:
+        logger.debug("Registered %d accounts in one transaction", len(operations))
+        for operation_index, (index, operation) in enumerate(operations):
+            responses[index] = {"result": _own_batch_result(api_response_json["result"], operation_index)}
+        return responses
+
+    logger.error("Batched registration failed, registering accounts one by one")
+    logger.error("Command response: %s", api_response_json)
+    for index, operation in operations:
+        account_name, public_key, ref = registrations[index]
+        # Otherwise an account the failed (or only seemingly failed) transaction did create would come back as taken
+        if _is_registered_with_key(account_name, public_key):
+            logger.info("Account %s was registered by the batch after all", account_name)
+            responses[index] = {"result": {"operations": [operation]}}
+        else:
+            responses[index] = _register_single_account(account_name, public_key, ref)
+    return responses
+
+
+# The transaction of a batch holds everyone's registrations, each caller only gets its own operation back
+def _own_batch_result(transaction: dict, operation_index: int) -> dict:
+    result = {key: value for key, value in transaction.items()
+              if key not in ("operations", "operation_results", "signatures")}
+    result["operations"] = [transaction["operations"][operation_index]]
+    if "operation_results" in transaction:
+        result["operation_results"] = [transaction["operation_results"][operation_index]]
+    return result
+
+
+# Whether account_name exists on chain with public_key as its owner key. Asks the wallet, account_lookup's cache may
+# not know about accounts created moments ago.
+def _is_registered_with_key(account_name: str, public_key: str) -> bool:
+    try:
+        api_response_json = _send_request("get_account", [account_name], True)
+    except Exception as e:
+        logger.error("Error looking up account %s: %s", account_name, e)
+        return False
+
+    # get_account fails for unknown names
+    if "result" not in api_response_json:
+        return False
+    key_auths = api_response_json["result"].get("owner", {}).get("key_auths", [])
+    return any(key_auth[0] == public_key for key_auth in key_auths)
+
+
+# The operation the wallet's register_account builds. Returns None when the registrar or referrer cannot be resolved
+# to an account id, register_account reports that error itself.
+def _account_create_operation(account_name: str, public_key: str, ref: str) -> typing.Optional[list]:
+    try:
+        registrar_id = account_lookup.get_account_id(tusc_api_cfg["registrar_account_name"])
+        referrer_id = account_lookup.get_account_id(ref)
+    except Exception as e:
+        logger.error("Error looking up registrar or referrer: %s", e)
+        return None
+
+    if registrar_id is None or referrer_id is None:
+        return None
+
+    authority = {"weight_threshold": 1, "account_auths": [], "key_auths": [[public_key, 1]], "address_auths": []}
+    return [AccountCreateOperationId, {
+        "fee": {"amount": 0, "asset_id": CoreAssetId},
+        "registrar": registrar_id,
+        "referrer": referrer_id,
+        "referrer_percent": ReferrerPercent * OnePercent,
+        "name": account_name,
+        "owner": authority,
+        "active": authority,
+        "options": {
+            "memo_key": public_key,
+            "voting_account": ProxyToSelfAccountId,
+            "num_witness": 0,
+            "num_committee": 0,
+            "votes": [],
+            "extensions": []
+        },
+        "extensions": {}
+    }]
+
+
+# Builder transactions only exist in the wallet that began them, every call below goes to the instance the request
+# was routed to
+def _send_builder_transaction(operations: typing.List[list]) -> dict:
+    api_response_json = _send_request("begin_builder_transaction", [], False)
+    if "result" not in api_response_json:
+        return api_response_json
+
+    handle = api_response_json["result"]
+    try:
+        api_responses = _send_batch_request(
+            [("add_operation_to_builder_transaction", [handle, operation]) for operation in operations], False)
+        for api_response_json in api_responses:
+            if "result" not in api_response_json:
+                return api_response_json
+
+        api_response_json = _send_request("set_fees_on_builder_transaction", [handle, CoreAssetId], False)
+        if "result" not in api_response_json:
+            return api_response_json
+
+        return _send_request("sign_builder_transaction", [handle, True], False)
+    finally:
+        try:
+            _send_request("remove_builder_transaction", [handle], True)
+        except Exception as e:
+            logger.error("Error removing builder transaction: %s", e)
+
+
+def account_available(account_name: str) -> dict:
+    validation_error = account_validator.validate_account_name(account_name)
+    if validation_error is not None:
+        return validation_error
+
+    with _wallet_admission():
+        taken = _is_account_name_taken(account_name, True)
+    if taken is None:
+        return DefaultErrorResponse
+
+    return {"result": {"account_name": account_name, "available": not taken}}
+
+
+# Returns None when the wallet could not be asked. Names that are neither known as taken nor in the taken names
+# Bloom filter are only looked up on chain when always_confirm is set.
+def _is_account_name_taken(account_name: str, always_confirm: bool) -> typing.Optional[bool]:
+    taken_names.seed(db.iter_registered_account_names)
+
+    if taken_names.is_known_taken(account_name):
+        return True
+
+    if not always_confirm:
+        if not tusc_api_cfg["taken_names_confirm_with_wallet"] or not taken_names.might_be_taken(account_name):
+            return False
+
+    wallet_response = start_and_unlock_wallet()
+    if wallet_response != WalletUnlockResponseNoneResult:
+        return None
+
+    try:
+        taken = account_lookup.exists(account_name)
+    except Exception as e:
+        logger.error("Error looking up account name: %s", e)
+        return None
+
+    if taken:
+        taken_names.add(account_name)
+    return taken
+
+
+# Returns the account to register with as referrer, or an error response. An unknown referrer would only fail the
+# broadcast, so it is caught here: rejected, or replaced by tusc_api:registrar_account_name with
+# referrer_validation_action "fallback". Allowlisted referrers and those account_lookup has cached cost no wallet call.
+def _resolve_referrer(referrer: str) -> typing.Tuple[str, typing.Optional[dict]]:
+    registrar = tusc_api_cfg["registrar_account_name"]
+    if referrer == "" or referrer == registrar:
+        return registrar, None
+    if not tusc_api_cfg["referrer_validation_enabled"] or referrer in referrer_allowlist:
+        return referrer, None
+
+    exists = False
+    if account_validator.is_valid_name(referrer):
+        exists = account_lookup.cached_exists(referrer)
+        if exists is None:
+            wallet_response = start_and_unlock_wallet()
+            if wallet_response != WalletUnlockResponseNoneResult:
+                return registrar, wallet_response
+
+            try:
+                exists = account_lookup.exists(referrer)
+            except Exception as e:
+                logger.error("Error looking up referrer: %s", e)
+                return registrar, DefaultErrorResponse
+
+    if exists:
+        return referrer, None
+
+    if tusc_api_cfg["referrer_validation_action"] == "fallback":
+        logger.info("Unknown referrer '%s', registering with %s as referrer instead", referrer, registrar)
+        metrics.invalid_referrers.inc("fallback")
+        return registrar, None
+
+    logger.info("Unknown referrer '%s', rejecting the registration", referrer)
+    metrics.invalid_referrers.inc("reject")
+    return registrar, {"error": "Referrer '" + referrer + "' is not a TUSC account."}
+
+
+def _account_name_taken_response(account_name: str) -> dict:
+    return {"error": "Account name '" + account_name + "' already in use. Please use a different account name."}
+
+
+# Errors decided by the registration request alone (name taken, invalid name or public key, missing fields), the same
+# request always gets the same answer. Captcha, rate limit, busy and unavailable errors may go away on a retry.
+def is_final_registration_error(response: dict) -> bool:
+    error = response.get("error", "")
+    return error.startswith("Account name '") or error.startswith("The public key '") \
+        or error == "Expected account_name and public_key in json string"
 
 
 def _register_account_error_handler_imp(api_response_json: dict,
@@ -90,54 +439,76 @@ def _register_account_error_handler_imp(api_response_json: dict,
             for stack_obj in api_response_json["error"]["data"]["stack"]:
                 if "format" in stack_obj:
                     if "rec && rec->name" in stack_obj["format"]:
-                        return {"error": "Account name '" + account_name + "' already in use. "
-                                                                           "Please use a different account name."}
+                        metrics.wallet_errors.inc("account_name_taken")
+                        taken_names.add(account_name)
+                        return _account_name_taken_response(account_name)
 
                     if "is_valid_name(name" in stack_obj["format"]:
                         logger.error("Account name already exists")
+                        metrics.wallet_errors.inc("invalid_account_name")
                         return {"error": "Account name '" + account_name + "' is invalid. " +
                                          account_name_restrictions}
 
+                    if "Insufficient Balance" in stack_obj["format"]:
+                        logger.error("The registrar account cannot pay for the registration")
+                        metrics.wallet_errors.inc("insufficient_balance")
+                        funds_monitor.wake()
+                        return {"error": RegistrationsUnavailableMessage}
+
                     if "base58str.size() > prefix_len:" in stack_obj["format"]:
                         logger.error("Public key error")
+                        metrics.wallet_errors.inc("invalid_public_key")
                         return {"error": "The public key '" + public_key + "' is invalid. Please double check "
                                                                            "that it is correct and resubmit."}
 
+    metrics.wallet_errors.inc("unclassified")
     return DefaultErrorResponse
 
 
-def unlock_wallet(password: str) -> dict:
-    api_response_json = _send_request("unlock", [password], True)
-    return handle_generic_wallet_response(api_response_json, True, None)
-
+# Wraps everything a request does with the wallet and routes it to one wallet instance. Raises
+# WalletUnavailableError while the circuit breaker is open or too many requests are already waiting for the wallet.
+@contextlib.contextmanager
+def _wallet_admission():
+    wallet_circuit_breaker.check()
+    with wallet_concurrency_limiter.slot(), wallet_router.route():
+        yield
 
-def _send_request(method_name: str, params: list, do_not_log_data=False) -> dict:
-    req = build_request_dict(method_name, params)
 
-    # POST with JSON
-    command_json = json.dumps(req)
-    logger.debug("Sending command to TUSC wallet")
+# Takes the request's wallet instance out of rotation. The circuit breaker only counts failures while no instance is
+# left, one broken wallet out of several does not make the service unavailable.
+def _record_wallet_failure():
+    instance = wallet_router.current()
+    if instance is not None:
+        instance.supervisor.mark_unhealthy()
+        wallet_router.eject(instance)
+    if wallet_router.in_rotation_count() == 0:
+        wallet_circuit_breaker.record_failure()
 
-    if do_not_log_data is False:
-        logger.debug("Command payload: " + str(command_json))
 
-    url = get_tusc_url()
+def unlock_wallet(password: str) -> dict:
+    with metrics.wallet_unlock_seconds.time():
+        api_response_json = _send_request("unlock", [password], True)
+    return handle_generic_wallet_response(api_response_json, True, None)
 
-    logger.debug("posting to: " + str(url))
 
-    try:
-        r = requests.post(url, data=command_json)
-    except Exception as err:
-        logger.error(err)
-        raise err
+def _send_request(method_name: str, params: list, do_not_log_data=False) -> dict:
+    with wallet_router.route() as instance:
+        try:
+            with metrics.wallet_rpc_seconds.time(method_name):
+                return instance.client.call(method_name, params, do_not_log_data)
+        except Exception as err:
+            _record_wallet_failure()
+            raise err
 
-    try:
-        api_response_json = json.loads(r.text)
-        return api_response_json
 
-    except json.JSONDecodeError as err:
-        logger.error(err)
-        raise err
+def _send_batch_request(calls: typing.List[typing.Tuple[str, list]], do_not_log_data=False) -> typing.List[dict]:
+    with wallet_router.route() as instance:
+        try:
+            with metrics.wallet_rpc_seconds.time("batch"):
+                return instance.client.batch(calls, do_not_log_data)
+        except Exception as err:
+            _record_wallet_failure()
+            raise err
 
 
 def handle_generic_wallet_response(
@@ -148,11 +519,12 @@ def handle_generic_wallet_response(
 
     if "result" in api_response_json.keys():
         if do_not_log_data is False:
-            logger.debug("Command response: " + str(api_response_json))
+            logger.debug("Command response: %s", api_response_json)
         response = {"result": api_response_json["result"]}
+        wallet_circuit_breaker.record_success()
     elif "error" in api_response_json.keys():
         logger.error("Error in response from TUSC api")
-        logger.error("Command response: " + str(api_response_json))
+        logger.error("Command response: %s", api_response_json)
         response = handle_generic_tusc(api_response_json)
 
     if error_handler_func is not None and response is None:
@@ -160,7 +532,8 @@ def handle_generic_wallet_response(
 
     if response is None:
         logger.error("Unsure what happened with TUSC API")
-        logger.error("Command response: " + str(api_response_json))
+        metrics.wallet_errors.inc("unclassified")
+        logger.error("Command response: %s", api_response_json)
         response = DefaultErrorResponse
 
     return response
@@ -175,12 +548,15 @@ def handle_generic_tusc(api_response_json: dict) -> dict:
                     # Wallet is locked
                     if "is_locked" in stack_obj["format"]:
                         logger.error("Cannot perform operation, TUSC Wallet is locked")
+                        metrics.wallet_errors.inc("is_locked")
+                        _record_wallet_failure()
                         return DefaultErrorResponse
 
                     # Incorrect password used on wallet
                     if "during aes 256" in stack_obj["format"]:
                         logger.error("Cannot perform operation, "
                                      "incorrect wallet password, TUSC Wallet cannot be unlocked")
+                        metrics.wallet_errors.inc("incorrect_password")
                         return DefaultErrorResponse
 
                 if "data" in stack_obj:
@@ -188,13 +564,20 @@ def handle_generic_tusc(api_response_json: dict) -> dict:
                         if "invalid state" in stack_obj["data"]["msg"]:
                             # Wallet in invalid state, needs to be restarted.
                             logger.error("Cannot perform operation, TUSC Wallet is in invalid state")
+                            metrics.wallet_errors.inc("invalid_state")
+                            _record_wallet_failure()
                             return DefaultErrorResponse
 
     return None
 
 
-def start_wallet() -> subprocess:
-    logger.info("Starting TUSC Wallet")
+def start_wallet(index: int = 0) -> subprocess:
+    with metrics.wallet_start_seconds.time():
+        return _start_wallet(wallet_cfg["instances"][index])
+
+
+def _start_wallet(instance_cfg: dict) -> subprocess:
+    logger.info("Starting TUSC Wallet on port %s", instance_cfg['port'])
 
     wallet_proc = subprocess.Popen(
         [
@@ -204,9 +587,9 @@ def start_wallet() -> subprocess:
             '--chain-id',
             wallet_cfg["chain_id"],
             '-H',
-            '0.0.0.0:5071',
+            f'0.0.0.0:{instance_cfg["port"]}',
             '-w',
-            os.path.expanduser(wallet_cfg["wallet_config_file"]),
+            os.path.expanduser(instance_cfg["wallet_config_file"]),
         ],
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
@@ -218,7 +601,7 @@ def start_wallet() -> subprocess:
     for x in range(4):
         wallet_stderr = wallet_proc.stderr.readline().decode('ascii').rstrip()
 
-        logger.info(f"TUSC Wallet stderr: {wallet_stderr}")
+        logger.info("TUSC Wallet stderr: %s", wallet_stderr)
         if successfully_started_message in wallet_stderr:
             logger.info("TUSC Wallet started successfully")
             return wallet_proc
@@ -229,14 +612,113 @@ def start_wallet() -> subprocess:
     raise TimeoutError("Timed out while waiting for TUSC wallet to start")
 
 
+# Only starts/unlocks the request's wallet instance when its supervisor finds it down, locked or in an invalid state,
+# so on the request path this usually costs nothing.
 def start_and_unlock_wallet() -> dict:
-    try:
-        start_wallet()
-    except Exception as e:
-        logger.error(f"Error starting wallet: {str(e)}")
-        return DefaultErrorResponse
+    with wallet_router.route() as instance:
+        try:
+            return instance.supervisor.ensure_ready()
+        except Exception as e:
+            logger.error("Error starting wallet: %s", e)
+            _record_wallet_failure()
+            return DefaultErrorResponse
+
+
+# Restarts every wallet instance, returns the first error if any of them failed
+def restart_wallet() -> dict:
+    response = WalletUnlockResponseNoneResult
+    for instance in wallet_router.instances:
+        with wallet_router.pin(instance):
+            try:
+                instance_response = instance.supervisor.restart()
+            except Exception as e:
+                logger.error("Error restarting wallet: %s", e)
+                instance_response = DefaultErrorResponse
+        if response == WalletUnlockResponseNoneResult:
+            response = instance_response
+    return response
+
 
-    return unlock_wallet(wallet_cfg["wallet_password"])
+def _recover_wallet(instance: WalletInstance) -> bool:
+    return instance.supervisor.ensure_ready() == WalletReadyResponse
+
+
+# wallet:pid_file and wallet:lock_file with the instance's port, e.g. /tmp/tusc-registrar-wallet-5071.pid
+def _instance_file(path: str, port: int) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}-{port}{ext}"
+
+
+def _create_wallet_instance(index: int, instance_cfg: dict) -> WalletInstance:
+    client = create_wallet_rpc_client(instance_cfg["port"])
+    # The supervisor is only ever used with its own instance routed, so the unlock goes to that instance. The health
+    # check calls the instance's client directly, a wallet the check finds down is what the supervisor is there to
+    # recover and is no request failure for the router or the circuit breaker.
+    supervisor = WalletSupervisor(
+        lambda: start_wallet(index),
+        lambda method_name, params: client.call(method_name, params, True),
+        lambda: unlock_wallet(wallet_cfg["wallet_password"]),
+        _instance_file(wallet_cfg["pid_file"], instance_cfg["port"]),
+        _instance_file(wallet_cfg["lock_file"], instance_cfg["port"]))
+    return WalletInstance(index, instance_cfg["port"], client, supervisor)
+
+
+wallet_router = WalletRouter(
+    [_create_wallet_instance(index, instance_cfg) for index, instance_cfg in enumerate(wallet_cfg["instances"])],
+    _recover_wallet,
+    wallet_cfg["recovery_retry_seconds"])
+brain_key_pool = BrainKeyPool(
+    _generate_brain_keys,
+    tusc_api_cfg["brain_key_pool_size"],
+    tusc_api_cfg["brain_key_pool_low_water"],
+    tusc_api_cfg["brain_key_pool_refill_batch"],
+    tusc_api_cfg["brain_key_pool_retry_seconds"])
+taken_names = TakenNamesIndex(
+    tusc_api_cfg["taken_names_capacity"],
+    tusc_api_cfg["taken_names_error_rate"],
+    tusc_api_cfg["taken_names_lru_size"])
+account_lookup = AccountLookup(
+    lambda method_name, params: _send_request(method_name, params, False),
+    tusc_api_cfg["account_lookup_cache_seconds"],
+    tusc_api_cfg["account_lookup_cache_size"],
+    tusc_api_cfg["account_lookup_negative_cache_seconds"])
+referrer_allowlist = frozenset(tusc_api_cfg["referrer_allowlist"])
+wallet_concurrency_limiter = ConcurrencyLimiter(
+    tusc_api_cfg["wallet_admission_lock_dir"],
+    tusc_api_cfg["wallet_max_concurrent_requests"],
+    tusc_api_cfg["wallet_max_queued_requests"],
+    tusc_api_cfg["wallet_queue_timeout_seconds"],
+    tusc_api_cfg["wallet_busy_retry_after_seconds"])
+wallet_circuit_breaker = CircuitBreaker(
+    tusc_api_cfg["wallet_circuit_breaker_failure_threshold"],
+    tusc_api_cfg["wallet_circuit_breaker_open_seconds"])
+request_coalescer = RequestCoalescer(
+    tusc_api_cfg["request_coalescing_lock_dir"],
+    tusc_api_cfg["request_coalescing_wait_seconds"],
+    tusc_api_cfg["idempotency_key_ttl_seconds"])
+funds_monitor = FundsMonitor(
+    _poll_registrar_funds,
+    tusc_api_cfg["funds_poll_interval_seconds"],
+    tusc_api_cfg["funds_max_age_seconds"],
+    tusc_api_cfg["funds_min_registrations"])
+registration_batcher = RegistrationBatcher(
+    _register_account_batch,
+    tusc_api_cfg["registration_batch_max_size"],
+    tusc_api_cfg["registration_batch_window_ms"])
+
+metrics.registry.gauge("tusc_wallet_process_up", "cli_wallet processes running on this host",
+                       lambda: sum(1 for i in wallet_router.instances if i.supervisor.is_wallet_running()))
+metrics.registry.gauge("tusc_wallet_needs_check", "Wallet instances the next request will check (and restart)",
+                       lambda: sum(1 for i in wallet_router.instances if i.supervisor.needs_check()))
+metrics.registry.gauge("tusc_wallet_instances_in_rotation", "Wallet instances requests are routed to",
+                       wallet_router.in_rotation_count)
+metrics.registry.gauge("tusc_wallet_circuit_breaker_open", "1 while the wallet circuit breaker is open",
+                       lambda: 1 if wallet_circuit_breaker.is_open() else 0)
+if tusc_api_cfg["funds_check_enabled"]:
+    metrics.registry.gauge("tusc_registrations_funded", "0 while the registrar account cannot pay for registrations",
+                           lambda: 0 if funds_monitor.is_depleted() else 1)
+metrics.registry.gauge("tusc_brain_key_pool_size", "Pre-generated brain keys available",
+                       lambda: len(brain_key_pool))
 
 
 logger.debug('loaded')
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import functools
+import contextlib
+import contextvars
+import typing
+import db_access.async_db as async_db
+import db_access.registration_writer as registration_writer
+from tusc_api import gate_tusc_api as gate
+from tusc_api import account_validator
+from tusc_api.wallet_rpc import AsyncWalletRpcClient, get_tusc_url
+from tusc_api.admission import ConcurrencyLimiter
+from config import cfg, tusc_api_cfg
+import metrics
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+db_cfg = cfg["db"]
+
+# asyncio versions of the gate_tusc_api entry points for the ASGI app. The wallet RPCs, reCAPTCHA and database calls
+# of a request are awaited, everything else (brain key pool, taken names, supervisor, admission control, coalescing)
+# is shared with gate_tusc_api. Starting/unlocking the wallet and on-chain account lookups are rare and blocking, they
+# run in the default executor. Registrations are not batched here, registration_batch_enabled only applies to the
+# sync gate.
+
+
+# asyncio.to_thread, which needs Python 3.9. Runs func in the default executor with a copy of the context, so the
+# instance wallet_router.route() picked follows the call into the thread.
+async def run_in_thread(func: typing.Callable, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(contextvars.copy_context().run, func, *args))
+
+
+async def suggest_brain_key() -> dict:
+    if tusc_api_cfg["brain_key_pool_enabled"]:
+        brain_key = gate.brain_key_pool.take()
+        if brain_key is not None:
+            return {"result": brain_key}
+
+    async with _wallet_admission():
+        wallet_response = await start_and_unlock_wallet()
+        if wallet_response != gate.WalletUnlockResponseNoneResult:
+            return wallet_response
+
+        api_response_json = await _send_request("suggest_brain_key", [], True)
+        return gate.handle_generic_wallet_response(api_response_json, True, None)
+
+
+async def register_account(account_name: str, public_key: str, referrer: str) -> dict:
+    validation_error = gate.check_registration_request(account_name, public_key)
+    if validation_error is not None:
+        return validation_error
+
+    if tusc_api_cfg["request_coalescing_enabled"]:
+        return await gate.request_coalescer.coalesce_async(
+            gate.registration_coalescing_key(account_name, public_key),
+            lambda: _register_account(account_name, public_key, referrer))
+    return await _register_account(account_name, public_key, referrer)
+
+
+# gate_tusc_api._register_account without batching, with the wallet call awaited
+async def _register_account(account_name: str, public_key: str, referrer: str) -> dict:
+    async with _wallet_admission():
+        ref, error = await run_in_thread(gate._check_registration, account_name, referrer)
+        if error is not None:
+            return error
+
+        wallet_response = await start_and_unlock_wallet()
+        if wallet_response != gate.WalletUnlockResponseNoneResult:
+            return wallet_response
+
+        wallet_api_response = await _send_request("register_account",
+                                                  gate._register_account_params(account_name, public_key, ref), False)
+        response = gate._register_account_response(wallet_api_response, account_name, public_key)
+
+    if 'error' not in response:
+        await _record_completed_registration(account_name, public_key, ref)
+        gate._remember_registered_account(account_name)
+
+    return response
+
+
+async def account_available(account_name: str) -> dict:
+    validation_error = account_validator.validate_account_name(account_name)
+    if validation_error is not None:
+        return validation_error
+
+    async with _wallet_admission():
+        taken = await run_in_thread(gate._is_account_name_taken, account_name, True)
+    if taken is None:
+        return gate.DefaultErrorResponse
+
+    return {"result": {"account_name": account_name, "available": not taken}}
+
+
+@contextlib.asynccontextmanager
+async def _wallet_admission():
+    gate.wallet_circuit_breaker.check()
+    async with wallet_concurrency_limiter.slot_async():
+        with gate.wallet_router.route():
+            yield
+
+
+async def start_and_unlock_wallet() -> dict:
+    return await run_in_thread(gate.start_and_unlock_wallet)
+
+
+async def _send_request(method_name: str, params: list, do_not_log_data=False) -> dict:
+    with gate.wallet_router.route() as instance:
+        try:
+            with metrics.wallet_rpc_seconds.time(method_name):
+                return await wallet_rpc_clients[instance.index].call(method_name, params, do_not_log_data)
+        except Exception as err:
+            gate._record_wallet_failure()
+            raise err
+
+
+async def _record_completed_registration(account_name: str, public_key: str, ref: str):
+    if db_cfg["write_behind_enabled"]:
+        # Appends to the spool file, the flusher thread saves it
+        await run_in_thread(registration_writer.record_completed_registration, account_name, public_key, ref)
+    else:
+        await async_db.save_completed_registration(account_name, public_key, ref)
+
+
+async def close():
+    for wallet_rpc_client in wallet_rpc_clients:
+        await wallet_rpc_client.close()
+
+
+# The same slot files as gate_tusc_api.wallet_concurrency_limiter with a longer queue, see
+# tusc_api:wallet_max_queued_requests_async
+wallet_concurrency_limiter = ConcurrencyLimiter(
+    tusc_api_cfg["wallet_admission_lock_dir"],
+    tusc_api_cfg["wallet_max_concurrent_requests"],
+    tusc_api_cfg["wallet_max_queued_requests_async"],
+    tusc_api_cfg["wallet_queue_timeout_seconds"],
+    tusc_api_cfg["wallet_busy_retry_after_seconds"])
+
+# One per wallet instance, by index. Always HTTP, the cli_wallet serves HTTP and WebSocket on the same endpoint
+wallet_rpc_clients = [AsyncWalletRpcClient(get_tusc_url(instance.port)) for instance in gate.wallet_router.instances]
+
+
+logger.debug('loaded')
@@ -0,0 +1,257 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+import collections
+import itertools
+import ipaddress
+import typing
+import db_access.db as db
+from config import general_cfg
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+# (key, reservation id) as returned by reserve_many, release_many removes exactly these reservations and never one
+# another request made for the same key. Lists work as well, reservations stored as JSON come back as lists.
+Reservation = typing.Tuple[str, int]
+
+
+class MemoryRateLimiter:
+    """
+    Per-process limiter, only correct with a single worker. Reservations are kept in the order they expire (the
+    window is the same for all of them) so expired ones are dropped from the front and memory only holds the
+    reservations made within the last window.
+    """
+
+    def __init__(self, window_seconds: float):
+        self._window = window_seconds
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        # key -> deque of (expires_at, reservation id)
+        self._reservations = {}
+        # (expires_at, key, reservation id), oldest first
+        self._expiry_order = collections.deque()
+
+    def is_allowed(self, key: str, limit: int = 1) -> bool:
+        with self._lock:
+            self._purge(time.time())
+            return len(self._reservations.get(key, ())) < limit
+
+    def reserve(self, key: str, limit: int = 1) -> bool:
+        return self.reserve_many([(key, limit)])[0] is None
+
+    def reserve_many(self, keys_and_limits: typing.List[typing.Tuple[str, int]]) \
+            -> typing.Tuple[typing.Optional[str], typing.List[Reservation]]:
+        with self._lock:
+            now = time.time()
+            self._purge(now)
+            for key, limit in keys_and_limits:
+                if len(self._reservations.get(key, ())) >= limit:
+                    return key, []
+
+            reservations = []
+            for key, limit in keys_and_limits:
+                reservation = (now + self._window, next(self._ids))
+                self._reservations.setdefault(key, collections.deque()).append(reservation)
+                self._expiry_order.append((reservation[0], key, reservation[1]))
+                reservations.append((key, reservation[1]))
+            return None, reservations
+
+    def release_many(self, reservations: typing.List[Reservation]):
+        with self._lock:
+            for key, reservation_id in reservations:
+                key_reservations = self._reservations.get(key)
+                if not key_reservations:
+                    continue
+                # Already gone if it expired
+                for reservation in key_reservations:
+                    if reservation[1] == reservation_id:
+                        key_reservations.remove(reservation)
+                        break
+                if len(key_reservations) == 0:
+                    del self._reservations[key]
+
+    def _purge(self, now: float):
+        while len(self._expiry_order) > 0 and self._expiry_order[0][0] <= now:
+            expires_at, key, reservation_id = self._expiry_order.popleft()
+            key_reservations = self._reservations.get(key)
+            # Released reservations are already gone from the key's deque
+            if key_reservations and key_reservations[0][1] == reservation_id:
+                key_reservations.popleft()
+                if len(key_reservations) == 0:
+                    del self._reservations[key]
+
+
+class SqliteRateLimiter:
+    """
+    Limiter shared by every worker on the host through a SQLite file. Reservations are rows with an expiry time,
+    reserve() counts and inserts inside one write transaction so concurrent workers cannot both take the last slot.
+    Expired rows are deleted as part of reserve() so the table only holds the current window.
+    """
+
+    def __init__(self, path: str, window_seconds: float):
+        self._path = path
+        self._window = window_seconds
+        self._local = threading.local()
+
+        conn = self._connection()
+        with conn:
+            conn.execute("create table if not exists rate_limit_reservations ("
+                         "id integer primary key autoincrement, "
+                         "reservation_key text not null, "
+                         "expires_at real not null)")
+            conn.execute("create index if not exists rate_limit_reservations_key_idx "
+                         "on rate_limit_reservations (reservation_key, expires_at)")
+            conn.execute("create index if not exists rate_limit_reservations_expires_at_idx "
+                         "on rate_limit_reservations (expires_at)")
+
+    def is_allowed(self, key: str, limit: int = 1) -> bool:
+        cur = self._connection().execute("select count(*) from rate_limit_reservations "
+                                         "where reservation_key = ? and expires_at > ?", (key, time.time()))
+        return cur.fetchone()[0] < limit
+
+    def reserve(self, key: str, limit: int = 1) -> bool:
+        return self.reserve_many([(key, limit)])[0] is None
+
+    def reserve_many(self, keys_and_limits: typing.List[typing.Tuple[str, int]]) \
+            -> typing.Tuple[typing.Optional[str], typing.List[Reservation]]:
+        conn = self._connection()
+        now = time.time()
+        conn.execute("begin immediate")
+        try:
+            conn.execute("delete from rate_limit_reservations where expires_at <= ?", (now,))
+            for key, limit in keys_and_limits:
+                count = conn.execute("select count(*) from rate_limit_reservations where reservation_key = ?",
+                                     (key,)).fetchone()[0]
+                if count >= limit:
+                    conn.execute("commit")
+                    return key, []
+
+            reservations = []
+            for key, limit in keys_and_limits:
+                cur = conn.execute("insert into rate_limit_reservations (reservation_key, expires_at) values (?, ?)",
+                                   (key, now + self._window))
+                reservations.append((key, cur.lastrowid))
+            conn.execute("commit")
+            return None, reservations
+        except Exception:
+            conn.execute("rollback")
+            raise
+
+    def release_many(self, reservations: typing.List[Reservation]):
+        conn = self._connection()
+        with conn:
+            conn.executemany("delete from rate_limit_reservations where id = ? and reservation_key = ?",
+                             [(reservation_id, key) for key, reservation_id in reservations])
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None so transactions are only the ones opened explicitly with "begin immediate"
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            conn.execute("pragma journal_mode=wal")
+            self._local.conn = conn
+        return conn
+
+
+class PostgresRateLimiter:
+    """
+    Limiter shared by every worker on every host through the tusc_rate_limit_reservations table (see
+    0004-rate-limits.sql). A transaction-scoped advisory lock on the key serializes reserve() for the same key, and
+    every reserve() deletes a bounded number of expired rows so the table only holds about one window.
+    """
+
+    def __init__(self, window_seconds: float):
+        self._window = window_seconds
+
+    def is_allowed(self, key: str, limit: int = 1) -> bool:
+        with db.get_database_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("select count(*) from tusc_rate_limit_reservations "
+                        "where reservation_key = %s and expires_at > (now() at time zone 'utc')", (key,))
+            count = cur.fetchone()[0]
+            conn.commit()
+        return count < limit
+
+    def reserve(self, key: str, limit: int = 1) -> bool:
+        return self.reserve_many([(key, limit)])[0] is None
+
+    def reserve_many(self, keys_and_limits: typing.List[typing.Tuple[str, int]]) \
+            -> typing.Tuple[typing.Optional[str], typing.List[Reservation]]:
+        with db.get_database_connection() as conn:
+            cur = conn.cursor()
+            # Locks are always taken in the same order so two requests sharing keys cannot deadlock
+            for key in sorted(key for key, limit in keys_and_limits):
+                cur.execute("select pg_advisory_xact_lock(hashtext(%s))", (key,))
+            # Bounded so a single request never pays for clearing a large backlog of expired rows
+            cur.execute("delete from tusc_rate_limit_reservations where id in "
+                        "(select id from tusc_rate_limit_reservations "
+                        "where expires_at <= (now() at time zone 'utc') limit 100)")
+            for key, limit in keys_and_limits:
+                cur.execute("select count(*) from tusc_rate_limit_reservations "
+                            "where reservation_key = %s and expires_at > (now() at time zone 'utc')", (key,))
+                if cur.fetchone()[0] >= limit:
+                    conn.commit()
+                    return key, []
+
+            reservations = []
+            for key, limit in keys_and_limits:
+                cur.execute("insert into tusc_rate_limit_reservations (reservation_key, expires_at) "
+                            "values (%s, (now() at time zone 'utc') + %s * interval '1 second') returning id",
+                            (key, self._window))
+                reservations.append((key, cur.fetchone()[0]))
+            conn.commit()
+            return None, reservations
+
+    def release_many(self, reservations: typing.List[Reservation]):
+        with db.get_database_connection() as conn:
+            cur = conn.cursor()
+            for key, reservation_id in reservations:
+                cur.execute("delete from tusc_rate_limit_reservations where id = %s and reservation_key = %s",
+                            (reservation_id, key))
+            conn.commit()
+
+
+def rate_limit_keys(ip_address: str) -> typing.List[typing.Tuple[str, int]]:
+    """
+    The (key, limit) reservations a registration from ip_address needs: one for the address itself and, when
+    configured, one for the IPv4/IPv6 prefix it belongs to. Prefix keys are the network address as an integer so
+    every address in the prefix maps to the same key in constant time.
+    """
+    keys_and_limits = [(ip_address, 1)]
+
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return keys_and_limits
+
+    if isinstance(address, ipaddress.IPv4Address):
+        prefix_length, quota = general_cfg["ipv4_prefix_length"], general_cfg["ipv4_prefix_quota"]
+    else:
+        prefix_length, quota = general_cfg["ipv6_prefix_length"], general_cfg["ipv6_prefix_quota"]
+
+    if quota > 0:
+        network = int(address) >> (address.max_prefixlen - prefix_length)
+        keys_and_limits.append((f"v{address.version}/{prefix_length}:{network}", quota))
+
+    return keys_and_limits
+
+
+def create_rate_limiter():
+    window_seconds = general_cfg["ip_request_blocking_hours"] * 60 * 60
+    backend = general_cfg["ip_rate_limiter_backend"]
+
+    if backend == "memory":
+        return MemoryRateLimiter(window_seconds)
+    if backend == "sqlite":
+        return SqliteRateLimiter(os.path.join(os.getcwd(), general_cfg["ip_rate_limiter_sqlite_path"]),
+                                 window_seconds)
+    if backend == "postgres":
+        return PostgresRateLimiter(window_seconds)
+
+    raise Exception(f"Unknown general:ip_rate_limiter_backend '{backend}'")
+
+
+logger.debug('loaded')
@@ -0,0 +1,83 @@
+import time
+import logging
+import threading
+import typing
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class RegistrationBatcher:
+    """
+    Groups registrations submitted within window_ms of each other, at most max_size at a time, and hands each group
+    to register_batch, which returns one response per registration in the same order.
+
+    There is no background thread: the first registration of a batch waits out the window and then runs the whole
+    batch, the others wait for it. submit() returns the caller's own response, and re-raises in every caller if
+    register_batch raised. Batches only form between concurrent requests of one process, so this pays off with
+    threaded workers or the registration job pool, not with one sync worker handling one request at a time.
+    """
+
+    def __init__(self,
+                 register_batch: typing.Callable[[list], typing.List[dict]],
+                 max_size: int,
+                 window_ms: float):
+        self._register_batch = register_batch
+        self._max_size = max(1, max_size)
+        self._window_seconds = window_ms / 1000
+        self._lock = threading.Condition()
+        self._open_batch = None
+
+    def submit(self, item) -> dict:
+        with self._lock:
+            batch = self._open_batch
+            is_leader = batch is None
+            if is_leader:
+                batch = self._open_batch = _Batch()
+
+            index = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= self._max_size:
+                self._open_batch = None
+                self._lock.notify_all()
+
+            if is_leader:
+                deadline = time.monotonic() + self._window_seconds
+                while self._open_batch is batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._open_batch = None
+                        break
+                    self._lock.wait(remaining)
+
+        if is_leader:
+            self._run(batch)
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
+
+    def _run(self, batch: _Batch):
+        try:
+            logger.debug("Registering a batch of %d accounts", len(batch.items))
+            results = self._register_batch(batch.items)
+            if len(results) != len(batch.items):
+                raise Exception(f"Expected {len(batch.items)} registration results, got {len(results)}")
+            batch.results = results
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+
+logger.debug('loaded')
@@ -0,0 +1,128 @@
+import io
+import csv
+import hmac
+import json
+import base64
+import logging
+import datetime
+import typing
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+# The order of the columns in the rows of db.get_registrations_page
+COLUMNS = ["id", "tusc_account_name", "tusc_public_key", "referrer", "created_at"]
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+class InvalidExportRequestError(Exception):
+    """The message is returned to the client as is."""
+    pass
+
+
+def is_authorized(authorization: typing.Optional[str], tokens: typing.List[str]) -> bool:
+    """Whether the Authorization header is "Bearer <token>" for one of tokens. Nothing is authorized without tokens."""
+    if authorization is None or not authorization.startswith("Bearer "):
+        return False
+    token = authorization[len("Bearer "):].strip().encode()
+    # Compares against every token so the time taken does not tell which one came close
+    authorized = False
+    for expected in tokens:
+        if hmac.compare_digest(token, str(expected).encode()):
+            authorized = True
+    return authorized
+
+
+def parse_created_range(args: typing.Mapping[str, str]) \
+        -> typing.Tuple[typing.Optional[datetime.datetime], typing.Optional[datetime.datetime]]:
+    """The created_at range [from, to) of the request, either end may be missing."""
+    return _parse_timestamp(args, "from"), _parse_timestamp(args, "to")
+
+
+def _parse_timestamp(args: typing.Mapping[str, str], name: str) -> typing.Optional[datetime.datetime]:
+    value = args.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        timestamp = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidExportRequestError(f"'{name}' must be an ISO 8601 date or timestamp")
+
+    # created_at is UTC without a time zone
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def parse_limit(value: typing.Optional[str], default: int, maximum: int) -> int:
+    if value is None or value == "":
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise InvalidExportRequestError("'limit' must be a number")
+    if limit < 1 or limit > maximum:
+        raise InvalidExportRequestError(f"'limit' must be between 1 and {maximum}")
+    return limit
+
+
+def parse_format(value: typing.Optional[str]) -> str:
+    if value is None or value == "":
+        return "ndjson"
+    if value not in CONTENT_TYPES:
+        raise InvalidExportRequestError("'format' must be one of " + ", ".join(CONTENT_TYPES))
+    return value
+
+
+# A page ends at a (created_at, id), the next page starts after it. Clients get it as an opaque string.
+def next_after(rows: list) -> typing.Tuple[datetime.datetime, int]:
+    return rows[-1][4], rows[-1][0]
+
+
+def encode_cursor(after: typing.Tuple[datetime.datetime, int]) -> str:
+    return base64.urlsafe_b64encode(json.dumps([after[0].isoformat(), after[1]]).encode()).decode()
+
+
+def decode_cursor(cursor: typing.Optional[str]) -> typing.Optional[typing.Tuple[datetime.datetime, int]]:
+    if cursor is None or cursor == "":
+        return None
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise InvalidExportRequestError("'after' is not a valid cursor")
+
+
+def registration_dict(row) -> dict:
+    registration = dict(zip(COLUMNS, row))
+    registration["created_at"] = registration["created_at"].isoformat()
+    return registration
+
+
+def page_result(rows: list, limit: int) -> dict:
+    """The JSON listing of one page, next is None on the last page."""
+    return {
+        "registrations": [registration_dict(row) for row in rows],
+        "next": encode_cursor(next_after(rows)) if len(rows) == limit else None
+    }
+
+
+def format_header(export_format: str) -> str:
+    if export_format == "csv":
+        return _csv_lines([COLUMNS])
+    return ""
+
+
+def format_rows(export_format: str, rows: list) -> str:
+    if export_format == "csv":
+        return _csv_lines([registration_dict(row).values() for row in rows])
+    return "".join(json.dumps(registration_dict(row)) + "\n" for row in rows)
+
+
+def _csv_lines(rows: typing.Iterable[typing.Iterable]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue()
+
+
+logger.debug('loaded')
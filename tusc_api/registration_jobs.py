@@ -0,0 +1,122 @@
+import time
+import uuid
+import logging
+import threading
+import typing
+import db_access.db as db
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+MAINTENANCE_INTERVAL_SECONDS = 60
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+class RegistrationJobRunner:
+    """
+    Runs registration jobs queued in tusc_registration_jobs with a fixed number of threads per process.
+
+    Jobs are claimed with `for update skip locked`, so every worker process's threads share the one queue and a job
+    runs exactly once. run_job returns the response stored for the job, a job whose response has an error is
+    failed. Jobs left running by a process that died are failed after stale_seconds and handed to on_expired, and
+    finished jobs are deleted after retention_hours.
+    """
+
+    def __init__(self,
+                 run_job: typing.Callable[[dict], dict],
+                 on_expired: typing.Callable[[dict], None],
+                 error_response: dict,
+                 workers: int,
+                 poll_interval: float,
+                 stale_seconds: float,
+                 retention_hours: float):
+        self._run_job = run_job
+        self._on_expired = on_expired
+        self._error_response = error_response
+        self._workers = workers
+        self._poll_interval = poll_interval
+        self._stale_seconds = stale_seconds
+        self._retention_hours = retention_hours
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+        self._threads_lock = threading.Lock()
+        self._maintenance_lock = threading.Lock()
+        self._next_maintenance = 0.0
+
+    def start(self):
+        if len(self._threads) > 0:
+            return
+        with self._threads_lock:
+            if len(self._threads) == 0:
+                for x in range(self._workers):
+                    thread = threading.Thread(target=self._run, daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def wake(self):
+        """Lets an idle thread of this process pick up a job that was just queued without waiting for the poll."""
+        self._wake.set()
+
+    def stop(self):
+        """Threads finish the job they are running and exit."""
+        self._stopped.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                job = db.claim_registration_job()
+            except Exception:
+                logger.exception('Failed to claim registration job')
+                job = None
+
+            if job is None:
+                self._maintain()
+                if not self._stopped.is_set():
+                    self._wake.wait(self._poll_interval)
+                    self._wake.clear()
+                continue
+
+            self._run_one(job)
+
+    def _run_one(self, job: dict):
+        logger.debug("Running registration job %s", job['id'])
+        try:
+            response = self._run_job(job)
+        except Exception:
+            logger.exception("Registration job %s failed", job['id'])
+            response = self._error_response
+
+        status = 'failed' if 'error' in response else 'succeeded'
+        for attempt in range(3):
+            try:
+                db.finish_registration_job(job['id'], status, response)
+                return
+            except Exception:
+                logger.exception("Failed to save result of registration job %s", job['id'])
+                time.sleep(self._poll_interval)
+
+    def _maintain(self):
+        now = time.monotonic()
+        if now < self._next_maintenance or not self._maintenance_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_maintenance = now + MAINTENANCE_INTERVAL_SECONDS
+            expired_jobs = db.expire_registration_jobs(self._stale_seconds, self._retention_hours,
+                                                       self._error_response)
+            for job in expired_jobs:
+                logger.error("Registration job %s did not finish, marked as failed", job['id'])
+                self._on_expired(job)
+        except Exception:
+            logger.exception('Failed to expire registration jobs')
+        finally:
+            self._maintenance_lock.release()
+
+
+logger.debug('loaded')
@@ -0,0 +1,213 @@
+import os
+import glob
+import asyncio
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import threading
+import typing
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+LOCK_POLL_SECONDS = 0.05
+SWEEP_INTERVAL_SECONDS = 600
+
+
+class IdempotencyKeyReusedError(Exception):
+    pass
+
+
+class RequestCoalescer:
+    """
+    Shares request results between the worker processes of one host through lock files in lock_dir.
+
+    coalesce() lets one request per key run at a time, a request that had to wait for another one with the same key
+    returns that request's result instead of running again. idempotent() returns the result saved for the key for up
+    to idempotency_ttl seconds, as long as the request matches the one that was saved. The *_async versions are the
+    same for the ASGI app.
+
+    Every key has its own file, flock'd while the request runs and holding its result afterwards. flock conflicts
+    between separate open() calls, so threads of one process are coalesced the same way as processes. Waiting for
+    the lock gives up after wait_timeout, the request then runs without coalescing.
+    """
+
+    def __init__(self, lock_dir: str, wait_timeout: float, idempotency_ttl: float):
+        self._lock_dir = lock_dir
+        self._wait_timeout = wait_timeout
+        self._idempotency_ttl = idempotency_ttl
+        self._sweep_lock = threading.Lock()
+        self._next_sweep = 0.0
+
+    def coalesce(self, key: str, func: typing.Callable[[], dict]) -> dict:
+        started_at = time.time()
+        with self._locked_record("c", key) as record_file:
+            if record_file is None:
+                return func()
+
+            response = self._coalesced_response(record_file, key, started_at)
+            if response is None:
+                response = func()
+                self._write_record(record_file, {"key": key, "completed_at": time.time(), "response": response})
+            return response
+
+    async def coalesce_async(self, key: str, func: typing.Callable[[], typing.Awaitable[dict]]) -> dict:
+        started_at = time.time()
+        async with self._locked_record("c", key) as record_file:
+            if record_file is None:
+                return await func()
+
+            response = self._coalesced_response(record_file, key, started_at)
+            if response is None:
+                response = await func()
+                self._write_record(record_file, {"key": key, "completed_at": time.time(), "response": response})
+            return response
+
+    def idempotent(self,
+                   key: str,
+                   fingerprint: str,
+                   func: typing.Callable[[], dict],
+                   is_cacheable: typing.Callable[[dict], bool]) -> dict:
+        with self._locked_record("i", key) as record_file:
+            if record_file is None:
+                return func()
+
+            response = self._saved_response(record_file, key, fingerprint)
+            if response is None:
+                response = func()
+                self._save_response(record_file, key, fingerprint, response, is_cacheable)
+            return response
+
+    async def idempotent_async(self,
+                               key: str,
+                               fingerprint: str,
+                               func: typing.Callable[[], typing.Awaitable[dict]],
+                               is_cacheable: typing.Callable[[dict], bool]) -> dict:
+        async with self._locked_record("i", key) as record_file:
+            if record_file is None:
+                return await func()
+
+            response = self._saved_response(record_file, key, fingerprint)
+            if response is None:
+                response = await func()
+                self._save_response(record_file, key, fingerprint, response, is_cacheable)
+            return response
+
+    def _coalesced_response(self, record_file, key: str, started_at: float) -> typing.Optional[dict]:
+        record = self._read_record(record_file)
+        # Only a request that finished while this one was waiting counts, later retries run again
+        if record is not None and record["key"] == key and record["completed_at"] >= started_at:
+            logger.debug('Coalesced duplicate request')
+            return record["response"]
+        return None
+
+    def _saved_response(self, record_file, key: str, fingerprint: str) -> typing.Optional[dict]:
+        record = self._read_record(record_file)
+        if record is not None and record["key"] == key \
+                and time.time() - record["completed_at"] < self._idempotency_ttl:
+            if record["fingerprint"] != fingerprint:
+                raise IdempotencyKeyReusedError()
+            logger.debug('Returning saved response for Idempotency-Key')
+            return record["response"]
+        return None
+
+    def _save_response(self, record_file, key: str, fingerprint: str, response: dict,
+                       is_cacheable: typing.Callable[[dict], bool]):
+        if is_cacheable(response):
+            self._write_record(record_file, {"key": key, "fingerprint": fingerprint,
+                                             "completed_at": time.time(), "response": response})
+
+    def _locked_record(self, kind: str, key: str):
+        os.makedirs(self._lock_dir, exist_ok=True)
+        self._sweep()
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return _LockedFile(os.path.join(self._lock_dir, f"{kind}-{digest}.json"), self._wait_timeout)
+
+    @staticmethod
+    def _read_record(record_file) -> typing.Optional[dict]:
+        record_file.seek(0)
+        data = record_file.read()
+        if len(data) == 0:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _write_record(record_file, record: dict):
+        record_file.seek(0)
+        record_file.truncate()
+        record_file.write(json.dumps(record))
+        record_file.flush()
+
+    # Deletes record files nobody needs any more. A request that opened a file just before it was deleted loses its
+    # coalescing, the chain still rejects the duplicate registration.
+    def _sweep(self):
+        now = time.time()
+        if now < self._next_sweep or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sweep = now + SWEEP_INTERVAL_SECONDS
+            max_ages = {"c": self._wait_timeout * 2, "i": self._idempotency_ttl}
+            for kind, max_age in max_ages.items():
+                for path in glob.glob(os.path.join(self._lock_dir, f"{kind}-*.json")):
+                    try:
+                        if now - os.path.getmtime(path) > max_age:
+                            os.unlink(path)
+                    except OSError:
+                        pass
+        finally:
+            self._sweep_lock.release()
+
+
+class _LockedFile:
+    def __init__(self, path: str, wait_timeout: float):
+        self._path = path
+        self._wait_timeout = wait_timeout
+        self._file = None
+
+    # Both return None when the lock could not be taken in time, the async version waits without blocking the loop
+    def __enter__(self):
+        self._file = open(self._path, 'a+')
+        deadline = time.monotonic() + self._wait_timeout
+        while not self._try_lock():
+            if time.monotonic() >= deadline:
+                return self._give_up()
+            time.sleep(LOCK_POLL_SECONDS)
+        return self._file
+
+    async def __aenter__(self):
+        self._file = open(self._path, 'a+')
+        deadline = time.monotonic() + self._wait_timeout
+        while not self._try_lock():
+            if time.monotonic() >= deadline:
+                return self._give_up()
+            await asyncio.sleep(LOCK_POLL_SECONDS)
+        return self._file
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._file is not None:
+            # Closing releases the lock
+            self._file.close()
+        return False
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return self.__exit__(exc_type, exc_val, exc_tb)
+
+    def _try_lock(self) -> bool:
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _give_up(self):
+        logger.warning('Timed out waiting for a duplicate request to finish')
+        self._file.close()
+        self._file = None
+        return None
+
+logger.debug('loaded')
@@ -0,0 +1,88 @@
+import math
+import hashlib
+import logging
+import threading
+import typing
+from tusc_api.cache import TTLCache
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+
+class BloomFilter:
+    """
+    Fixed size bit array sized for capacity items at error_rate false positives. Never gives false negatives.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.bit_count = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hash_count = max(1, int(round(self.bit_count / capacity * math.log(2))))
+        self._bits = bytearray((self.bit_count + 7) // 8)
+
+    def add(self, item: str):
+        for index in self._indexes(item):
+            self._bits[index >> 3] |= 1 << (index & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[index >> 3] & (1 << (index & 7)) for index in self._indexes(item))
+
+    def _indexes(self, item: str) -> typing.Iterator[int]:
+        # Double hashing, k indexes from two 64 bit halves of a single digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.bit_count
+
+
+class TakenNamesIndex:
+    """
+    Account names known to be taken: a Bloom filter over every name we know of (seeded from
+    tusc_account_registrations) plus an exact LRU of names recently confirmed as taken.
+
+    is_known_taken() is exact and can be trusted on its own. might_be_taken() comes from the Bloom filter and needs
+    confirming (see AccountLookup) before a registration is rejected because of it, but a False from it means the
+    name is not one we know of.
+    """
+
+    def __init__(self, capacity: int, error_rate: float, lru_size: int):
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._lock = threading.Lock()
+        self._recent = TTLCache(float('inf'), lru_size)
+        self._seed_thread = None
+
+    def add(self, account_name: str):
+        self._add_to_bloom(account_name)
+        self._recent.set(account_name, True)
+
+    def is_known_taken(self, account_name: str) -> bool:
+        return account_name in self._recent
+
+    def might_be_taken(self, account_name: str) -> bool:
+        return account_name in self._bloom
+
+    def seed(self, load_names: typing.Callable[[], typing.Iterable[str]]):
+        """Loads names in a background thread, only the first call does anything."""
+        with self._lock:
+            if self._seed_thread is not None:
+                return
+            self._seed_thread = threading.Thread(target=self._seed, args=(load_names,), daemon=True)
+            self._seed_thread.start()
+
+    def _seed(self, load_names: typing.Callable[[], typing.Iterable[str]]):
+        count = 0
+        try:
+            for account_name in load_names():
+                self._add_to_bloom(account_name)
+                count += 1
+        except Exception:
+            logger.exception('Failed to seed taken account names')
+        logger.debug("Seeded taken account names with %d names", count)
+
+    def _add_to_bloom(self, account_name: str):
+        # bytearray read-modify-write is not atomic
+        with self._lock:
+            self._bloom.add(account_name)
+
+
+logger.debug('loaded')
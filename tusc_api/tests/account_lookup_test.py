@@ -0,0 +1,58 @@
+import time
+from tusc_api.account_lookup import AccountLookup, AccountLookupError
+
+
+class TestAccountLookup:
+    def test_exists_is_cached(self):
+        requests = []
+
+        def send_request(method_name, params):
+            requests.append((method_name, params))
+            return {"id": 1, "jsonrpc": "2.0", "result": [["someaccountname", "1.2.100"]]}
+
+        lookup = AccountLookup(send_request, 60, 10)
+        assert lookup.get_account_id("someaccountname") == "1.2.100"
+        assert lookup.exists("someaccountname")
+        assert requests == [("list_accounts", ["someaccountname", 1])]
+
+    def test_unknown_name(self):
+        requests = []
+
+        def send_request(method_name, params):
+            requests.append((method_name, params))
+            return {"id": 1, "jsonrpc": "2.0", "result": [["someaccountnamf", "1.2.101"]]}
+
+        lookup = AccountLookup(send_request, 60, 10)
+        assert not lookup.exists("someaccountname")
+        assert not lookup.exists("someaccountname")
+        assert len(requests) == 1
+
+        lookup.forget("someaccountname")
+        assert not lookup.exists("someaccountname")
+        assert len(requests) == 2
+
+    def test_error(self):
+        def send_request(method_name, params):
+            return {"id": 1, "jsonrpc": "2.0", "error": {"code": 0, "message": "Assert Exception"}}
+
+        lookup = AccountLookup(send_request, 60, 10)
+        try:
+            lookup.exists("someaccountname")
+            assert False
+        except AccountLookupError:
+            pass
+
+    def test_negative_ttl(self):
+        requests = []
+
+        def send_request(method_name, params):
+            requests.append((method_name, params))
+            return {"id": 1, "jsonrpc": "2.0", "result": []}
+
+        lookup = AccountLookup(send_request, 60, 10, 0.05)
+        assert lookup.cached_exists("someaccountname") is None
+        assert not lookup.exists("someaccountname")
+        assert lookup.cached_exists("someaccountname") is False
+        time.sleep(0.1)
+        assert lookup.cached_exists("someaccountname") is None
+        assert len(requests) == 1
@@ -0,0 +1,51 @@
+from tusc_api import account_validator
+
+valid_public_key = "TUSC6xiw2BAZnZ5gB7n31Bz5E2dtGqqc9BoftEb3TGpy3hRj27Qpvq"
+
+
+class TestIsValidName:
+    def test_valid_names(self):
+        for name in ["someaccountname", "some-account1", "a.b.c", "registration-faucet", "abc.def-1"]:
+            assert account_validator.is_valid_name(name), name
+
+    def test_invalid_names(self):
+        for name in ["", "1someaccount", "-someaccount", "someaccount-", "some_account", "SomeAccount",
+                     "some..account", ".someaccount", "someaccount.", "some.1account", "a" * 64]:
+            assert not account_validator.is_valid_name(name), name
+
+
+class TestIsValidPublicKey:
+    def test_valid_keys(self):
+        assert account_validator.is_valid_public_key(valid_public_key)
+        assert account_validator.is_valid_public_key("TUSC6mC3SQiFEcsGzrwUTMHKPKyyE2GdA1bAfKuzEcdst7sRZc6rhR")
+
+    def test_wrong_prefix(self):
+        assert not account_validator.is_valid_public_key("BTS" + valid_public_key[4:])
+
+    def test_bad_checksum(self):
+        assert not account_validator.is_valid_public_key(valid_public_key[:-1] + "r")
+
+    def test_bad_characters(self):
+        assert not account_validator.is_valid_public_key(valid_public_key[:-1] + "0")
+        assert not account_validator.is_valid_public_key("TUSC")
+        assert not account_validator.is_valid_public_key("b")
+
+    def test_ripemd160_fallback(self):
+        assert account_validator._ripemd160(b"abc").hex() == "8eb208f7e05d987a9b044a8e98c6b087f15a0bfc"
+
+
+class TestValidateRegistration:
+    def test_valid(self):
+        assert account_validator.validate_registration("someaccountname", valid_public_key) is None
+
+    def test_too_short(self):
+        response = account_validator.validate_registration("short", valid_public_key)
+        assert response["error"].startswith("Account name 'short' is too short.")
+
+    def test_invalid_name(self):
+        response = account_validator.validate_registration("1someaccount", valid_public_key)
+        assert response["error"].startswith("Account name '1someaccount' is invalid.")
+
+    def test_invalid_public_key(self):
+        response = account_validator.validate_registration("someaccountname", "b")
+        assert response["error"].startswith("The public key 'b' is invalid.")
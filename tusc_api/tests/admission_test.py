@@ -0,0 +1,139 @@
+import time
+import threading
+import pytest
+from tusc_api.admission import ConcurrencyLimiter, CircuitBreaker, WalletUnavailableError
+
+
+def hold_slot(limiter, started, release):
+    with limiter.slot():
+        started.release()
+        release.wait(5)
+
+
+class TestConcurrencyLimiter:
+    def test_limits_concurrency(self, tmp_path):
+        limiter = ConcurrencyLimiter(str(tmp_path), 2, 0, 0.1, 5)
+        started = threading.Semaphore(0)
+        release = threading.Event()
+        threads = [threading.Thread(target=hold_slot, args=(limiter, started, release)) for x in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            assert started.acquire(timeout=5)
+
+        # No queue, the third request is rejected right away
+        with pytest.raises(WalletUnavailableError) as error:
+            with limiter.slot():
+                pass
+        assert error.value.retry_after == 5
+
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        with limiter.slot():
+            pass
+
+    def test_queued_request_gets_freed_slot(self, tmp_path):
+        limiter = ConcurrencyLimiter(str(tmp_path), 1, 1, 5, 5)
+        started = threading.Semaphore(0)
+        release = threading.Event()
+        thread = threading.Thread(target=hold_slot, args=(limiter, started, release))
+        thread.start()
+        assert started.acquire(timeout=5)
+
+        threading.Timer(0.1, release.set).start()
+        with limiter.slot():
+            pass
+        thread.join(5)
+
+    def test_queue_timeout(self, tmp_path):
+        limiter = ConcurrencyLimiter(str(tmp_path), 1, 1, 0.1, 5)
+        started = threading.Semaphore(0)
+        release = threading.Event()
+        thread = threading.Thread(target=hold_slot, args=(limiter, started, release))
+        thread.start()
+        assert started.acquire(timeout=5)
+
+        with pytest.raises(WalletUnavailableError):
+            with limiter.slot():
+                pass
+        release.set()
+        thread.join(5)
+
+
+class TestCircuitBreaker:
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(3, 30)
+        for x in range(2):
+            breaker.record_failure()
+        breaker.check()
+
+        breaker.record_failure()
+        assert breaker.is_open()
+        with pytest.raises(WalletUnavailableError) as error:
+            breaker.check()
+        assert 1 <= error.value.retry_after <= 30
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(2, 30)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.check()
+
+    def test_half_open_lets_one_trial_through(self):
+        breaker = CircuitBreaker(1, 0.1)
+        breaker.record_failure()
+        time.sleep(0.15)
+
+        breaker.check()
+        with pytest.raises(WalletUnavailableError):
+            breaker.check()
+
+        breaker.record_success()
+        assert not breaker.is_open()
+        breaker.check()
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker(1, 0.1)
+        breaker.record_failure()
+        time.sleep(0.15)
+
+        breaker.check()
+        breaker.record_failure()
+        with pytest.raises(WalletUnavailableError):
+            breaker.check()
+
+
+class TestConcurrencyLimiterAsync:
+    def test_limits_concurrency(self, tmp_path):
+        import asyncio
+        limiter = ConcurrencyLimiter(str(tmp_path), 2, 10, 5, 5)
+        running = []
+        peak = []
+
+        async def request():
+            async with limiter.slot_async():
+                running.append(1)
+                peak.append(len(running))
+                await asyncio.sleep(0.05)
+                running.pop()
+
+        async def main():
+            await asyncio.gather(*[request() for x in range(6)])
+
+        asyncio.run(main())
+        assert max(peak) == 2
+        assert len(peak) == 6
+
+    def test_full_queue_rejected(self, tmp_path):
+        import asyncio
+        limiter = ConcurrencyLimiter(str(tmp_path), 1, 0, 5, 5)
+
+        async def main():
+            async with limiter.slot_async():
+                with pytest.raises(WalletUnavailableError):
+                    async with limiter.slot_async():
+                        pass
+
+        asyncio.run(main())
@@ -0,0 +1,69 @@
+import time
+import itertools
+import threading
+from tusc_api.brain_key_pool import BrainKeyPool
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class FakeWallet:
+    def __init__(self):
+        self.counter = itertools.count()
+        self.batches = []
+        self.fail = False
+
+    def generate_batch(self, count):
+        if self.fail:
+            raise Exception("TUSC Wallet is not ready")
+        self.batches.append(count)
+        return [{"pub_key": f"TUSCkey{next(self.counter)}"} for x in range(count)]
+
+
+class TestBrainKeyPool:
+    def test_fills_in_batches(self):
+        wallet = FakeWallet()
+        pool = BrainKeyPool(wallet.generate_batch, 10, 5, 4, 0.01)
+        pool.start()
+        assert wait_for(lambda: len(pool) == 10)
+        assert wallet.batches == [4, 4, 2]
+
+    def test_keys_handed_out_once(self):
+        wallet = FakeWallet()
+        pool = BrainKeyPool(wallet.generate_batch, 20, 10, 5, 0.01)
+        pool.start()
+        assert wait_for(lambda: len(pool) == 20)
+
+        taken = []
+        threads = [threading.Thread(target=lambda: taken.append(pool.take())) for x in range(15)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        pub_keys = [brain_key["pub_key"] for brain_key in taken if brain_key is not None]
+        assert len(pub_keys) == len(set(pub_keys))
+
+    def test_refills_below_low_water(self):
+        wallet = FakeWallet()
+        pool = BrainKeyPool(wallet.generate_batch, 10, 5, 10, 0.01)
+        pool.start()
+        assert wait_for(lambda: len(pool) == 10)
+        for x in range(6):
+            pool.take()
+        assert wait_for(lambda: len(pool) == 10)
+
+    def test_retries_after_failure(self):
+        wallet = FakeWallet()
+        wallet.fail = True
+        pool = BrainKeyPool(wallet.generate_batch, 10, 5, 10, 0.01)
+        assert pool.take() is None
+        time.sleep(0.05)
+        wallet.fail = False
+        assert wait_for(lambda: len(pool) == 10)
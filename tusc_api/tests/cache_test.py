@@ -0,0 +1,53 @@
+import time
+import threading
+from tusc_api.cache import TTLCache
+
+
+class TestTTLCache:
+    def test_get_set(self):
+        cache = TTLCache(60)
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        assert "a" in cache
+        assert cache.get("b") is None
+
+    def test_expiry(self):
+        cache = TTLCache(0.05)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=60)
+        time.sleep(0.1)
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+
+    def test_lru_eviction(self):
+        cache = TTLCache(60, maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert "a" in cache
+        assert "b" not in cache
+        assert len(cache) == 2
+
+    def test_get_or_load_loads_once(self):
+        cache = TTLCache(60)
+        calls = []
+
+        def loader():
+            calls.append(1)
+            time.sleep(0.05)
+            return "value"
+
+        threads = [threading.Thread(target=cache.get_or_load, args=("key", loader)) for x in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert cache.get_or_load("key", loader) == "value"
+        assert len(calls) == 1
+
+    def test_get_or_load_does_not_cache_none(self):
+        cache = TTLCache(60)
+        assert cache.get_or_load("key", lambda: None) is None
+        assert "key" not in cache
@@ -0,0 +1,81 @@
+import json
+import socket
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+from tusc_api import captcha
+
+
+class SiteverifyHandler(BaseHTTPRequestHandler):
+    requests_seen = []
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        SiteverifyHandler.requests_seen.append(form)
+        body = json.dumps({"success": form['response'][0] == "valid-token"}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def siteverify_url():
+    SiteverifyHandler.requests_seen = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SiteverifyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}/recaptcha/api/siteverify'
+    server.shutdown()
+
+
+def unused_url() -> str:
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return f'http://127.0.0.1:{port}/recaptcha/api/siteverify'
+
+
+class TestCaptchaVerifier:
+    def test_valid_token(self, siteverify_url):
+        verifier = captcha.CaptchaVerifier(siteverify_url, "secret", 1, 1, False, 60, 100)
+        assert verifier.verify("valid-token", "1.2.3.4")
+        assert SiteverifyHandler.requests_seen[0]['remoteip'] == ["1.2.3.4"]
+
+    def test_invalid_token(self, siteverify_url):
+        verifier = captcha.CaptchaVerifier(siteverify_url, "secret", 1, 1, False, 60, 100)
+        assert not verifier.verify("invalid-token", "1.2.3.4")
+
+    def test_replayed_token_rejected_without_request(self, siteverify_url):
+        verifier = captcha.CaptchaVerifier(siteverify_url, "secret", 1, 1, False, 60, 100)
+        assert verifier.verify("valid-token", "1.2.3.4")
+        assert not verifier.verify("valid-token", "1.2.3.4")
+        assert len(SiteverifyHandler.requests_seen) == 1
+
+    def test_empty_token(self, siteverify_url):
+        verifier = captcha.CaptchaVerifier(siteverify_url, "secret", 1, 1, False, 60, 100)
+        assert not verifier.verify("", "1.2.3.4")
+        assert not verifier.verify(None, "1.2.3.4")
+        assert len(SiteverifyHandler.requests_seen) == 0
+
+    def test_unreachable_fail_closed(self):
+        verifier = captcha.CaptchaVerifier(unused_url(), "secret", 1, 1, False, 60, 100)
+        assert not verifier.verify("valid-token", "1.2.3.4")
+
+    def test_unreachable_fail_open(self):
+        verifier = captcha.CaptchaVerifier(unused_url(), "secret", 1, 1, True, 60, 100)
+        assert verifier.verify("valid-token", "1.2.3.4")
+
+    def test_unreachable_token_can_be_retried(self, siteverify_url):
+        verifier = captcha.CaptchaVerifier(unused_url(), "secret", 1, 1, False, 60, 100)
+        assert not verifier.verify("valid-token", "1.2.3.4")
+        # siteverify never saw the token, it is not a replay once the verifier is reachable again
+        verifier.verify_url = siteverify_url
+        assert verifier.verify("valid-token", "1.2.3.4")
+        assert not verifier.verify("valid-token", "1.2.3.4")
+        assert len(SiteverifyHandler.requests_seen) == 1
@@ -0,0 +1,92 @@
+import time
+import pytest
+from tusc_api.funds_monitor import FundsMonitor, core_balance, account_create_fee
+
+GLOBAL_PROPERTIES = {
+    "parameters": {
+        "current_fees": {
+            "parameters": [
+                [0, {"fee": 86, "price_per_kbyte": 10}],
+                [5, {"basic_fee": 40000, "premium_fee": 2000000, "price_per_kbyte": 10}]
+            ],
+            "scale": 10000
+        }
+    }
+}
+
+
+def make_monitor(polls, max_age=60, min_registrations=1):
+    def poll():
+        result = polls.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monitor = FundsMonitor(poll, 60, max_age, min_registrations)
+    # Polled by hand, the thread would poll on its own
+    monitor.start = lambda: None
+    return monitor
+
+
+class TestFundsMonitor:
+    def test_unknown_until_polled(self):
+        monitor = make_monitor([])
+        assert not monitor.is_depleted()
+        assert monitor.state()["balance"] is None
+
+    def test_depleted(self):
+        monitor = make_monitor([(100000, 40010), (40009, 40010), (80020, 40010)], min_registrations=2)
+        assert monitor.refresh()
+        assert not monitor.is_depleted()
+        assert monitor.refresh()
+        assert monitor.is_depleted()
+        assert monitor.state()["registrations_available"] is False
+        assert monitor.refresh()
+        assert not monitor.is_depleted()
+        assert monitor.state()["balance"] == 80020
+
+    def test_failed_poll_keeps_last_state(self):
+        monitor = make_monitor([(0, 40010), Exception("TUSC Wallet is not ready")])
+        monitor.refresh()
+        assert not monitor.refresh()
+        assert monitor.is_depleted()
+
+    def test_old_poll_is_not_trusted(self):
+        monitor = make_monitor([(0, 40010)], max_age=0.05)
+        monitor.refresh()
+        assert monitor.is_depleted()
+        time.sleep(0.1)
+        assert not monitor.is_depleted()
+        assert monitor.state()["seconds_since_poll"] is None
+
+    def test_background_poll(self):
+        polls = []
+        monitor = FundsMonitor(lambda: polls.append(1) or (0, 40010), 60, 60, 1)
+        monitor.is_depleted()
+        deadline = time.monotonic() + 5
+        while not monitor.is_depleted():
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        monitor.wake()
+        while len(polls) < 2:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+
+class TestWalletResults:
+    def test_core_balance(self):
+        balances = [{"amount": 5, "asset_id": "1.3.1"}, {"amount": "123456", "asset_id": "1.3.0"}]
+        assert core_balance(balances, "1.3.0") == 123456
+        assert core_balance([], "1.3.0") == 0
+
+    def test_account_create_fee(self):
+        assert account_create_fee(GLOBAL_PROPERTIES, 5) == 40010
+        GLOBAL_PROPERTIES["parameters"]["current_fees"]["scale"] = 5000
+        try:
+            assert account_create_fee(GLOBAL_PROPERTIES, 5) == 20005
+        finally:
+            GLOBAL_PROPERTIES["parameters"]["current_fees"]["scale"] = 10000
+
+        with pytest.raises(ValueError):
+            account_create_fee(GLOBAL_PROPERTIES, 1)
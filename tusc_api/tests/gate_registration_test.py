@@ -0,0 +1,203 @@
+import time
+import threading
+import contextlib
+import pytest
+from tusc_api import gate_tusc_api
+from tusc_api.account_lookup import AccountLookup
+from tusc_api.wallet_supervisor import WALLET_DOWN
+
+PUBLIC_KEYS = ["TUSC6YZ8dWrEzGDnZPaRCxgXQ8yXeYMV9dvuUsrRskXW6FqTwPWyLT",
+               "TUSC5KCSDw3Dng58VNeKm3Xf8dpxwxxDpTxSAs4n5kdF6VzQZdDuUc3"]
+REGISTRATIONS = [("someaccountname", PUBLIC_KEYS[0], "registration-faucet"),
+                 ("otheraccountname", PUBLIC_KEYS[1], "registration-faucet")]
+
+
+def operation(account_name, public_key, ref):
+    return [gate_tusc_api.AccountCreateOperationId,
+            {"name": account_name, "owner": {"key_auths": [[public_key, 1]]}, "referrer": ref}]
+
+
+def transaction(operations):
+    return {"ref_block_num": 1, "expiration": "2019-09-30T12:00:00", "operations": operations, "signatures": ["00"]}
+
+
+@pytest.fixture
+def wallet(monkeypatch):
+    """Stubs out everything _register_account_batch_imp sends to the wallet."""
+    state = {"accounts": {}, "singles": [], "broadcast": None}
+
+    def send_builder_transaction(operations):
+        if state["broadcast"] is not None:
+            return state["broadcast"](operations)
+        return {"result": transaction(operations)}
+
+    def send_request(method_name, params, do_not_log_data=False):
+        assert method_name == "get_account"
+        if params[0] not in state["accounts"]:
+            return {"error": {"message": "Assert Exception: rec: Unknown account"}}
+        return {"result": {"name": params[0], "owner": {"key_auths": [[state["accounts"][params[0]], 1]]}}}
+
+    def register_single_account(account_name, public_key, ref):
+        state["singles"].append(account_name)
+        if account_name in state["accounts"]:
+            return gate_tusc_api._account_name_taken_response(account_name)
+        return {"result": transaction([operation(account_name, public_key, ref)])}
+
+    monkeypatch.setattr(gate_tusc_api, "start_and_unlock_wallet", lambda: gate_tusc_api.WalletUnlockResponseNoneResult)
+    monkeypatch.setattr(gate_tusc_api, "_account_create_operation", operation)
+    monkeypatch.setattr(gate_tusc_api, "_send_builder_transaction", send_builder_transaction)
+    monkeypatch.setattr(gate_tusc_api, "_send_request", send_request)
+    monkeypatch.setattr(gate_tusc_api, "_register_single_account", register_single_account)
+    yield state
+
+
+class TestRegisterAccountBatch:
+    def test_each_caller_gets_only_its_own_operation(self, wallet):
+        responses = gate_tusc_api._register_account_batch_imp(REGISTRATIONS)
+        for response, registration in zip(responses, REGISTRATIONS):
+            assert response["result"]["operations"] == [operation(*registration)]
+            assert response["result"]["ref_block_num"] == 1
+            assert "signatures" not in response["result"]
+        assert wallet["singles"] == []
+
+    @pytest.mark.parametrize("failure", ["error", "exception"])
+    def test_accounts_created_by_failed_batch_are_successes(self, wallet, failure):
+        def broadcast(operations):
+            # The first account got created, yet the wallet reports a failure or times out
+            wallet["accounts"]["someaccountname"] = PUBLIC_KEYS[0]
+            if failure == "exception":
+                raise TimeoutError("read timed out")
+            return {"error": {"message": "Assert Exception"}}
+
+        wallet["broadcast"] = broadcast
+        responses = gate_tusc_api._register_account_batch_imp(REGISTRATIONS)
+        assert responses[0] == {"result": {"operations": [operation(*REGISTRATIONS[0])]}}
+        assert "result" in responses[1]
+        assert wallet["singles"] == ["otheraccountname"]
+
+    def test_name_taken_with_another_key_is_retried(self, wallet):
+        wallet["accounts"]["someaccountname"] = PUBLIC_KEYS[1]
+        wallet["broadcast"] = lambda operations: {"error": {"message": "Assert Exception"}}
+        responses = gate_tusc_api._register_account_batch_imp(REGISTRATIONS)
+        assert responses[0] == gate_tusc_api._account_name_taken_response("someaccountname")
+        assert wallet["singles"] == ["someaccountname", "otheraccountname"]
+
+
+class TestBatchAdmission:
+    def test_only_the_batch_holds_an_admission_slot(self, monkeypatch):
+        active = [0]
+        during_batch = []
+        lock = threading.Lock()
+
+        @contextlib.contextmanager
+        def wallet_admission():
+            with lock:
+                active[0] += 1
+            try:
+                yield
+            finally:
+                with lock:
+                    active[0] -= 1
+
+        def register_batch(registrations):
+            time.sleep(0.05)
+            during_batch.append((len(registrations), active[0]))
+            return [{"result": {"operations": []}}] * len(registrations)
+
+        monkeypatch.setitem(gate_tusc_api.tusc_api_cfg, "registration_batch_enabled", True)
+        monkeypatch.setattr(gate_tusc_api, "_wallet_admission", wallet_admission)
+        monkeypatch.setattr(gate_tusc_api, "_check_registration", lambda account_name, referrer: (referrer, None))
+        monkeypatch.setattr(gate_tusc_api, "_register_account_batch_imp", register_batch)
+        monkeypatch.setattr(gate_tusc_api.registration_writer, "record_completed_registration", lambda *args: None)
+        monkeypatch.setattr(gate_tusc_api, "registration_batcher",
+                            gate_tusc_api.RegistrationBatcher(gate_tusc_api._register_account_batch, 3, 1000))
+
+        threads = [threading.Thread(target=gate_tusc_api._register_account,
+                                    args=(f"someaccount{i}", PUBLIC_KEYS[0], "registration-faucet"))
+                   for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        assert during_batch == [(3, 1)]
+
+
+class TestResolveReferrer:
+    @pytest.fixture(autouse=True)
+    def lookup(self, monkeypatch):
+        """The referrer lookups sent to the wallet, which knows only someaccountname."""
+        lookups = []
+
+        def send_request(method_name, params):
+            lookups.append(params[0])
+            if params[0] == "brokenaccount":
+                return {"error": {"message": "Assert Exception"}}
+            return {"result": [["someaccountname", "1.2.100"]]}
+
+        monkeypatch.setitem(gate_tusc_api.tusc_api_cfg, "registrar_account_name", "registration-faucet")
+        monkeypatch.setitem(gate_tusc_api.tusc_api_cfg, "referrer_validation_enabled", True)
+        monkeypatch.setitem(gate_tusc_api.tusc_api_cfg, "referrer_validation_action", "reject")
+        monkeypatch.setattr(gate_tusc_api, "referrer_allowlist", frozenset(["somepartner"]))
+        monkeypatch.setattr(gate_tusc_api, "account_lookup", AccountLookup(send_request, 60, 10))
+        monkeypatch.setattr(gate_tusc_api, "start_and_unlock_wallet",
+                            lambda: gate_tusc_api.WalletUnlockResponseNoneResult)
+        yield lookups
+
+    def test_registrar(self, lookup):
+        assert gate_tusc_api._resolve_referrer("") == ("registration-faucet", None)
+        assert gate_tusc_api._resolve_referrer("registration-faucet") == ("registration-faucet", None)
+        assert lookup == []
+
+    def test_known_referrer_is_cached(self, lookup):
+        assert gate_tusc_api._resolve_referrer("someaccountname") == ("someaccountname", None)
+        assert gate_tusc_api._resolve_referrer("someaccountname") == ("someaccountname", None)
+        assert lookup == ["someaccountname"]
+
+    def test_reject(self, lookup):
+        ref, error = gate_tusc_api._resolve_referrer("unknownaccount")
+        assert error == {"error": "Referrer 'unknownaccount' is not a TUSC account."}
+
+    def test_fallback(self, lookup, monkeypatch):
+        monkeypatch.setitem(gate_tusc_api.tusc_api_cfg, "referrer_validation_action", "fallback")
+        assert gate_tusc_api._resolve_referrer("unknownaccount") == ("registration-faucet", None)
+
+    def test_allowlist(self, lookup):
+        assert gate_tusc_api._resolve_referrer("somepartner") == ("somepartner", None)
+        assert lookup == []
+
+    def test_validation_disabled(self, lookup, monkeypatch):
+        monkeypatch.setitem(gate_tusc_api.tusc_api_cfg, "referrer_validation_enabled", False)
+        assert gate_tusc_api._resolve_referrer("unknownaccount") == ("unknownaccount", None)
+        assert lookup == []
+
+    def test_invalid_name(self, lookup):
+        ref, error = gate_tusc_api._resolve_referrer("Not A Name")
+        assert "error" in error
+        assert lookup == []
+
+    def test_lookup_error(self, lookup):
+        assert gate_tusc_api._resolve_referrer("brokenaccount") == ("registration-faucet",
+                                                                   gate_tusc_api.DefaultErrorResponse)
+
+    def test_wallet_not_ready(self, lookup, monkeypatch):
+        not_ready = {"error": "TUSC Wallet is not ready"}
+        monkeypatch.setattr(gate_tusc_api, "start_and_unlock_wallet", lambda: not_ready)
+        assert gate_tusc_api._resolve_referrer("unknownaccount") == ("registration-faucet", not_ready)
+
+
+class TestWalletHealthCheck:
+    def test_down_wallet_is_no_request_failure(self, monkeypatch):
+        failures = []
+
+        def refused(*args):
+            raise ConnectionError("Connection refused")
+
+        instance = gate_tusc_api.wallet_router.instances[0]
+        monkeypatch.setattr(instance.client, "call", refused)
+        monkeypatch.setattr(gate_tusc_api.wallet_circuit_breaker, "record_failure", lambda: failures.append("breaker"))
+        monkeypatch.setattr(gate_tusc_api.wallet_router, "eject", lambda instance: failures.append("eject"))
+
+        with gate_tusc_api.wallet_router.pin(instance):
+            assert instance.supervisor.check_health() == WALLET_DOWN
+        assert failures == []
@@ -1,7 +1,7 @@
 import pytest
 import copy
 from tusc_api import gate_tusc_api
-from config import wallet_cfg
+from config import wallet_cfg, tusc_api_cfg
 import log
 
 logger = log.setup_custom_logger('root', '')
@@ -16,6 +16,16 @@ def setup_teardown():
     print("teardown")
 
 
+@pytest.fixture()
+def locked_wallet():
+    # The supervisor keeps the wallet unlocked between calls, lock it so the next call has to unlock it again
+    gate_tusc_api.start_and_unlock_wallet()
+    gate_tusc_api._send_request("lock", [], True)
+    for instance in gate_tusc_api.wallet_router.instances:
+        instance.supervisor.mark_unhealthy()
+    yield None
+
+
 # These tests aren't the best since it actually starts a real wallet which requires the
 # target API node to be running but, assuming the node is running and available, it does prove things load properly
 class TestWallet_success:
@@ -37,6 +47,12 @@ class TestWallet_success:
             response = gate_tusc_api.start_and_unlock_wallet()
             assert response == gate_tusc_api.WalletUnlockResponseNoneResult
 
+    def test_restart_wallet(self):
+        response = gate_tusc_api.restart_wallet()
+        assert response == gate_tusc_api.WalletUnlockResponseNoneResult
+        response = gate_tusc_api.start_and_unlock_wallet()
+        assert response == gate_tusc_api.WalletUnlockResponseNoneResult
+
     def test_suggest_brain_key_with_exceptions(self):
         resp = gate_tusc_api.suggest_brain_key()
         assert 'result' in resp
@@ -69,26 +85,31 @@ class TestWallet_success:
             return
         pytest.fail("Should have caught exception")
 
-    def test_suggest_brain_key_with_exceptions_invalid_wallet_address(self, setup_teardown):
+    def test_restart_wallet_invalid_wallet_address(self, setup_teardown):
         wallet_cfg["node_address"] = "wss://not.a.real.website/wallet"
-        response = gate_tusc_api.suggest_brain_key()
+        response = gate_tusc_api.restart_wallet()
         assert response == gate_tusc_api.DefaultErrorResponse
 
-    def test_start_and_unlock_incorrect_password(self, setup_teardown):
+    def test_start_and_unlock_incorrect_password(self, setup_teardown, locked_wallet):
         wallet_cfg["wallet_password"] = "incorrectpassword"
         response = gate_tusc_api.start_and_unlock_wallet()
         assert response == gate_tusc_api.DefaultErrorResponse
 
-    def test_suggest_brain_key_with_exceptions_incorrect_password(self, setup_teardown):
+    def test_suggest_brain_key_with_exceptions_incorrect_password(self, setup_teardown, locked_wallet, monkeypatch):
+        monkeypatch.setitem(tusc_api_cfg, "brain_key_pool_enabled", False)
         wallet_cfg["wallet_password"] = "incorrectpassword"
         response = gate_tusc_api.suggest_brain_key()
         assert response == gate_tusc_api.DefaultErrorResponse
 
-    def test_register_account_with_exceptions_incorrect_password(self, setup_teardown):
+    def test_register_account_with_exceptions_incorrect_password(self, setup_teardown, locked_wallet):
         wallet_cfg["wallet_password"] = "incorrectpassword"
         response = gate_tusc_api.register_account(
             "asdqwert",
-            "b",
+            "TUSC6mC3SQiFEcsGzrwUTMHKPKyyE2GdA1bAfKuzEcdst7sRZc6rhR",
             "c"
         )
-        assert response == gate_tusc_api.DefaultErrorResponse
\ No newline at end of file
+        assert response == gate_tusc_api.DefaultErrorResponse
+
+    def test_register_account_invalid_public_key_rejected_locally(self):
+        response = gate_tusc_api.register_account("asdqwert", "b", "c")
+        assert response["error"].startswith("The public key 'b' is invalid.")
\ No newline at end of file
@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import queue
+import logging
+from log import JsonFormatter, DroppingQueueHandler, SharedRotatingFileHandler
+
+
+def make_record(msg, *args):
+    return logging.makeLogRecord({"name": "root", "levelno": logging.INFO, "levelname": "INFO", "module": "gate",
+                                  "msg": msg, "args": args})
+
+
+class TestJsonFormatter:
+    def test_one_json_object_per_record(self):
+        entry = json.loads(JsonFormatter().format(make_record("Registered %d accounts", 3)))
+        assert entry["level"] == "INFO"
+        assert entry["module"] == "gate"
+        assert entry["message"] == "Registered 3 accounts"
+
+
+class TestDroppingQueueHandler:
+    def test_drops_when_full(self):
+        handler = DroppingQueueHandler(queue.Queue(1))
+        handler.handle(make_record("first"))
+        handler.handle(make_record("second"))
+        handler.handle(make_record("third"))
+
+        assert handler.queue.get_nowait().getMessage() == "first"
+        assert handler.take_dropped() == 2
+        assert handler.take_dropped() == 0
+
+    def test_keeps_exception_for_formatter(self):
+        handler = DroppingQueueHandler(queue.Queue())
+        try:
+            raise ValueError("wallet exploded")
+        except ValueError:
+            record = logging.makeLogRecord({"name": "root", "levelno": logging.ERROR, "levelname": "ERROR",
+                                            "module": "gate", "msg": "Job %s failed", "args": ("j1",)})
+            record.exc_info = sys.exc_info()
+        handler.handle(record)
+
+        queued = handler.queue.get_nowait()
+        entry = json.loads(JsonFormatter().format(queued))
+        assert entry["message"] == "Job j1 failed"
+        assert "ValueError: wallet exploded" in entry["exception"]
+        assert logging.Formatter().format(queued).startswith("Job j1 failed\nTraceback")
+
+
+class TestSharedRotatingFileHandler:
+    def test_reopens_file_rotated_by_another_worker(self, tmp_path):
+        filename = os.path.join(str(tmp_path), "root.log")
+        first = SharedRotatingFileHandler(filename, maxBytes=1000, backupCount=2)
+        second = SharedRotatingFileHandler(filename, maxBytes=1000, backupCount=2)
+        try:
+            first.handle(make_record("from the first worker"))
+            second.handle(make_record("from the second worker"))
+            first.doRollover()
+            # The second worker follows the rotation instead of writing to the old file or rotating again
+            second.handle(make_record("after rotation"))
+            first.handle(make_record("first after rotation"))
+        finally:
+            first.close()
+            second.close()
+
+        with open(filename + ".1") as f:
+            assert f.read() == "from the first worker\nfrom the second worker\n"
+        with open(filename) as f:
+            assert f.read() == "after rotation\nfirst after rotation\n"
+        assert not os.path.exists(filename + ".2")
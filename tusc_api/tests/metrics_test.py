@@ -0,0 +1,82 @@
+import os
+import json
+from metrics import MetricsRegistry
+
+
+class TestMetricsRegistry:
+    def test_counters_are_summed_across_workers(self, tmp_path):
+        registry = MetricsRegistry()
+        errors = registry.counter("errors_total", "Errors", ["kind"])
+        errors.inc("is_locked")
+        errors.inc("is_locked")
+
+        # Another worker's snapshot, from a process that already exited
+        other = {"pid": 999999999, "counters": {"errors_total": [[["is_locked"], 3], [["unclassified"], 1]]},
+                 "histograms": {}, "gauges": {"pool_size": 7}}
+        with open(os.path.join(str(tmp_path), "metrics-999999999.json"), 'w') as f:
+            json.dump(other, f)
+
+        lines = registry.render(str(tmp_path)).splitlines()
+        assert 'errors_total{kind="is_locked"} 5' in lines
+        assert 'errors_total{kind="unclassified"} 1' in lines
+
+    def test_histogram_buckets_are_cumulative(self, tmp_path):
+        registry = MetricsRegistry()
+        seconds = registry.histogram("rpc_seconds", "RPC calls", ["method"], buckets=(0.1, 1.0))
+        seconds.observe(0.05, "info")
+        seconds.observe(0.5, "info")
+        seconds.observe(5, "info")
+
+        lines = registry.render(str(tmp_path)).splitlines()
+        assert 'rpc_seconds_bucket{method="info",le="0.1"} 1' in lines
+        assert 'rpc_seconds_bucket{method="info",le="1"} 2' in lines
+        assert 'rpc_seconds_bucket{method="info",le="+Inf"} 3' in lines
+        assert 'rpc_seconds_count{method="info"} 3' in lines
+        assert 'rpc_seconds_sum{method="info"} 5.55' in lines
+
+    def test_gauges_only_for_live_workers(self, tmp_path):
+        registry = MetricsRegistry()
+        registry.gauge("pool_size", "Pool size", lambda: 4)
+        with open(os.path.join(str(tmp_path), "metrics-999999999.json"), 'w') as f:
+            json.dump({"pid": 999999999, "counters": {}, "histograms": {}, "gauges": {"pool_size": 7}}, f)
+
+        lines = registry.render(str(tmp_path)).splitlines()
+        assert f'pool_size{{pid="{os.getpid()}"}} 4' in lines
+        assert 'pool_size{pid="999999999"} 7' not in lines
+
+    def test_label_values_are_escaped(self, tmp_path):
+        registry = MetricsRegistry()
+        registry.counter("errors_total", "Errors", ["kind"]).inc('a"b\\c\nd')
+
+        lines = registry.render(str(tmp_path)).splitlines()
+        assert 'errors_total{kind="a\\"b\\\\c\\nd"} 1' in lines
+
+    def test_exited_workers_are_merged_once(self, tmp_path):
+        registry = MetricsRegistry()
+        errors = registry.counter("errors_total", "Errors", ["kind"])
+        seconds = registry.histogram("rpc_seconds", "RPC calls", ["method"], buckets=(0.1, 1.0))
+        errors.inc("is_locked")
+        for pid in (999999998, 999999999):
+            with open(os.path.join(str(tmp_path), f"metrics-{pid}-abc.json"), 'w') as f:
+                json.dump({"pid": pid, "worker_id": "abc", "counters": {"errors_total": [[["is_locked"], 3]]},
+                           "histograms": {"rpc_seconds": [[["info"], [1, 0, 1], 5.05]]}, "gauges": {}}, f)
+
+        for x in range(2):
+            lines = registry.render(str(tmp_path)).splitlines()
+            assert 'errors_total{kind="is_locked"} 7' in lines
+            assert 'rpc_seconds_bucket{method="info",le="+Inf"} 4' in lines
+            assert 'rpc_seconds_sum{method="info"} 10.1' in lines
+        assert sorted(os.listdir(str(tmp_path))) == ["exited-workers.json", "exited-workers.json.lock",
+                                                     f"metrics-{os.getpid()}-{registry._worker_id()}.json"]
+
+    def test_reused_pid_does_not_overwrite_earlier_worker(self, tmp_path):
+        registry = MetricsRegistry()
+        registry.counter("errors_total", "Errors", ["kind"]).inc("is_locked")
+        # Left by an earlier worker that had this process's pid
+        with open(os.path.join(str(tmp_path), f"metrics-{os.getpid()}-earlier.json"), 'w') as f:
+            json.dump({"pid": os.getpid(), "worker_id": "earlier",
+                       "counters": {"errors_total": [[["is_locked"], 2]]}, "histograms": {}, "gauges": {}}, f)
+
+        lines = registry.render(str(tmp_path)).splitlines()
+        assert 'errors_total{kind="is_locked"} 3' in lines
+        assert not os.path.exists(os.path.join(str(tmp_path), f"metrics-{os.getpid()}-earlier.json"))
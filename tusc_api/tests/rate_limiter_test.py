@@ -0,0 +1,103 @@
+import os
+import time
+import threading
+import pytest
+from tusc_api import rate_limiter
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def limiter_factory(request, tmp_path):
+    def factory(window_seconds):
+        if request.param == "memory":
+            return rate_limiter.MemoryRateLimiter(window_seconds)
+        return rate_limiter.SqliteRateLimiter(os.path.join(str(tmp_path), "rate_limits.sqlite3"), window_seconds)
+    yield factory
+
+
+class TestRateLimiter:
+    def test_reserve_blocks_within_window(self, limiter_factory):
+        limiter = limiter_factory(60)
+        assert limiter.is_allowed("1.2.3.4")
+        assert limiter.reserve("1.2.3.4")
+        assert not limiter.is_allowed("1.2.3.4")
+        assert not limiter.reserve("1.2.3.4")
+        assert limiter.reserve("1.2.3.5")
+
+    def test_reservations_expire(self, limiter_factory):
+        limiter = limiter_factory(0.05)
+        assert limiter.reserve("1.2.3.4")
+        time.sleep(0.1)
+        assert limiter.is_allowed("1.2.3.4")
+        assert limiter.reserve("1.2.3.4")
+
+    def test_release(self, limiter_factory):
+        limiter = limiter_factory(60)
+        blocked_key, reservations = limiter.reserve_many([("1.2.3.4", 1)])
+        assert blocked_key is None
+        limiter.release_many(reservations)
+        assert limiter.reserve("1.2.3.4")
+
+    def test_release_only_own_reservation(self, limiter_factory):
+        limiter = limiter_factory(60)
+        blocked_key, first = limiter.reserve_many([("1.2.3.0/24", 2)])
+        blocked_key, second = limiter.reserve_many([("1.2.3.0/24", 2)])
+        limiter.release_many(first)
+        # Releasing twice (e.g. an expired job released by two workers) must not take the other request's slot
+        limiter.release_many(first)
+        assert not limiter.is_allowed("1.2.3.0/24", 1)
+        limiter.release_many(second)
+        assert limiter.is_allowed("1.2.3.0/24", 1)
+
+    def test_limit(self, limiter_factory):
+        limiter = limiter_factory(60)
+        assert limiter.reserve("1.2.3.0/24", 2)
+        assert limiter.reserve("1.2.3.0/24", 2)
+        assert not limiter.reserve("1.2.3.0/24", 2)
+
+    def test_concurrent_reserve_allows_one(self, limiter_factory):
+        limiter = limiter_factory(60)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(limiter.reserve("1.2.3.4"))) for x in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results.count(True) == 1
+
+
+class TestMemoryRateLimiter:
+    def test_memory_is_released_after_window(self):
+        limiter = rate_limiter.MemoryRateLimiter(0.05)
+        for x in range(100):
+            limiter.reserve(f"10.0.0.{x}")
+        time.sleep(0.1)
+        limiter.reserve("10.0.1.1")
+        assert len(limiter._reservations) == 1
+        assert len(limiter._expiry_order) == 1
+
+
+class TestRateLimitKeys:
+    def test_ipv4_prefix(self):
+        keys = rate_limiter.rate_limit_keys("1.2.3.4")
+        assert keys[0] == ("1.2.3.4", 1)
+        assert keys[1] == rate_limiter.rate_limit_keys("1.2.3.200")[1]
+        assert keys[1] != rate_limiter.rate_limit_keys("1.2.4.4")[1]
+
+    def test_ipv6_prefix(self):
+        keys = rate_limiter.rate_limit_keys("2001:db8:1:2::1")
+        assert keys[1] == rate_limiter.rate_limit_keys("2001:db8:1:2:ffff::5")[1]
+        assert keys[1] != rate_limiter.rate_limit_keys("2001:db8:1:3::1")[1]
+
+    def test_invalid_address_has_no_prefix(self):
+        assert rate_limiter.rate_limit_keys("") == [("", 1)]
+
+    def test_prefix_quota(self, limiter_factory):
+        limiter = limiter_factory(60)
+        quota = rate_limiter.general_cfg["ipv4_prefix_quota"]
+        for x in range(quota):
+            assert limiter.reserve_many(rate_limiter.rate_limit_keys(f"1.2.3.{x}"))[0] is None
+
+        blocked_keys = rate_limiter.rate_limit_keys("1.2.3.250")
+        assert limiter.reserve_many(blocked_keys) == (blocked_keys[1][0], [])
+        # Nothing was reserved for the rejected address
+        assert limiter.is_allowed("1.2.3.250")
@@ -0,0 +1,78 @@
+import threading
+from tusc_api.registration_batcher import RegistrationBatcher
+
+
+def submit_concurrently(batcher, items):
+    results = [None] * len(items)
+    errors = [None] * len(items)
+
+    def submit(index):
+        try:
+            results[index] = batcher.submit(items[index])
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(len(items))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+class TestRegistrationBatcher:
+    def test_single_registration(self):
+        batches = []
+
+        def register_batch(items):
+            batches.append(list(items))
+            return [{"result": item} for item in items]
+
+        batcher = RegistrationBatcher(register_batch, 10, 0)
+        assert batcher.submit("someaccountname") == {"result": "someaccountname"}
+        assert batches == [["someaccountname"]]
+
+    def test_concurrent_registrations_are_batched(self):
+        batches = []
+
+        def register_batch(items):
+            batches.append(list(items))
+            return [{"result": item} for item in items]
+
+        batcher = RegistrationBatcher(register_batch, 5, 2000)
+        items = [f"account{i}" for i in range(10)]
+        results, errors = submit_concurrently(batcher, items)
+
+        # Full batches run without waiting out the window
+        assert results == [{"result": item} for item in items]
+        assert errors == [None] * 10
+        assert sorted(len(batch) for batch in batches) == [5, 5]
+
+    def test_each_caller_gets_its_own_result(self):
+        def register_batch(items):
+            return [{"error": item} if item.endswith("1") else {"result": item} for item in items]
+
+        batcher = RegistrationBatcher(register_batch, 2, 1000)
+        results, errors = submit_concurrently(batcher, ["account0", "account1"])
+        assert results == [{"result": "account0"}, {"error": "account1"}]
+
+    def test_error_raised_in_every_caller(self):
+        def register_batch(items):
+            raise ConnectionError("wallet down")
+
+        batcher = RegistrationBatcher(register_batch, 3, 1000)
+        results, errors = submit_concurrently(batcher, ["account0", "account1", "account2"])
+        assert results == [None] * 3
+        assert all(isinstance(error, ConnectionError) for error in errors)
+
+    def test_window_closes_partial_batch(self):
+        batches = []
+
+        def register_batch(items):
+            batches.append(list(items))
+            return [{"result": item} for item in items]
+
+        batcher = RegistrationBatcher(register_batch, 100, 50)
+        results, errors = submit_concurrently(batcher, ["account0", "account1"])
+        assert results == [{"result": "account0"}, {"result": "account1"}]
+        assert sum(len(batch) for batch in batches) == 2
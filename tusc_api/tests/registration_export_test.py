@@ -0,0 +1,92 @@
+import csv
+import io
+import json
+import datetime
+import pytest
+import db_access.db as db
+from tusc_api import registration_export
+from tusc_api.registration_export import InvalidExportRequestError
+
+ROWS = [
+    (1, "alice", "TUSC6YZ8dWrEzGDnZPaRCxgXQ8yXeYMV9dvuUsrRskXW6FqTwPWyLT", "",
+     datetime.datetime(2019, 9, 30, 12, 1, 2)),
+    (2, "bob", "TUSC5KCSDw3Dng58VNeKm3Xf8dpxwxxDpTxSAs4n5kdF6VzQZdDuUc3", "some, partner",
+     datetime.datetime(2019, 9, 30, 12, 1, 2, 345678)),
+]
+
+
+class TestRegistrationExport:
+    def test_authorization(self):
+        assert registration_export.is_authorized("Bearer secret", ["other", "secret"])
+        assert not registration_export.is_authorized("Bearer wrong", ["secret"])
+        assert not registration_export.is_authorized("secret", ["secret"])
+        assert not registration_export.is_authorized(None, ["secret"])
+        # No tokens configured means the endpoints are off
+        assert not registration_export.is_authorized("Bearer ", [])
+
+    def test_created_range(self):
+        assert registration_export.parse_created_range({}) == (None, None)
+        created_from, created_to = registration_export.parse_created_range(
+            {"from": "2019-09-01", "to": "2019-10-01T02:00:00+02:00"})
+        assert created_from == datetime.datetime(2019, 9, 1)
+        assert created_to == datetime.datetime(2019, 10, 1)
+
+        with pytest.raises(InvalidExportRequestError):
+            registration_export.parse_created_range({"from": "yesterday"})
+
+    def test_limit_and_format(self):
+        assert registration_export.parse_limit(None, 100, 1000) == 100
+        assert registration_export.parse_limit("5", 100, 1000) == 5
+        for value in ("0", "1001", "many"):
+            with pytest.raises(InvalidExportRequestError):
+                registration_export.parse_limit(value, 100, 1000)
+
+        assert registration_export.parse_format(None) == "ndjson"
+        assert registration_export.parse_format("csv") == "csv"
+        with pytest.raises(InvalidExportRequestError):
+            registration_export.parse_format("xml")
+
+    def test_cursor_round_trip(self):
+        after = registration_export.next_after(ROWS)
+        assert after == (ROWS[1][4], 2)
+        assert registration_export.decode_cursor(registration_export.encode_cursor(after)) == after
+        assert registration_export.decode_cursor(None) is None
+
+        with pytest.raises(InvalidExportRequestError):
+            registration_export.decode_cursor("not a cursor")
+
+    def test_export_pages(self, monkeypatch):
+        requested = []
+
+        def get_registrations_page(created_from, created_to, after, limit):
+            requested.append(after)
+            start = 0 if after is None else [row[0] for row in ROWS].index(after[1]) + 1
+            return ROWS[start:start + limit]
+
+        monkeypatch.setattr(db, "get_registrations_page", get_registrations_page)
+        assert list(db.iter_registration_pages(None, None, 1)) == [ROWS[:1], ROWS[1:]]
+        assert requested == [None, registration_export.next_after(ROWS[:1]), registration_export.next_after(ROWS)]
+
+    def test_page_result(self):
+        page = registration_export.page_result(ROWS, 2)
+        assert page["registrations"][1] == {"id": 2,
+                                            "tusc_account_name": "bob",
+                                            "tusc_public_key": ROWS[1][2],
+                                            "referrer": "some, partner",
+                                            "created_at": "2019-09-30T12:01:02.345678"}
+        assert registration_export.decode_cursor(page["next"]) == (ROWS[1][4], 2)
+
+        # A short page is the last one
+        assert registration_export.page_result(ROWS, 3)["next"] is None
+        assert registration_export.page_result([], 3) == {"registrations": [], "next": None}
+
+    def test_ndjson(self):
+        assert registration_export.format_header("ndjson") == ""
+        lines = registration_export.format_rows("ndjson", ROWS).splitlines()
+        assert [json.loads(line)["tusc_account_name"] for line in lines] == ["alice", "bob"]
+
+    def test_csv(self):
+        text = registration_export.format_header("csv") + registration_export.format_rows("csv", ROWS)
+        rows = list(csv.reader(io.StringIO(text)))
+        assert rows[0] == registration_export.COLUMNS
+        assert rows[2] == ["2", "bob", ROWS[1][2], "some, partner", "2019-09-30T12:01:02.345678"]
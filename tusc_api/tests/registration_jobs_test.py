@@ -0,0 +1,110 @@
+import time
+import threading
+import pytest
+from tusc_api import registration_jobs
+from tusc_api.registration_jobs import RegistrationJobRunner
+
+ErrorResponse = {"error": "Something went wrong, please contact tusc support"}
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class FakeJobTable:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queued = []
+        self.finished = {}
+        self.expired = []
+        self.runners = []
+
+    def claim_registration_job(self):
+        with self.lock:
+            return self.queued.pop(0) if self.queued else None
+
+    def finish_registration_job(self, job_id, status, response):
+        self.finished[job_id] = (status, response)
+
+    def expire_registration_jobs(self, stale_seconds, retention_hours, response):
+        expired, self.expired = self.expired, []
+        return expired
+
+
+@pytest.fixture
+def job_table(monkeypatch):
+    table = FakeJobTable()
+    monkeypatch.setattr(registration_jobs.db, "claim_registration_job", table.claim_registration_job)
+    monkeypatch.setattr(registration_jobs.db, "finish_registration_job", table.finish_registration_job)
+    monkeypatch.setattr(registration_jobs.db, "expire_registration_jobs", table.expire_registration_jobs)
+    yield table
+    for runner in table.runners:
+        runner.stop()
+
+
+def job(account_name):
+    return {"id": registration_jobs.new_job_id(), "account_name": account_name, "public_key": "TUSCkey",
+            "referrer": "", "ip_address": "127.0.0.1", "rate_limit_reservations": []}
+
+
+class TestRegistrationJobRunner:
+    def test_runs_queued_jobs(self, job_table):
+        jobs = [job("account0"), job("account1")]
+        job_table.queued.extend(jobs)
+
+        def run_job(j):
+            if j["account_name"] == "account1":
+                return {"error": "Account name 'account1' already in use."}
+            return {"result": {"ref_block_num": 1}}
+
+        runner = RegistrationJobRunner(run_job, lambda j: None, ErrorResponse, 2, 0.05, 300, 24)
+
+        job_table.runners.append(runner)
+        runner.start()
+
+        assert wait_for(lambda: len(job_table.finished) == 2)
+        assert job_table.finished[jobs[0]["id"]] == ("succeeded", {"result": {"ref_block_num": 1}})
+        assert job_table.finished[jobs[1]["id"]][0] == "failed"
+
+    def test_exception_fails_job(self, job_table):
+        queued = job("account0")
+        job_table.queued.append(queued)
+
+        def run_job(j):
+            raise ConnectionError("wallet down")
+
+        runner = RegistrationJobRunner(run_job, lambda j: None, ErrorResponse, 1, 0.05, 300, 24)
+
+        job_table.runners.append(runner)
+        runner.start()
+
+        assert wait_for(lambda: queued["id"] in job_table.finished)
+        assert job_table.finished[queued["id"]] == ("failed", ErrorResponse)
+
+    def test_expired_jobs_are_reported(self, job_table):
+        expired = job("account0")
+        job_table.expired.append(expired)
+        reported = []
+
+        runner = RegistrationJobRunner(lambda j: {"result": None}, reported.append, ErrorResponse, 1, 0.05, 300, 24)
+
+        job_table.runners.append(runner)
+        runner.start()
+
+        assert wait_for(lambda: reported == [expired])
+
+    def test_wake(self, job_table):
+        runner = RegistrationJobRunner(lambda j: {"result": None}, lambda j: None, ErrorResponse, 1, 10, 300, 24)
+        job_table.runners.append(runner)
+        runner.start()
+        time.sleep(0.1)
+
+        queued = job("account0")
+        job_table.queued.append(queued)
+        runner.wake()
+        assert wait_for(lambda: queued["id"] in job_table.finished, timeout=2)
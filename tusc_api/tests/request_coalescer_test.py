@@ -0,0 +1,141 @@
+import time
+import threading
+import pytest
+from tusc_api.request_coalescer import RequestCoalescer, IdempotencyKeyReusedError
+
+
+@pytest.fixture
+def coalescer(tmp_path):
+    return RequestCoalescer(str(tmp_path), 5, 60)
+
+
+class TestCoalesce:
+    def test_concurrent_duplicates_share_result(self, coalescer):
+        calls = []
+        started = threading.Event()
+
+        def func():
+            calls.append(1)
+            started.set()
+            time.sleep(0.3)
+            return {"result": len(calls)}
+
+        results = []
+        first = threading.Thread(target=lambda: results.append(coalescer.coalesce("someaccountname", func)))
+        first.start()
+        started.wait(5)
+        others = [threading.Thread(target=lambda: results.append(coalescer.coalesce("someaccountname", func)))
+                  for x in range(3)]
+        for thread in others:
+            thread.start()
+        for thread in [first] + others:
+            thread.join(5)
+
+        assert calls == [1]
+        assert results == [{"result": 1}] * 4
+
+    def test_later_request_runs_again(self, coalescer):
+        calls = []
+
+        def func():
+            calls.append(1)
+            return {"result": len(calls)}
+
+        assert coalescer.coalesce("someaccountname", func) == {"result": 1}
+        assert coalescer.coalesce("someaccountname", func) == {"result": 2}
+
+    def test_different_keys_do_not_wait(self, coalescer):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return {"result": "slow"}
+
+        thread = threading.Thread(target=lambda: coalescer.coalesce("firstaccount", slow))
+        thread.start()
+        started.wait(5)
+        assert coalescer.coalesce("secondaccount", lambda: {"result": "fast"}) == {"result": "fast"}
+        release.set()
+        thread.join(5)
+
+    def test_wait_timeout_runs_without_coalescing(self, tmp_path):
+        coalescer = RequestCoalescer(str(tmp_path), 0.1, 60)
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return {"result": "slow"}
+
+        thread = threading.Thread(target=lambda: coalescer.coalesce("someaccountname", slow))
+        thread.start()
+        started.wait(5)
+        assert coalescer.coalesce("someaccountname", lambda: {"result": "fast"}) == {"result": "fast"}
+        release.set()
+        thread.join(5)
+
+
+class TestIdempotent:
+    def test_saved_response_returned(self, coalescer):
+        calls = []
+
+        def func():
+            calls.append(1)
+            return {"result": len(calls)}
+
+        assert coalescer.idempotent("key", "request", func, lambda r: True) == {"result": 1}
+        assert coalescer.idempotent("key", "request", func, lambda r: True) == {"result": 1}
+        assert calls == [1]
+
+    def test_different_request_rejected(self, coalescer):
+        coalescer.idempotent("key", "request", lambda: {"result": 1}, lambda r: True)
+        with pytest.raises(IdempotencyKeyReusedError):
+            coalescer.idempotent("key", "other request", lambda: {"result": 2}, lambda r: True)
+
+    def test_uncacheable_response_not_saved(self, coalescer):
+        responses = [{"error": "Something went wrong"}, {"result": 1}]
+        is_cacheable = lambda r: "error" not in r
+
+        assert coalescer.idempotent("key", "request", lambda: responses.pop(0), is_cacheable) == \
+            {"error": "Something went wrong"}
+        assert coalescer.idempotent("key", "request", lambda: responses.pop(0), is_cacheable) == {"result": 1}
+
+    def test_expired_response(self, tmp_path):
+        coalescer = RequestCoalescer(str(tmp_path), 5, 0.1)
+        coalescer.idempotent("key", "request", lambda: {"result": 1}, lambda r: True)
+        time.sleep(0.2)
+        assert coalescer.idempotent("key", "request", lambda: {"result": 2}, lambda r: True) == {"result": 2}
+
+
+class TestCoalesceAsync:
+    def test_concurrent_duplicates_share_result(self, coalescer):
+        import asyncio
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.2)
+            return {"result": len(calls)}
+
+        async def main():
+            return await asyncio.gather(*[coalescer.coalesce_async("someaccountname", func) for x in range(4)])
+
+        assert asyncio.run(main()) == [{"result": 1}] * 4
+        assert calls == [1]
+
+    def test_idempotent(self, coalescer):
+        import asyncio
+
+        async def func():
+            return {"result": 1}
+
+        async def main():
+            first = await coalescer.idempotent_async("key", "request", func, lambda r: True)
+            with pytest.raises(IdempotencyKeyReusedError):
+                await coalescer.idempotent_async("key", "other request", func, lambda r: True)
+            return first
+
+        assert asyncio.run(main()) == {"result": 1}
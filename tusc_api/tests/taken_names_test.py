@@ -0,0 +1,72 @@
+import time
+from tusc_api.taken_names import BloomFilter, TakenNamesIndex
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestBloomFilter:
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        names = [f"account-name-{i}" for i in range(1000)]
+        for name in names:
+            bloom.add(name)
+        assert all(name in bloom for name in names)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f"account-name-{i}")
+        false_positives = sum(f"other-name-{i}" in bloom for i in range(10000))
+        assert false_positives < 300
+
+
+class TestTakenNamesIndex:
+    def test_add(self):
+        index = TakenNamesIndex(1000, 0.01, 10)
+        assert not index.is_known_taken("someaccountname")
+        assert not index.might_be_taken("someaccountname")
+
+        index.add("someaccountname")
+        assert index.is_known_taken("someaccountname")
+        assert index.might_be_taken("someaccountname")
+
+    def test_lru_evicts_but_bloom_remembers(self):
+        index = TakenNamesIndex(1000, 0.01, 2)
+        for name in ["firstaccount", "secondaccount", "thirdaccount"]:
+            index.add(name)
+        assert not index.is_known_taken("firstaccount")
+        assert index.might_be_taken("firstaccount")
+        assert index.is_known_taken("thirdaccount")
+
+    def test_seed_only_once(self):
+        index = TakenNamesIndex(1000, 0.01, 10)
+        calls = []
+
+        def load_names():
+            calls.append(1)
+            return ["seededaccount"]
+
+        index.seed(load_names)
+        index.seed(load_names)
+        assert wait_for(lambda: index.might_be_taken("seededaccount"))
+        assert calls == [1]
+        # Seeded names still need confirming
+        assert not index.is_known_taken("seededaccount")
+
+    def test_seed_failure(self):
+        index = TakenNamesIndex(1000, 0.01, 10)
+
+        def load_names():
+            yield "seededaccount"
+            raise Exception("database is down")
+
+        index.seed(load_names)
+        assert wait_for(lambda: index.might_be_taken("seededaccount"))
+
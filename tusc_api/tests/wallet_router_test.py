@@ -0,0 +1,71 @@
+import time
+import threading
+from tusc_api.wallet_router import WalletRouter, WalletInstance
+
+
+def make_router(count, recover=lambda instance: True, retry_seconds=0.01):
+    return WalletRouter([WalletInstance(i, 5071 + i, None, None) for i in range(count)], recover, retry_seconds)
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class TestWalletRouter:
+    def test_routes_to_least_outstanding(self):
+        router = make_router(3)
+        with router.route() as first:
+            # A new thread has its own context, it is routed separately
+            seen = []
+            thread = threading.Thread(target=lambda: seen.append(_route_once(router)))
+            thread.start()
+            thread.join()
+            assert seen[0] is not first
+            assert first.outstanding == 1
+        assert first.outstanding == 0
+
+    def test_nested_route_stays_on_instance(self):
+        router = make_router(3)
+        with router.route() as outer:
+            with router.route() as inner:
+                assert inner is outer
+                assert router.current() is outer
+            assert outer.outstanding == 1
+        assert router.current() is None
+
+    def test_ejected_instance_is_skipped_until_recovered(self):
+        recovered = threading.Event()
+        router = make_router(2, lambda instance: recovered.is_set())
+        broken = router.instances[0]
+        router.eject(broken)
+        assert router.in_rotation_count() == 1
+
+        for x in range(10):
+            with router.route() as instance:
+                assert instance is not broken
+
+        recovered.set()
+        wait_for(lambda: broken.in_rotation)
+        assert router.in_rotation_count() == 2
+
+    def test_recovery_runs_pinned_to_instance(self):
+        current = []
+        router = make_router(2, lambda instance: current.append((instance, router.current())) or True)
+        router.eject(router.instances[1])
+        wait_for(lambda: router.instances[1].in_rotation)
+        assert current[0] == (router.instances[1], router.instances[1])
+
+    def test_all_ejected_still_routes(self):
+        router = make_router(2, lambda instance: False, retry_seconds=10)
+        for instance in router.instances:
+            router.eject(instance)
+        with router.route() as instance:
+            assert instance in router.instances
+
+
+def _route_once(router):
+    with router.route() as instance:
+        return instance
@@ -0,0 +1,210 @@
+import json
+import queue
+import concurrent.futures
+import pytest
+from tusc_api.wallet_rpc import WalletRpcClient, WalletWebSocketClient, WalletRpcError, websocket
+
+
+class FakeResponse:
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.status_code = status_code
+
+
+class FakeSession:
+    """
+    Stands in for the requests.Session of a WalletRpcClient, answer gets the decoded request payload. An answer that
+    is a FakeResponse is sent as it is.
+    """
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.payloads = []
+
+    def post(self, url, data, timeout):
+        payload = json.loads(data)
+        self.payloads.append(payload)
+        answer = self.answer(payload)
+        return answer if isinstance(answer, FakeResponse) else FakeResponse(json.dumps(answer))
+
+
+def make_client(answer):
+    client = WalletRpcClient("http://127.0.0.1:9999/rpc")
+    client._session = FakeSession(answer)
+    return client
+
+
+def echo(req):
+    return {"id": req["id"], "jsonrpc": "2.0", "result": req["method"]}
+
+
+class TestCall:
+    def test_call(self):
+        client = make_client(echo)
+        assert client.call("info", [])["result"] == "info"
+        assert client.call("about", [])["result"] == "about"
+        assert [payload["id"] for payload in client._session.payloads] == [1, 2]
+
+    def test_response_id_mismatch(self):
+        client = make_client(lambda req: {**echo(req), "id": req["id"] + 1})
+        with pytest.raises(WalletRpcError):
+            client.call("info", [])
+
+    def test_response_without_id(self):
+        client = make_client(lambda req: {"result": None})
+        with pytest.raises(WalletRpcError):
+            client.call("info", [])
+
+
+class TestBatch:
+    def test_results_reordered_by_id(self):
+        client = make_client(lambda reqs: [echo(req) for req in reversed(reqs)])
+        responses = client.batch([("info", []), ("about", []), ("get_account", ["someaccountname"])])
+        assert [response["result"] for response in responses] == ["info", "about", "get_account"]
+
+    def test_missing_id(self):
+        client = make_client(lambda reqs: [echo(req) for req in reqs[1:]])
+        with pytest.raises(WalletRpcError):
+            client.batch([("info", []), ("about", [])])
+
+    def test_falls_back_to_single_calls(self):
+        def answer(req):
+            if isinstance(req, list):
+                return {"id": None, "error": {"message": "Batch requests are not supported"}}
+            return echo(req)
+
+        client = make_client(answer)
+        responses = client.batch([("info", []), ("about", [])])
+        assert [response["result"] for response in responses] == ["info", "about"]
+        assert [isinstance(payload, list) for payload in client._session.payloads] == [True, False, False]
+
+    def test_array_body_rejected_like_cli_wallet(self):
+        # cli_wallet answers a JSON array body with HTTP 500 and no body
+        client = make_client(lambda req: FakeResponse("", 500) if isinstance(req, list) else echo(req))
+        for _ in range(2):
+            responses = client.batch([("info", []), ("about", [])])
+            assert [response["result"] for response in responses] == ["info", "about"]
+
+        # Only the first batch is sent as one
+        assert [isinstance(payload, list) for payload in client._session.payloads] == [True] + [False] * 4
+
+    def test_supported_batch_failing_once_is_retried(self):
+        failures = [FakeResponse("", 500)]
+
+        def answer(reqs):
+            if isinstance(reqs, list) and len(client._session.payloads) > 1 and len(failures) > 0:
+                return failures.pop()
+            return [echo(req) for req in reqs] if isinstance(reqs, list) else echo(reqs)
+
+        client = make_client(answer)
+        for _ in range(3):
+            responses = client.batch([("info", []), ("about", [])])
+            assert [response["result"] for response in responses] == ["info", "about"]
+        assert [isinstance(payload, list) for payload in client._session.payloads] == [True, True, False, False, True]
+
+    def test_error_status_with_json_body(self):
+        client = make_client(lambda req: FakeResponse(json.dumps({"id": req["id"], "error": {"message": "locked"}}),
+                                                      500))
+        assert client.call("info", [])["error"] == {"message": "locked"}
+
+    def test_error_status_without_body(self):
+        client = make_client(lambda req: FakeResponse("", 500))
+        with pytest.raises(json.JSONDecodeError):
+            client.call("info", [])
+
+
+class FakeWebSocket:
+    """
+    A connection from websocket.create_connection. answer gets the requests sent so far that are still unanswered
+    and returns the responses to deliver now. fail_send fails every send, drop_after_send closes the connection once
+    a request was sent.
+    """
+
+    def __init__(self, answer, fail_send=False, drop_after_send=False):
+        self.answer = answer
+        self.fail_send = fail_send
+        self.drop_after_send = drop_after_send
+        self.unanswered = []
+        self.messages = queue.Queue()
+
+    def settimeout(self, timeout):
+        pass
+
+    def send(self, data):
+        if self.fail_send:
+            raise websocket.WebSocketConnectionClosedException("socket is already closed.")
+        self.unanswered.append(json.loads(data))
+        for response in self.answer(self.unanswered):
+            self.unanswered.remove(next(req for req in self.unanswered if req["id"] == response["id"]))
+            self.messages.put(json.dumps(response))
+        if self.drop_after_send:
+            self.close()
+
+    def recv(self):
+        message = self.messages.get()
+        if message is None:
+            raise websocket.WebSocketConnectionClosedException("Connection to remote host was lost.")
+        return message
+
+    def close(self):
+        self.messages.put(None)
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    """The FakeWebSockets the next connects return, in order."""
+    connections = []
+    connected = []
+
+    def create_connection(url, timeout):
+        connected.append(connections.pop(0))
+        return connected[-1]
+
+    monkeypatch.setattr(websocket, "create_connection", create_connection)
+    yield connections
+
+
+@pytest.mark.skipif(websocket is None, reason="needs the websocket-client package")
+class TestWebSocket:
+    def test_pipelined_calls_matched_by_id(self, connections):
+        # Nothing is answered until both calls are in flight, then the second one is answered first
+        connections.append(FakeWebSocket(lambda reqs: [echo(req) for req in reversed(reqs)] if len(reqs) == 2
+                                         else []))
+        client = WalletWebSocketClient("ws://127.0.0.1:9999/")
+        responses = client.batch([("info", []), ("about", [])])
+        assert [response["result"] for response in responses] == ["info", "about"]
+        assert client._pending == {}
+
+    def test_concurrent_calls(self, connections):
+        connections.append(FakeWebSocket(lambda reqs: [echo(req) for req in reqs]))
+        client = WalletWebSocketClient("ws://127.0.0.1:9999/")
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            methods = [f"method{i}" for i in range(32)]
+            responses = list(executor.map(lambda method: client.call(method, []), methods))
+        assert [response["result"] for response in responses] == methods
+
+    def test_send_failure_reconnects_and_retries_once(self, connections):
+        connections.append(FakeWebSocket(lambda reqs: [], fail_send=True))
+        connections.append(FakeWebSocket(lambda reqs: [echo(req) for req in reqs]))
+        client = WalletWebSocketClient("ws://127.0.0.1:9999/")
+        assert client.call("info", [])["result"] == "info"
+        assert connections == []
+
+    def test_second_send_failure_is_raised(self, connections):
+        connections.append(FakeWebSocket(lambda reqs: [], fail_send=True))
+        connections.append(FakeWebSocket(lambda reqs: [], fail_send=True))
+        client = WalletWebSocketClient("ws://127.0.0.1:9999/")
+        with pytest.raises(websocket.WebSocketException):
+            client.call("info", [])
+        assert client._pending == {}
+
+    def test_pending_calls_fail_when_connection_drops(self, connections):
+        # The wallet goes away once it got the request, without answering it
+        connections.append(FakeWebSocket(lambda reqs: [], drop_after_send=True))
+        connections.append(FakeWebSocket(lambda reqs: [echo(req) for req in reqs]))
+        client = WalletWebSocketClient("ws://127.0.0.1:9999/")
+        with pytest.raises(ConnectionError):
+            client.call("info", [])
+
+        # The next call connects again
+        assert client.call("about", [])["result"] == "about"
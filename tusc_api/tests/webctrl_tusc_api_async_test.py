@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+
+quart = pytest.importorskip("quart")
+pytest.importorskip("aiohttp")
+pytest.importorskip("asyncpg")
+
+from tusc_api import gate_tusc_api
+from tusc_api import gate_tusc_api_async
+from tusc_api import rate_limiter
+from tusc_api import webctrl_tusc_api
+from tusc_api import webctrl_tusc_api_async
+from tusc_api.admission import WalletUnavailableError
+from tusc_api.request_coalescer import RequestCoalescer
+
+PUBLIC_KEY = "TUSC6YZ8dWrEzGDnZPaRCxgXQ8yXeYMV9dvuUsrRskXW6FqTwPWyLT"
+REGISTRATION = {"account_name": "someaccountname", "public_key": PUBLIC_KEY}
+HEADERS = {"X-Real-IP": "1.2.3.4"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(webctrl_tusc_api_async.general_cfg, "disable_ip_blocking", False)
+    monkeypatch.setitem(webctrl_tusc_api_async.general_cfg, "disable_recaptcha", True)
+    monkeypatch.setitem(webctrl_tusc_api_async.tusc_api_cfg, "registration_jobs_enabled", False)
+    monkeypatch.setattr(webctrl_tusc_api, "ip_rate_limiter", rate_limiter.MemoryRateLimiter(60))
+
+    app = quart.Quart(__name__)
+    app.register_blueprint(webctrl_tusc_api_async.tusc_api)
+    yield app.test_client()
+
+
+def post(client, content, headers=HEADERS):
+    async def request():
+        response = await client.post("/wallet/register_account", json=content, headers=headers)
+        return response.status_code, await response.get_json()
+
+    return asyncio.run(request())
+
+
+async def registered(account_name, public_key, referrer):
+    return {"result": {"account_name": account_name}}
+
+
+class TestRegisterAccount:
+    def test_registered(self, client, monkeypatch):
+        monkeypatch.setattr(gate_tusc_api_async, "register_account", registered)
+        assert post(client, REGISTRATION) == (200, {"result": {"account_name": "someaccountname"}})
+
+        # The rate limit is shared with webctrl_tusc_api
+        status, response = post(client, REGISTRATION)
+        assert "error" in response
+        assert not webctrl_tusc_api.ip_rate_limiter.is_allowed("1.2.3.4")
+
+    def test_missing_fields(self, client, monkeypatch):
+        monkeypatch.setattr(gate_tusc_api_async, "register_account", registered)
+        assert post(client, {"account_name": "someaccountname"}) == (200, webctrl_tusc_api.MissingFieldsResponse)
+        assert webctrl_tusc_api.ip_rate_limiter.is_allowed("1.2.3.4")
+
+    def test_failed_captcha(self, client, monkeypatch):
+        async def verify_async(token, ip):
+            return token == "fresh"
+
+        monkeypatch.setitem(webctrl_tusc_api_async.general_cfg, "disable_recaptcha", False)
+        monkeypatch.setattr(webctrl_tusc_api_async.captcha_verifier, "verify_async", verify_async)
+        monkeypatch.setattr(gate_tusc_api_async, "register_account", registered)
+        assert post(client, REGISTRATION) == (200, webctrl_tusc_api.FailedCaptchaResponse)
+        assert post(client, {**REGISTRATION, "recaptcha_response": "fresh"})[1] == \
+            {"result": {"account_name": "someaccountname"}}
+
+    def test_unavailable_releases_rate_limit(self, client, monkeypatch):
+        async def unavailable(*args):
+            raise WalletUnavailableError("The service is busy. Please try again later.", 1)
+
+        monkeypatch.setattr(gate_tusc_api_async, "register_account", unavailable)
+        assert post(client, REGISTRATION)[0] == 503
+        assert webctrl_tusc_api.ip_rate_limiter.is_allowed("1.2.3.4")
+
+    def test_idempotency_key(self, client, monkeypatch, tmp_path):
+        monkeypatch.setattr(gate_tusc_api, "request_coalescer", RequestCoalescer(str(tmp_path), 5, 60))
+        monkeypatch.setattr(gate_tusc_api_async, "register_account", registered)
+        headers = {**HEADERS, "Idempotency-Key": "k1"}
+        assert post(client, REGISTRATION, headers)[1] == {"result": {"account_name": "someaccountname"}}
+        assert post(client, {**REGISTRATION, "account_name": "otheraccountname"}, headers)[1] == \
+            webctrl_tusc_api.IdempotencyKeyReusedResponse
+
+
+class TestRunInThread:
+    def test_keeps_the_routed_wallet_instance(self):
+        instance = gate_tusc_api.wallet_router.instances[0]
+
+        async def routed():
+            with gate_tusc_api.wallet_router.pin(instance):
+                return await gate_tusc_api_async.run_in_thread(gate_tusc_api.wallet_router.current)
+
+        assert asyncio.run(routed()) is instance
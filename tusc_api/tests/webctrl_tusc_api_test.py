@@ -0,0 +1,145 @@
+import pytest
+from flask import Flask
+from tusc_api import gate_tusc_api
+from tusc_api import rate_limiter
+from tusc_api import webctrl_tusc_api
+from tusc_api.admission import WalletUnavailableError
+from tusc_api.request_coalescer import RequestCoalescer
+
+PUBLIC_KEY = "TUSC6YZ8dWrEzGDnZPaRCxgXQ8yXeYMV9dvuUsrRskXW6FqTwPWyLT"
+REGISTRATION = {"account_name": "someaccountname", "public_key": PUBLIC_KEY}
+HEADERS = {"X-Real-IP": "1.2.3.4"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(webctrl_tusc_api.general_cfg, "disable_ip_blocking", False)
+    monkeypatch.setitem(webctrl_tusc_api.general_cfg, "disable_recaptcha", True)
+    monkeypatch.setitem(webctrl_tusc_api.tusc_api_cfg, "registration_jobs_enabled", False)
+    monkeypatch.setattr(webctrl_tusc_api, "ip_rate_limiter", rate_limiter.MemoryRateLimiter(60))
+
+    app = Flask(__name__)
+    app.register_blueprint(webctrl_tusc_api.tusc_api)
+    yield app.test_client()
+
+
+def unavailable(*args):
+    raise WalletUnavailableError("The service is busy. Please try again later.", 1)
+
+
+def registered(account_name, public_key, referrer):
+    return {"result": {"account_name": account_name}}
+
+
+class TestRegisterAccount:
+    def test_unavailable_releases_rate_limit(self, client, monkeypatch):
+        monkeypatch.setattr(gate_tusc_api, "register_account", unavailable)
+        response = client.post("/wallet/register_account", json=REGISTRATION, headers=HEADERS)
+        assert response.status_code == 503
+
+        monkeypatch.setattr(gate_tusc_api, "register_account", registered)
+        response = client.post("/wallet/register_account", json=REGISTRATION, headers=HEADERS)
+        assert response.get_json() == {"result": {"account_name": "someaccountname"}}
+
+        # Only the successful registration counts
+        response = client.post("/wallet/register_account", json=REGISTRATION, headers=HEADERS)
+        assert "error" in response.get_json()
+
+    def test_unexpected_error_releases_rate_limit(self, client, monkeypatch):
+        def broken(*args):
+            raise RuntimeError("wallet exploded")
+
+        monkeypatch.setattr(gate_tusc_api, "register_account", broken)
+        assert client.post("/wallet/register_account", json=REGISTRATION, headers=HEADERS).status_code == 500
+        assert webctrl_tusc_api.ip_rate_limiter.is_allowed("1.2.3.4")
+
+    def test_missing_fields_and_captcha(self, client, monkeypatch):
+        monkeypatch.setattr(gate_tusc_api, "register_account", registered)
+        response = client.post("/wallet/register_account", json={"account_name": "someaccountname"}, headers=HEADERS)
+        assert response.get_json() == webctrl_tusc_api.MissingFieldsResponse
+
+        # A request without a token fails verification
+        monkeypatch.setitem(webctrl_tusc_api.general_cfg, "disable_recaptcha", False)
+        monkeypatch.setattr(webctrl_tusc_api.captcha_verifier, "verify", lambda token, ip: token is not None)
+        response = client.post("/wallet/register_account", json=REGISTRATION, headers=HEADERS)
+        assert response.get_json() == webctrl_tusc_api.FailedCaptchaResponse
+        assert webctrl_tusc_api.ip_rate_limiter.is_allowed("1.2.3.4")
+
+    def test_queue_funds_check_releases_rate_limit(self, client, monkeypatch):
+        monkeypatch.setitem(webctrl_tusc_api.tusc_api_cfg, "registration_jobs_enabled", True)
+        monkeypatch.setattr(gate_tusc_api, "check_funds", unavailable)
+        response = client.post("/wallet/register_account", json=REGISTRATION, headers=HEADERS)
+        assert response.status_code == 503
+        assert webctrl_tusc_api.ip_rate_limiter.is_allowed("1.2.3.4")
+
+    def test_failed_job_releases_its_reservations(self, client, monkeypatch):
+        queued = []
+        monkeypatch.setitem(webctrl_tusc_api.tusc_api_cfg, "registration_jobs_enabled", True)
+        monkeypatch.setattr(gate_tusc_api, "check_funds", lambda: None)
+        monkeypatch.setattr(webctrl_tusc_api.db, "enqueue_registration_job",
+                            lambda *args: queued.append(args) or True)
+        monkeypatch.setattr(webctrl_tusc_api.registration_job_runner, "start", lambda: None)
+        response = client.post("/wallet/register_account", json=REGISTRATION, headers=HEADERS)
+        assert response.get_json()["result"]["status"] == "queued"
+        assert not webctrl_tusc_api.ip_rate_limiter.is_allowed("1.2.3.4")
+
+        # Another request's reservation for the same network is left alone
+        network_key = rate_limiter.rate_limit_keys("1.2.3.4")[1][0]
+        assert webctrl_tusc_api.ip_rate_limiter.reserve(network_key, 100)
+        job_id, account_name, public_key, referrer, ip_address, reservations, max_queued = queued[0]
+        taken = gate_tusc_api._account_name_taken_response("someaccountname")
+        monkeypatch.setattr(gate_tusc_api, "register_account", lambda *args: taken)
+        assert webctrl_tusc_api._run_registration_job({"account_name": account_name, "public_key": public_key,
+                                                       "referrer": referrer, "ip_address": ip_address,
+                                                       "rate_limit_reservations": reservations}) == taken
+        assert webctrl_tusc_api.ip_rate_limiter.is_allowed("1.2.3.4")
+        assert not webctrl_tusc_api.ip_rate_limiter.is_allowed(network_key, 1)
+
+
+class TestIdempotencyKey:
+    @pytest.fixture(autouse=True)
+    def coalescer(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(gate_tusc_api, "request_coalescer", RequestCoalescer(str(tmp_path), 5, 60))
+
+    def post(self, client, content):
+        return client.post("/wallet/register_account", json=content, headers={**HEADERS, "Idempotency-Key": "k1"})
+
+    def test_failed_captcha_is_not_saved(self, client, monkeypatch):
+        monkeypatch.setitem(webctrl_tusc_api.general_cfg, "disable_recaptcha", False)
+        monkeypatch.setattr(webctrl_tusc_api, "handle_captcha", lambda token, ip: token == "fresh")
+        monkeypatch.setattr(gate_tusc_api, "register_account", registered)
+
+        response = self.post(client, {**REGISTRATION, "recaptcha_response": "expired"})
+        assert response.get_json() == {"error": "Failed reCAPTCHA validation"}
+        response = self.post(client, {**REGISTRATION, "recaptcha_response": "fresh"})
+        assert response.get_json() == {"result": {"account_name": "someaccountname"}}
+
+    def test_unavailable_is_not_saved(self, client, monkeypatch):
+        monkeypatch.setattr(gate_tusc_api, "register_account",
+                            lambda *args: {"error": gate_tusc_api.RegistrationsUnavailableMessage})
+        assert "error" in self.post(client, REGISTRATION).get_json()
+
+        monkeypatch.setattr(gate_tusc_api, "register_account", registered)
+        assert "result" in self.post(client, REGISTRATION).get_json()
+
+    def test_final_error_is_saved(self, client, monkeypatch):
+        taken = gate_tusc_api._account_name_taken_response("someaccountname")
+        monkeypatch.setattr(gate_tusc_api, "register_account", lambda *args: taken)
+        assert self.post(client, REGISTRATION).get_json() == taken
+
+        monkeypatch.setattr(gate_tusc_api, "register_account", registered)
+        assert self.post(client, REGISTRATION).get_json() == taken
+
+
+class TestMetrics:
+    def test_needs_token(self, client, monkeypatch, tmp_path):
+        monkeypatch.setitem(webctrl_tusc_api.general_cfg, "metrics_dir", str(tmp_path))
+        monkeypatch.setitem(webctrl_tusc_api.general_cfg, "metrics_api_tokens", [])
+        assert client.get("/metrics", headers={"Authorization": "Bearer "}).status_code == 401
+
+        monkeypatch.setitem(webctrl_tusc_api.general_cfg, "metrics_api_tokens", ["scrape-token"])
+        assert client.get("/metrics").status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer other-token"}).status_code == 401
+        response = client.get("/metrics", headers={"Authorization": "Bearer scrape-token"})
+        assert response.status_code == 200
+        assert "# TYPE tusc_wallet_unavailable_total counter" in response.get_data(as_text=True)
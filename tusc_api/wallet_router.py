@@ -0,0 +1,136 @@
+import time
+import random
+import logging
+import threading
+import contextlib
+import contextvars
+import typing
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+_current_instance = contextvars.ContextVar("wallet_instance", default=None)
+
+
+class WalletInstance:
+    """One cli_wallet process: its RPC client and the supervisor that starts, checks and unlocks it."""
+
+    def __init__(self, index: int, port: int, client, supervisor):
+        self.index = index
+        self.port = port
+        self.client = client
+        self.supervisor = supervisor
+        self.outstanding = 0
+        self.in_rotation = True
+
+
+class WalletRouter:
+    """
+    Spreads requests over several cli_wallet instances. route() picks the instance in rotation with the fewest
+    requests of this process in flight, and everything the request sends to the wallet inside it goes to that
+    instance, so a builder transaction never spans two wallets. The instance is kept in a context variable, which
+    follows the request into gate_tusc_api_async.run_in_thread.
+
+    eject() takes a failed instance out of rotation. A background thread calls recover(instance) for every ejected
+    instance every retry_seconds (the supervisor restarts and unlocks it) and puts it back once that succeeds. While
+    no instance is in rotation requests are spread over all of them, so they can still restart a wallet themselves.
+    """
+
+    def __init__(self,
+                 instances: typing.List[WalletInstance],
+                 recover: typing.Callable[[WalletInstance], bool],
+                 retry_seconds: float):
+        self._instances = instances
+        self._recover = recover
+        self._retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+        self._recovery_needed = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    @property
+    def instances(self) -> typing.List[WalletInstance]:
+        return self._instances
+
+    @staticmethod
+    def current() -> typing.Optional[WalletInstance]:
+        return _current_instance.get()
+
+    @contextlib.contextmanager
+    def route(self):
+        # Nested calls stay on the instance the request already uses
+        instance = _current_instance.get()
+        if instance is not None:
+            yield instance
+            return
+
+        instance = self._acquire()
+        token = _current_instance.set(instance)
+        try:
+            yield instance
+        finally:
+            _current_instance.reset(token)
+            with self._lock:
+                instance.outstanding -= 1
+
+    @contextlib.contextmanager
+    def pin(self, instance: WalletInstance):
+        """Sends everything inside to instance, whether it is in rotation or not."""
+        token = _current_instance.set(instance)
+        try:
+            yield instance
+        finally:
+            _current_instance.reset(token)
+
+    def eject(self, instance: WalletInstance):
+        with self._lock:
+            if not instance.in_rotation:
+                return
+            instance.in_rotation = False
+        logger.warning("Taking TUSC wallet on port %s out of rotation", instance.port)
+        self._start()
+        self._recovery_needed.set()
+
+    def in_rotation_count(self) -> int:
+        return sum(1 for instance in self._instances if instance.in_rotation)
+
+    def _acquire(self) -> WalletInstance:
+        with self._lock:
+            candidates = [instance for instance in self._instances if instance.in_rotation] or self._instances
+            fewest = min(instance.outstanding for instance in candidates)
+            instance = random.choice([instance for instance in candidates if instance.outstanding == fewest])
+            instance.outstanding += 1
+            return instance
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._recovery_needed.wait()
+            self._recovery_needed.clear()
+
+            for instance in [instance for instance in self._instances if not instance.in_rotation]:
+                try:
+                    with self.pin(instance):
+                        recovered = self._recover(instance)
+                except Exception as e:
+                    logger.error("Failed to recover TUSC wallet on port %s: %s", instance.port, e)
+                    recovered = False
+
+                if recovered:
+                    with self._lock:
+                        instance.in_rotation = True
+                    logger.info("TUSC wallet on port %s is back in rotation", instance.port)
+
+            if self.in_rotation_count() < len(self._instances):
+                time.sleep(self._retry_seconds)
+                self._recovery_needed.set()
+
+
+logger.debug('loaded')
@@ -0,0 +1,368 @@
+import json
+import logging
+import itertools
+import threading
+import typing
+import concurrent.futures
+import requests
+import requests.adapters
+from config import tusc_api_cfg
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+
+class WalletRpcError(Exception):
+    pass
+
+
+def build_request_dict(method_name: str, params: list, request_id: int) -> dict:
+    tusc_wallet_command_structure = {
+        "jsonrpc": tusc_api_cfg["tusc_wallet_rpc_version"],
+        "method": method_name,
+        "params": params,
+        "id": request_id
+    }
+    return tusc_wallet_command_structure
+
+
+def get_tusc_url(port: int) -> str:
+    return f'http://{tusc_api_cfg["tusc_wallet_ip"]}:{port}' \
+           f'{tusc_api_cfg["tusc_wallet_rpc_endpoint"]}'
+
+
+def get_tusc_ws_url(port: int) -> str:
+    return f'ws://{tusc_api_cfg["tusc_wallet_ip"]}:{port}' \
+           f'{tusc_api_cfg["tusc_wallet_ws_endpoint"]}'
+
+
+def create_wallet_rpc_client(port: int):
+    if tusc_api_cfg["tusc_wallet_transport"] == "ws":
+        return WalletWebSocketClient(get_tusc_ws_url(port))
+    return WalletRpcClient(get_tusc_url(port))
+
+
+class WalletRpcClient:
+    """
+    JSON-RPC client for the cli_wallet HTTP endpoint.
+
+    Keeps a pool of keep-alive connections to the wallet (tusc_api:tusc_wallet_pool_size) and bounds every call by
+    tusc_api:tusc_wallet_connect_timeout_seconds and tusc_api:tusc_wallet_read_timeout_seconds. Request ids increase
+    monotonically and every response is checked against the id it answers.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self._timeout = (tusc_api_cfg["tusc_wallet_connect_timeout_seconds"],
+                         tusc_api_cfg["tusc_wallet_read_timeout_seconds"])
+        self._session = requests.Session()
+        self._session.headers.update({"Content-Type": "application/json"})
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=tusc_api_cfg["tusc_wallet_pool_size"],
+                                                max_retries=0)
+        self._session.mount("http://", adapter)
+        self._ids = itertools.count(1)
+        self._id_lock = threading.Lock()
+        # None until the first batch request tells whether the wallet accepts them
+        self._batch_supported = None
+
+    def next_id(self) -> int:
+        with self._id_lock:
+            return next(self._ids)
+
+    def call(self, method_name: str, params: list, do_not_log_data=False) -> dict:
+        req = build_request_dict(method_name, params, self.next_id())
+        r = self._post(req, do_not_log_data)
+        try:
+            api_response_json = json.loads(r.text)
+        except json.JSONDecodeError as err:
+            logger.error("TUSC wallet answered HTTP %d with a body that is not JSON: %s", r.status_code, err)
+            raise err
+
+        if not isinstance(api_response_json, dict) or api_response_json.get("id") != req["id"]:
+            logger.error("TUSC wallet response id does not match request id %s", req['id'])
+            raise WalletRpcError(f"Response id mismatch for {method_name}")
+
+        return api_response_json
+
+    def batch(self, calls: typing.List[typing.Tuple[str, list]], do_not_log_data=False) -> typing.List[dict]:
+        """
+        Sends several calls in one round trip, the responses are returned in the same order as the calls. Falls back
+        to one call at a time if the wallet does not answer the batch with a list, e.g. cli_wallet answers an array
+        body with HTTP 500 and no body. A wallet that never accepted a batch is not sent another one.
+        """
+        if self._batch_supported is False:
+            return self._call_each(calls, do_not_log_data)
+
+        reqs = [build_request_dict(method_name, params, self.next_id()) for method_name, params in calls]
+        r = self._post(reqs, do_not_log_data)
+        api_response_json = _batch_response_json(r)
+
+        if api_response_json is None:
+            if self._batch_supported is None:
+                logger.warning("TUSC wallet did not accept a batch request (HTTP %d), sending calls one at a time "
+                               "from now on", r.status_code)
+                self._batch_supported = False
+            else:
+                logger.warning("TUSC wallet did not accept a batch request (HTTP %d), sending these calls one at a "
+                               "time", r.status_code)
+            return self._call_each(calls, do_not_log_data)
+
+        self._batch_supported = True
+
+        responses_by_id = {}
+        for response in api_response_json:
+            if isinstance(response, dict) and "id" in response:
+                responses_by_id[response["id"]] = response
+
+        missing_ids = [req["id"] for req in reqs if req["id"] not in responses_by_id]
+        if len(missing_ids) > 0:
+            logger.error("TUSC wallet batch response is missing ids %s", missing_ids)
+            raise WalletRpcError("Batch response id mismatch")
+
+        return [responses_by_id[req["id"]] for req in reqs]
+
+    def _call_each(self, calls: typing.List[typing.Tuple[str, list]], do_not_log_data: bool) -> typing.List[dict]:
+        return [self.call(method_name, params, do_not_log_data) for method_name, params in calls]
+
+    def _post(self, req: typing.Union[dict, list], do_not_log_data: bool) -> requests.Response:
+        # POST with JSON
+        command_json = json.dumps(req)
+        logger.debug("Sending command to TUSC wallet")
+
+        if do_not_log_data is False:
+            logger.debug("Command payload: %s", command_json)
+
+        logger.debug("posting to: %s", self.url)
+
+        try:
+            r = self._session.post(self.url, data=command_json, timeout=self._timeout)
+        except requests.RequestException as err:
+            logger.error(err)
+            raise err
+
+        return r
+
+
+# The responses of a batch request, None if the wallet did not answer it with a JSON list
+def _batch_response_json(r: requests.Response) -> typing.Optional[list]:
+    if not 200 <= r.status_code < 300:
+        return None
+
+    try:
+        api_response_json = json.loads(r.text)
+    except json.JSONDecodeError:
+        return None
+
+    return api_response_json if isinstance(api_response_json, list) else None
+
+
+class AsyncWalletRpcClient:
+    """
+    asyncio version of WalletRpcClient for the ASGI app, over aiohttp with the same pool size, timeouts and id checks.
+    The session is created on first use so it belongs to the running event loop.
+    """
+
+    def __init__(self, url: str):
+        if aiohttp is None:
+            raise ImportError("The ASGI app needs the aiohttp package")
+        self.url = url
+        self._ids = itertools.count(1)
+        self._session = None
+
+    async def call(self, method_name: str, params: list, do_not_log_data=False) -> dict:
+        req = build_request_dict(method_name, params, next(self._ids))
+        command_json = json.dumps(req)
+        logger.debug("Sending command to TUSC wallet")
+
+        if do_not_log_data is False:
+            logger.debug("Command payload: %s", command_json)
+
+        try:
+            async with self._get_session().post(self.url, data=command_json) as r:
+                text = await r.text()
+        except aiohttp.ClientError as err:
+            logger.error(err)
+            raise err
+
+        try:
+            api_response_json = json.loads(text)
+        except json.JSONDecodeError as err:
+            logger.error(err)
+            raise err
+
+        if not isinstance(api_response_json, dict) or api_response_json.get("id") != req["id"]:
+            logger.error("TUSC wallet response id does not match request id %s", req['id'])
+            raise WalletRpcError(f"Response id mismatch for {method_name}")
+
+        return api_response_json
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                headers={"Content-Type": "application/json"},
+                connector=aiohttp.TCPConnector(limit=tusc_api_cfg["tusc_wallet_pool_size"]),
+                timeout=aiohttp.ClientTimeout(sock_connect=tusc_api_cfg["tusc_wallet_connect_timeout_seconds"],
+                                              sock_read=tusc_api_cfg["tusc_wallet_read_timeout_seconds"]))
+        return self._session
+
+
+class WalletWebSocketClient:
+    """
+    JSON-RPC client for the cli_wallet WebSocket endpoint (the same -H endpoint that serves HTTP).
+
+    Keeps one persistent connection per worker and lets any number of calls be in flight on it at once. A reader
+    thread matches responses back to their callers by id. When the connection drops (e.g. the wallet is restarted)
+    calls that were in flight fail, and the next call reconnects. A call whose request could not be written to the
+    old connection is retried once on the new one, since the wallet never saw it.
+    """
+
+    def __init__(self, url: str):
+        if websocket is None:
+            raise WalletRpcError("tusc_api:tusc_wallet_transport 'ws' requires the websocket-client package")
+
+        self.url = url
+        self._connect_timeout = tusc_api_cfg["tusc_wallet_connect_timeout_seconds"]
+        self._read_timeout = tusc_api_cfg["tusc_wallet_read_timeout_seconds"]
+        self._ws = None
+        self._connect_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._id_lock = threading.Lock()
+
+    def next_id(self) -> int:
+        with self._id_lock:
+            return next(self._ids)
+
+    def call(self, method_name: str, params: list, do_not_log_data=False) -> dict:
+        return self.batch([(method_name, params)], do_not_log_data)[0]
+
+    def batch(self, calls: typing.List[typing.Tuple[str, list]], do_not_log_data=False) -> typing.List[dict]:
+        """
+        Pipelines the calls on the connection and waits for all of them, the responses are returned in the same
+        order as the calls.
+        """
+        reqs = [build_request_dict(method_name, params, self.next_id()) for method_name, params in calls]
+
+        responses = []
+        try:
+            futures = [self._send(req, do_not_log_data) for req in reqs]
+            for req, future in zip(reqs, futures):
+                try:
+                    responses.append(future.result(timeout=self._read_timeout))
+                except concurrent.futures.TimeoutError:
+                    logger.error("Timed out waiting for TUSC wallet response to %s", req['method'])
+                    raise TimeoutError(f"Timed out waiting for TUSC wallet response to {req['method']}")
+        finally:
+            with self._pending_lock:
+                for req in reqs:
+                    self._pending.pop(req["id"], None)
+
+        return responses
+
+    def _send(self, req: dict, do_not_log_data: bool) -> concurrent.futures.Future:
+        command_json = json.dumps(req)
+        logger.debug("Sending command to TUSC wallet")
+
+        if do_not_log_data is False:
+            logger.debug("Command payload: %s", command_json)
+
+        for attempt in range(2):
+            ws = self._connection()
+            future = concurrent.futures.Future()
+            # Registered before sending, the answer can arrive before send() returns
+            with self._pending_lock:
+                self._pending[req["id"]] = (ws, future)
+            try:
+                with self._send_lock:
+                    ws.send(command_json)
+                return future
+            except (websocket.WebSocketException, OSError) as err:
+                logger.warning("TUSC wallet WebSocket send failed: %s", err)
+                self._drop_connection(ws)
+                if attempt == 1:
+                    with self._pending_lock:
+                        self._pending.pop(req["id"], None)
+                    raise err
+
+    def _connection(self):
+        with self._connect_lock:
+            if self._ws is None:
+                logger.debug("connecting to: %s", self.url)
+                try:
+                    ws = websocket.create_connection(self.url, timeout=self._connect_timeout)
+                except (websocket.WebSocketException, OSError) as err:
+                    logger.error(err)
+                    raise err
+
+                # Reads block in the reader thread, call timeouts are enforced on the futures instead
+                ws.settimeout(None)
+                self._ws = ws
+                threading.Thread(target=self._read_responses, args=(ws,), daemon=True).start()
+            return self._ws
+
+    def _drop_connection(self, ws):
+        with self._connect_lock:
+            if self._ws is ws:
+                self._ws = None
+        try:
+            ws.close()
+        except Exception:
+            pass
+
+    def _read_responses(self, ws):
+        try:
+            while True:
+                message = ws.recv()
+                try:
+                    api_response_json = json.loads(message)
+                except json.JSONDecodeError as err:
+                    logger.error(err)
+                    continue
+
+                if not isinstance(api_response_json, list):
+                    api_response_json = [api_response_json]
+
+                for response in api_response_json:
+                    with self._pending_lock:
+                        pending = self._pending.pop(response.get("id"), None) if isinstance(response, dict) else None
+                    if pending is None:
+                        logger.warning("TUSC wallet sent a response with an unknown id")
+                        continue
+                    pending[1].set_result(response)
+        except Exception as err:
+            logger.warning("TUSC wallet WebSocket connection closed: %s", err)
+        finally:
+            self._drop_connection(ws)
+            self._fail_pending(ws)
+
+    def _fail_pending(self, ws):
+        # Every call still waiting on this connection was written to it, none of them will get an answer now
+        with self._pending_lock:
+            failed = [(request_id, pending[1]) for request_id, pending in self._pending.items() if pending[0] is ws]
+            for request_id, future in failed:
+                del self._pending[request_id]
+
+        for request_id, future in failed:
+            if not future.done():
+                future.set_exception(ConnectionError(f"TUSC wallet connection closed before answering {request_id}"))
+
+
+logger.debug('loaded')
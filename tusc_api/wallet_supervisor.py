@@ -0,0 +1,216 @@
+import os
+import time
+import fcntl
+import signal
+import logging
+import threading
+import contextlib
+import subprocess
+import typing
+from config import wallet_cfg
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+WALLET_HEALTHY = "healthy"
+WALLET_LOCKED = "locked"
+WALLET_DOWN = "down"
+WALLET_INVALID = "invalid"
+
+WalletReadyResponse = {'result': None}
+
+
+class WalletStartError(Exception):
+    pass
+
+
+class WalletSupervisor:
+    """
+    Keeps one cli_wallet running and unlocked for the whole host.
+
+    Every gunicorn worker owns a supervisor per wallet instance, but starting and stopping the wallet is serialized
+    through lock_file so only one of them spawns the process. The others find it through the health check (or
+    pid_file when it needs to be restarted). The request path calls ensure_ready(), which only costs an RPC when the
+    last health check is older than wallet:health_check_interval_seconds or a request reported the wallet as broken.
+    """
+
+    def __init__(self,
+                 start_func: typing.Callable[[], subprocess.Popen],
+                 send_request: typing.Callable[[str, list], dict],
+                 unlock_func: typing.Callable[[], dict],
+                 pid_file: str,
+                 lock_file: str):
+        self._start_func = start_func
+        self._send_request = send_request
+        self._unlock_func = unlock_func
+        self._pid_file = os.path.expanduser(pid_file)
+        self._lock_file = os.path.expanduser(lock_file)
+        self._lock = threading.Lock()
+        self._wallet_proc = None
+        self._needs_check = True
+        self._next_health_check = 0.0
+
+    def check_health(self) -> str:
+        try:
+            api_response_json = self._send_request("is_locked", [])
+        except Exception as e:
+            logger.warning("TUSC Wallet health check failed: %s", e)
+            return WALLET_DOWN
+
+        if "result" in api_response_json:
+            return WALLET_LOCKED if api_response_json["result"] else WALLET_HEALTHY
+
+        # Any error on a call as cheap as is_locked means the wallet cannot be trusted anymore, most commonly this is
+        # the "invalid state" it gets into after losing its node connection.
+        logger.error("TUSC Wallet health check returned an error: %s", api_response_json)
+        return WALLET_INVALID
+
+    def ensure_ready(self) -> dict:
+        with self._lock:
+            self._reap()
+            if not self._needs_check and time.monotonic() < self._next_health_check:
+                return WalletReadyResponse
+
+            response = self._make_ready()
+            if response == WalletReadyResponse:
+                self._needs_check = False
+                self._next_health_check = time.monotonic() + wallet_cfg["health_check_interval_seconds"]
+            return response
+
+    def mark_unhealthy(self):
+        self._needs_check = True
+
+    def needs_check(self) -> bool:
+        return self._needs_check
+
+    def is_wallet_running(self) -> bool:
+        """Whether a cli_wallet process is running on this host, whichever worker started it."""
+        wallet_proc = self._wallet_proc
+        if wallet_proc is not None and wallet_proc.poll() is None:
+            return True
+        pid = _read_pid_file(self._pid_file)
+        return pid is not None and _is_wallet_pid(pid)
+
+    def restart(self) -> dict:
+        with self._lock:
+            self._needs_check = True
+            with self._host_lock():
+                self._stop_wallet()
+                self._spawn_wallet()
+
+            response = self._unlock_func()
+            if response == WalletReadyResponse:
+                self._needs_check = False
+                self._next_health_check = time.monotonic() + wallet_cfg["health_check_interval_seconds"]
+            return response
+
+    def _make_ready(self) -> dict:
+        state = self.check_health()
+
+        if state in (WALLET_DOWN, WALLET_INVALID):
+            with self._host_lock():
+                # Another worker may have (re)started the wallet while we were waiting on the lock
+                state = self.check_health()
+                if state in (WALLET_DOWN, WALLET_INVALID):
+                    self._stop_wallet()
+                    self._spawn_wallet()
+                    state = WALLET_LOCKED
+
+        if state == WALLET_LOCKED:
+            logger.info("Unlocking TUSC Wallet")
+            return self._unlock_func()
+
+        return WalletReadyResponse
+
+    def _spawn_wallet(self):
+        try:
+            self._wallet_proc = self._start_func()
+        except Exception as e:
+            raise WalletStartError(str(e)) from e
+
+        # cli_wallet keeps logging to stderr, if nobody reads the pipes it eventually blocks on a full pipe buffer
+        for stream in (self._wallet_proc.stdout, self._wallet_proc.stderr):
+            threading.Thread(target=_drain_output, args=(stream,), daemon=True).start()
+
+        with open(self._pid_file, 'w') as pid_file:
+            pid_file.write(str(self._wallet_proc.pid))
+
+    def _stop_wallet(self):
+        if self._wallet_proc is not None:
+            logger.info("Stopping TUSC Wallet, pid %s", self._wallet_proc.pid)
+            self._wallet_proc.terminate()
+            try:
+                self._wallet_proc.wait(timeout=wallet_cfg["stop_timeout_seconds"])
+            except subprocess.TimeoutExpired:
+                self._wallet_proc.kill()
+                self._wallet_proc.wait()
+            self._wallet_proc = None
+            return
+
+        # The wallet was started by another worker (or a previous run), all we have is its pid
+        pid = _read_pid_file(self._pid_file)
+        if pid is None or not _is_wallet_pid(pid):
+            return
+
+        logger.info("Stopping TUSC Wallet started by another process, pid %s", pid)
+        if not _signal_pid(pid, signal.SIGTERM):
+            return
+
+        deadline = time.monotonic() + wallet_cfg["stop_timeout_seconds"]
+        while time.monotonic() < deadline:
+            if not _signal_pid(pid, 0):
+                return
+            time.sleep(0.1)
+        _signal_pid(pid, signal.SIGKILL)
+
+    def _reap(self):
+        if self._wallet_proc is not None and self._wallet_proc.poll() is not None:
+            logger.error("TUSC Wallet exited with code %s", self._wallet_proc.returncode)
+            self._wallet_proc = None
+            self._needs_check = True
+
+    @contextlib.contextmanager
+    def _host_lock(self):
+        with open(self._lock_file, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _drain_output(stream):
+    for line in iter(stream.readline, b''):
+        # The output is still read to keep the pipe from filling up, decoding it is only worth it for debug logs
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("TUSC Wallet output: %s", line.decode('ascii', 'replace').rstrip())
+
+
+def _read_pid_file(path: str) -> typing.Optional[int]:
+    try:
+        with open(path, 'r') as pid_file:
+            return int(pid_file.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _is_wallet_pid(pid: int) -> bool:
+    # Guards against the pid having been reused by an unrelated process since the pid file was written
+    if not os.path.isdir("/proc"):
+        return True
+    try:
+        with open(f"/proc/{pid}/cmdline", 'rb') as cmdline:
+            return os.path.basename(wallet_cfg["path"]).encode() in cmdline.read()
+    except OSError:
+        return False
+
+
+def _signal_pid(pid: int, sig: int) -> bool:
+    try:
+        os.kill(pid, sig)
+        return True
+    except ProcessLookupError:
+        return False
+
+
+logger.debug('loaded')
@@ -1,20 +1,49 @@
-from flask import Blueprint, request
+from flask import Blueprint, Response, request, stream_with_context
 
-import requests
 from tusc_api import gate_tusc_api
+from tusc_api.cache import TTLCache
+from tusc_api import rate_limiter
+from tusc_api import captcha
+from tusc_api import registration_jobs
+from tusc_api import registration_export
+from tusc_api.request_coalescer import IdempotencyKeyReusedError
+from tusc_api.admission import WalletUnavailableError
+import json
 import logging
+import typing
 import db_access.db as db
-import json
+import metrics
 from config import cfg
-from datetime import datetime, timedelta
 
 logger = logging.getLogger('root')
 logger.debug('loading')
 
 tusc_api = Blueprint('tusc_api', 'tusc_api', url_prefix='')
 general_cfg = cfg["general"]
+tusc_api_cfg = cfg["tusc_api"]
+
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+IdempotencyKeyReusedResponse = {"error": "This Idempotency-Key was already used for a different request"}
+FailedCaptchaResponse = {"error": "Failed reCAPTCHA validation"}
+MissingFieldsResponse = {"error": "Expected account_name and public_key in json string"}
+
+ip_rate_limiter = rate_limiter.create_rate_limiter()
+stats_cache = TTLCache(general_cfg["stats_cache_seconds"])
+captcha_verifier = captcha.create_captcha_verifier()
+
+
+# Overload and an open circuit breaker get a fast 503, with the usual error body
+@tusc_api.errorhandler(WalletUnavailableError)
+def wallet_unavailable(error: WalletUnavailableError):
+    return _wallet_unavailable_response(error, get_real_ip())
 
-ip_addresses = {}
+
+# The functions below that take what they need from the request as arguments are shared with
+# webctrl_tusc_api_async, which only adds the awaits
+def _wallet_unavailable_response(error: WalletUnavailableError, ip_address: str) -> tuple:
+    logger.warning('Wallet unavailable, request from %s: %s', ip_address, error)
+    metrics.wallet_unavailable.inc()
+    return {"error": str(error)}, 503, {"Retry-After": str(error.retry_after)}
 
 
 def get_real_ip():
@@ -33,95 +62,393 @@ def get_real_ip():
 # ```
 @tusc_api.route('/wallet/suggest_brain_key', methods=["GET"])
 def suggest_brain_key():
-    logger.debug('suggest_brain_key, request from ' + get_real_ip())
+    logger.debug('suggest_brain_key, request from %s', get_real_ip())
     return gate_tusc_api.suggest_brain_key()
 
+# example response
+# ```
+# {
+#     "result": {
+#         "account_name": "someaccountname",
+#         "available": true
+#     }
+# }
+# ```
+@tusc_api.route('/wallet/account_available/<account_name>', methods=["GET"])
+def account_available(account_name):
+    logger.debug('account_available, request from %s', get_real_ip())
+    return gate_tusc_api.account_available(account_name)
+
 # Accepted fields: account_name (str), public_key (str)
 @tusc_api.route('/wallet/register_account', methods=["POST"])
 def register_account():
-    global ip_addresses
-    logger.debug('register_account, request from ' + get_real_ip())
+    logger.debug('register_account, request from %s', get_real_ip())
 
     content = request.json
-    ip_address = request.headers.get('X-Real-IP')
+    ip_address = get_real_ip()
+
+    # Optional, a retry with the same Idempotency-Key gets the first request's response back instead of registering
+    # again
+    idempotency_key = request.headers.get('Idempotency-Key', "")
+    if idempotency_key == "":
+        return _handle_register_account(content, ip_address)
+
+    idempotency_key_error = _check_idempotency_key(idempotency_key)
+    if idempotency_key_error is not None:
+        return idempotency_key_error
+
+    fingerprint = _request_fingerprint(content)
+    try:
+        return gate_tusc_api.request_coalescer.idempotent(idempotency_key,
+                                                          fingerprint,
+                                                          lambda: _handle_register_account(content, ip_address),
+                                                          _is_cacheable_response)
+    except IdempotencyKeyReusedError:
+        return IdempotencyKeyReusedResponse
+
+
+def _check_idempotency_key(idempotency_key: str) -> typing.Optional[dict]:
+    if len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        return {"error": "Idempotency-Key must not be longer than " + str(MAX_IDEMPOTENCY_KEY_LENGTH) + " characters"}
+    return None
+
+
+# A retry may come with a new reCAPTCHA token, it is still the same request
+def _request_fingerprint(content: dict) -> str:
+    return json.dumps({key: value for key, value in content.items() if key != 'recaptcha_response'}, sort_keys=True)
+
 
-    if not general_cfg['disable_ip_blocking'] and not is_ip_allowed(ip_address):
+# Only successes and final errors are saved, a retry after any other error (e.g. with a fresh reCAPTCHA token) runs
+# again
+def _is_cacheable_response(response: dict) -> bool:
+    return 'error' not in response or gate_tusc_api.is_final_registration_error(response)
+
+
+def _handle_register_account(content: dict, ip_address: str) -> dict:
+    rate_limit_error, reservations = _reserve_rate_limit(ip_address)
+    if rate_limit_error is not None:
+        return rate_limit_error
+
+    try:
+        res = _register_account(content, ip_address, reservations)
+    except:
+        # WalletUnavailableError from admission control, the circuit breaker or the funds check, or anything
+        # unexpected, the registration did not happen either way
+        _release_rate_limit(reservations)
+        raise
+
+    if 'error' in res:
+        _release_rate_limit(reservations)
+
+    return res
+
+
+# Reserving up front closes the gap between checking the ip and recording it once the registration succeeded, the
+# reservations are released again if the registration fails. Returns the error response if the ip is not allowed,
+# otherwise the reservations to release.
+def _reserve_rate_limit(ip_address: str) -> typing.Tuple[typing.Optional[dict], typing.List[rate_limiter.Reservation]]:
+    if general_cfg['disable_ip_blocking']:
+        return None, []
+
+    blocked_key, reservations = ip_rate_limiter.reserve_many(rate_limiter.rate_limit_keys(ip_address))
+    if blocked_key == ip_address:
+        logger.debug('register_account: ip "%s" is not allowed', ip_address)
+        metrics.rate_limit_rejections.inc("ip")
         return {"error": "For security purposes, you are only allowed to register an account every " +
-                         str(general_cfg['ip_request_blocking_hours']) + " hours."}
+                         str(general_cfg['ip_request_blocking_hours']) + " hours."}, []
+    if blocked_key is not None:
+        logger.debug('register_account: network of ip "%s" is not allowed', ip_address)
+        metrics.rate_limit_rejections.inc("network")
+        return {"error": "Too many accounts have been registered from your network recently. "
+                         "Please try again later."}, []
+    return None, reservations
+
+
+def _release_rate_limit(reservations: typing.List[rate_limiter.Reservation]):
+    if len(reservations) > 0:
+        ip_rate_limiter.release_many(reservations)
 
-    did_recaptcha_succeed = False
 
-    if general_cfg['disable_recaptcha']:
-        did_recaptcha_succeed = True
+def _register_account(content: dict, ip_address: str, reservations: typing.List[rate_limiter.Reservation]) -> dict:
+    # A missing token fails verification without a call to Google
+    if not general_cfg['disable_recaptcha'] and not handle_captcha(content.get('recaptcha_response'), ip_address):
+        return FailedCaptchaResponse
 
-    if 'recaptcha_response' in content and did_recaptcha_succeed is not True:
-        did_recaptcha_succeed = handle_captcha(content['recaptcha_response'], ip_address)
+    registration = _registration_fields(content)
+    if registration is None:
+        return MissingFieldsResponse
 
-    if not did_recaptcha_succeed:
-        return {"error": "Failed reCAPTCHA validation"}
+    account_name, public_key, referrer = registration
+    if tusc_api_cfg['registration_jobs_enabled']:
+        return _queue_registration(account_name, public_key, referrer, ip_address, reservations)
+    return gate_tusc_api.register_account(account_name, public_key, referrer)
 
-    referrer = ""
 
-    if 'referrer' in content:
-        referrer = content['referrer']
+# The account_name, public_key and referrer of a registration request, None if it lacks one of the required fields
+def _registration_fields(content: dict) -> typing.Optional[typing.Tuple[str, str, str]]:
+    if 'account_name' not in content or 'public_key' not in content:
+        return None
+    return content['account_name'], content['public_key'], content.get('referrer', "")
 
-    if 'account_name' in content and 'public_key' in content:
-        res = gate_tusc_api.register_account(content['account_name'], content['public_key'], referrer)
 
-        if 'error' not in res:
-            now = datetime.now()
-            ip_addresses[ip_address] = now
+# example response, poll /wallet/register_account/<job_id> for the outcome
+# {
+#     "result": {
+#         "job_id": "0f8e7c3b9a2d4e5f8a1b2c3d4e5f6a7b",
+#         "status": "queued"
+#     }
+# }
+def _queue_registration(account_name: str,
+                        public_key: str,
+                        referrer: str,
+                        ip_address: str,
+                        reservations: typing.List[rate_limiter.Reservation]) -> dict:
+    # Otherwise the job would only fail once it runs
+    validation_error = gate_tusc_api.check_registration_request(account_name, public_key)
+    if validation_error is not None:
+        return validation_error
 
-        return res
-    else:
-        return {"error": "Expected account_name and public_key in json string"}
+    job_id = registration_jobs.new_job_id()
+    try:
+        queued = db.enqueue_registration_job(job_id, account_name, public_key, referrer, ip_address, reservations,
+                                             tusc_api_cfg['registration_jobs_max_queued'])
+    except:
+        logger.exception('Failed to queue registration job')
+        return gate_tusc_api.DefaultErrorResponse
 
+    return _queued_registration_response(job_id, queued)
 
-def is_ip_allowed(ip_address) -> bool:
-    global ip_addresses
-    logger.debug('is_ip_allowed: checking ip "' + ip_address + '"')
 
-    now = datetime.now()
-    if ip_address in ip_addresses:
-        if ip_addresses[ip_address] > now - timedelta(hours=general_cfg['ip_request_blocking_hours']):
-            logger.debug('is_ip_allowed: ip "' + ip_address + '" is not allowed')
-            return False
-        else:
-            logger.debug('is_ip_allowed: ip "' + ip_address + '" is allowed')
-            return True
+def _queued_registration_response(job_id: str, queued: bool) -> dict:
+    if not queued:
+        return {"error": "Too many registrations are waiting to be processed. Please try again later."}
 
-    return True
+    registration_job_runner.start()
+    registration_job_runner.wake()
+    return {"result": {"job_id": job_id, "status": "queued"}}
 
 
-def handle_captcha(captcha_response, ip) -> bool:
+def _run_registration_job(job: dict) -> dict:
     try:
-        content = requests.post(
-            'https://www.google.com/recaptcha/api/siteverify',
-            data={
-                'secret': general_cfg['captcha_secret'],
-                'response': captcha_response,
-                'remoteip': ip,
-            }
-        ).content
-    except ConnectionError:
-        return False
-
-    content = json.loads(content)
-
-    if not 'success' in content or not content['success']:
-        return False
-    else:
-        return True
+        response = gate_tusc_api.register_account(job['account_name'], job['public_key'], job['referrer'])
+    except WalletUnavailableError as e:
+        response = {"error": str(e)}
+    except:
+        _release_rate_limit(job['rate_limit_reservations'])
+        raise
+
+    if 'error' in response:
+        _release_rate_limit(job['rate_limit_reservations'])
+    return response
+
+
+# example response, status is one of queued, running, succeeded or failed. response is what
+# /wallet/register_account would have returned, it is only there once the job finished.
+# {
+#     "result": {
+#         "job_id": "0f8e7c3b9a2d4e5f8a1b2c3d4e5f6a7b",
+#         "status": "failed",
+#         "response": {
+#             "error": "Account name 'someaccountname' already in use. Please use a different account name."
+#         }
+#     }
+# }
+@tusc_api.route('/wallet/register_account/<job_id>', methods=["GET"])
+def register_account_job(job_id):
+    try:
+        job = db.get_registration_job(job_id)
+    except:
+        logger.exception('Failed to get registration job')
+        return gate_tusc_api.DefaultErrorResponse
+
+    return _registration_job_response(job)
 
+
+def _registration_job_response(job: typing.Optional[dict]) -> dict:
+    if job is None:
+        return {"error": "Unknown registration job"}
+
+    result = {"job_id": job['id'], "status": job['status']}
+    if job['response'] is not None:
+        result['response'] = job['response']
+    return {"result": result}
+
+
+def handle_captcha(captcha_response, ip) -> bool:
+    return captcha_verifier.verify(captcha_response, ip)
+
+
+# example response
+# {
+#     "number_of_registrations": "1534",
+#     "registrations_per_day": {
+#         "2019-09-29": "48",
+#         "2019-09-30": "61"
+#     },
+#     "registrations_per_referrer": {
+#         "registration-faucet": "1497",
+#         "some-partner": "37"
+#     }
+# }
+# registrations_per_day covers the last general:stats_days days. Results are cached for general:stats_cache_seconds
+# so polling this never reaches the database more than once per cache period.
+@tusc_api.route('/stats', methods=["GET"])
+def stats():
+    res = stats_cache.get_or_load("stats", lambda: db.get_stats() or None)
+    if res is None:
+        return gate_tusc_api.DefaultErrorResponse
+    return res
+
+
+# Prometheus text format, every gunicorn worker on this host added up. Needs "Authorization: Bearer <token>" with one
+# of general:metrics_api_tokens, it is disabled while that list is empty.
+@tusc_api.route('/metrics', methods=["GET"])
+def metrics_endpoint():
+    unauthorized = _check_token(general_cfg['metrics_api_tokens'], 'metrics')
+    if unauthorized is not None:
+        return unauthorized
+    return metrics.render_metrics(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+
+# example response, registrations_available is false while the wallet circuit breaker is open or the registrar
+# account cannot pay for a registration. funds is null when tusc_api:funds_check_enabled is off, its fields are null
+# until the registrar account has been polled.
+# {
+#     "result": {
+#         "registrations_available": true,
+#         "funds": {
+#             "registrations_available": true,
+#             "balance": 1234500000,
+#             "account_creation_fee": 50000,
+#             "seconds_since_poll": 12.3
+#         },
+#         "wallet": {
+#             "instances": 2,
+#             "instances_in_rotation": 2,
+#             "circuit_breaker_open": false
+#         }
+#     }
+# }
+# Only reads what this worker already knows, so it is cheap enough for frequent polling.
+@tusc_api.route('/health', methods=["GET"])
+def health():
+    return gate_tusc_api.health()
+
+
+# The registration listing and export need "Authorization: Bearer <token>" with one of
+# tusc_api:registrations_api_tokens, they are disabled while that list is empty. Returns the response for a request
+# without one of tokens.
+def _check_token(tokens: typing.List[str], endpoint: str) -> typing.Optional[tuple]:
+    return _unauthorized_response(request.headers.get('Authorization'), tokens, endpoint, get_real_ip())
+
+
+def _unauthorized_response(authorization: typing.Optional[str],
+                           tokens: typing.List[str],
+                           endpoint: str,
+                           ip_address: str) -> typing.Optional[tuple]:
+    if not registration_export.is_authorized(authorization, tokens):
+        logger.warning('Unauthorized %s request from %s', endpoint, ip_address)
+        return {"error": "Unauthorized"}, 401, {"WWW-Authenticate": "Bearer"}
+    return None
+
+
+# GET /registrations?from=2019-09-01&to=2019-10-01&limit=100&after=<next of the previous page>
+# from (inclusive) and to (exclusive) are ISO 8601 UTC timestamps, all parameters are optional.
 # example response
 # {
-#     "end_of_swap_date": "2019-10-01 00:00:00",
-#     "occ_left_to_swap": "100000000000000000000000000000",
-#     "occ_swapped": "0",
-#     "tusc_swapped": "0"
+#     "result": {
+#         "registrations": [
+#             {
+#                 "id": 1534,
+#                 "tusc_account_name": "someaccountname",
+#                 "tusc_public_key": "TUSC6YZ8dWrEzGDnZPaRCxgXQ8yXeYMV9dvuUsrRskXW6FqTwPWyLT",
+#                 "referrer": "registration-faucet",
+#                 "created_at": "2019-09-30T12:01:02.345678"
+#             }
+#         ],
+#         "next": "WyIyMDE5LTA5LTMwVDEyOjAxOjAyLjM0NTY3OCIsIDE1MzRd"
+#     }
 # }
-# Note that OCC uses 18 decimal places of precision and TUSC uses 5. So the above values are really:
-# OCC: 102348857281.025782841613573730
-# TUSC: 51174428640.51290
+# next is null on the last page.
+@tusc_api.route('/registrations', methods=["GET"])
+def registrations():
+    unauthorized = _check_token(tusc_api_cfg['registrations_api_tokens'], 'registrations')
+    if unauthorized is not None:
+        return unauthorized
+
+    try:
+        created_from, created_to, after, limit = _registrations_page_args(request.args)
+    except registration_export.InvalidExportRequestError as e:
+        return {"error": str(e)}, 400
+
+    try:
+        rows = db.get_registrations_page(created_from, created_to, after, limit)
+    except:
+        logger.exception('Failed to get registrations page')
+        return gate_tusc_api.DefaultErrorResponse
+
+    return {"result": registration_export.page_result(rows, limit)}
+
+
+# created_from, created_to, after and limit of a /registrations request, raises InvalidExportRequestError
+def _registrations_page_args(args: typing.Mapping[str, str]) -> tuple:
+    created_from, created_to = registration_export.parse_created_range(args)
+    after = registration_export.decode_cursor(args.get('after'))
+    limit = registration_export.parse_limit(args.get('limit'),
+                                            tusc_api_cfg['registrations_page_default_limit'],
+                                            tusc_api_cfg['registrations_page_max_limit'])
+    return created_from, created_to, after, limit
+
+
+# GET /registrations/export?format=ndjson|csv&from=...&to=... streams every registration in the range, ordered by
+# created_at. The rows are read tusc_api:registrations_export_batch_size at a time, so memory use does not grow with
+# the table and no transaction stays open for the duration of the download.
+@tusc_api.route('/registrations/export', methods=["GET"])
+def export_registrations():
+    unauthorized = _check_token(tusc_api_cfg['registrations_api_tokens'], 'registrations')
+    if unauthorized is not None:
+        return unauthorized
+
+    try:
+        created_from, created_to, export_format = _export_args(request.args)
+    except registration_export.InvalidExportRequestError as e:
+        return {"error": str(e)}, 400
+
+    logger.info('Exporting registrations as %s for %s', export_format, get_real_ip())
+    pages = db.iter_registration_pages(created_from, created_to, tusc_api_cfg['registrations_export_batch_size'])
+    return Response(stream_with_context(_export_chunks(export_format, pages)),
+                    mimetype=registration_export.CONTENT_TYPES[export_format],
+                    headers=_export_headers(export_format))
+
+
+# created_from, created_to and format of a /registrations/export request, raises InvalidExportRequestError
+def _export_args(args: typing.Mapping[str, str]) -> tuple:
+    created_from, created_to = registration_export.parse_created_range(args)
+    return created_from, created_to, registration_export.parse_format(args.get('format'))
+
+
+def _export_headers(export_format: str) -> dict:
+    return {"Content-Disposition": f'attachment; filename="registrations.{export_format}"'}
+
+
+def _export_chunks(export_format: str, pages: typing.Iterator[list]) -> typing.Iterator[str]:
+    yield registration_export.format_header(export_format)
+    try:
+        for rows in pages:
+            yield registration_export.format_rows(export_format, rows)
+    except:
+        # The status line is long gone, all that is left is to cut the download short
+        logger.exception('Registrations export failed part way')
+
+
+registration_job_runner = registration_jobs.RegistrationJobRunner(
+    _run_registration_job,
+    lambda job: _release_rate_limit(job['rate_limit_reservations']),
+    gate_tusc_api.DefaultErrorResponse,
+    tusc_api_cfg['registration_jobs_workers'],
+    tusc_api_cfg['registration_jobs_poll_interval_seconds'],
+    tusc_api_cfg['registration_jobs_stale_seconds'],
+    tusc_api_cfg['registration_jobs_retention_hours'])
+
 
 logger.debug('loaded')
@@ -0,0 +1,240 @@
+from quart import Blueprint, Response, request
+
+from tusc_api import gate_tusc_api
+from tusc_api import gate_tusc_api_async
+from tusc_api.gate_tusc_api_async import run_in_thread
+from tusc_api import webctrl_tusc_api
+from tusc_api import captcha
+from tusc_api import registration_jobs
+from tusc_api import registration_export
+from tusc_api.request_coalescer import IdempotencyKeyReusedError
+from tusc_api.admission import WalletUnavailableError
+import asyncio
+import logging
+import typing
+import db_access.async_db as async_db
+import metrics
+from config import cfg
+
+logger = logging.getLogger('root')
+logger.debug('loading')
+
+# The routes of webctrl_tusc_api for the ASGI app, see registrar_asgi.py. Responses and errors are the same, the
+# rate limiter, stats cache and registration job runner are shared with webctrl_tusc_api.
+tusc_api = Blueprint('tusc_api', 'tusc_api', url_prefix='')
+general_cfg = cfg["general"]
+tusc_api_cfg = cfg["tusc_api"]
+
+captcha_verifier = captcha.create_captcha_verifier(captcha.AsyncCaptchaVerifier)
+# Created on first use, an asyncio.Lock created at import belongs to another event loop than the server's before
+# Python 3.10
+stats_lock = None
+
+
+@tusc_api.errorhandler(WalletUnavailableError)
+async def wallet_unavailable(error: WalletUnavailableError):
+    return webctrl_tusc_api._wallet_unavailable_response(error, get_real_ip())
+
+
+def get_real_ip():
+    real_ip = request.headers.get('X-Real-IP')
+
+    return real_ip if real_ip is not None else ""
+
+
+@tusc_api.route('/wallet/suggest_brain_key', methods=["GET"])
+async def suggest_brain_key():
+    logger.debug('suggest_brain_key, request from %s', get_real_ip())
+    return await gate_tusc_api_async.suggest_brain_key()
+
+
+@tusc_api.route('/wallet/account_available/<account_name>', methods=["GET"])
+async def account_available(account_name):
+    logger.debug('account_available, request from %s', get_real_ip())
+    return await gate_tusc_api_async.account_available(account_name)
+
+
+@tusc_api.route('/wallet/register_account', methods=["POST"])
+async def register_account():
+    logger.debug('register_account, request from %s', get_real_ip())
+
+    content = await request.get_json()
+    ip_address = get_real_ip()
+
+    idempotency_key = request.headers.get('Idempotency-Key', "")
+    if idempotency_key == "":
+        return await _handle_register_account(content, ip_address)
+
+    idempotency_key_error = webctrl_tusc_api._check_idempotency_key(idempotency_key)
+    if idempotency_key_error is not None:
+        return idempotency_key_error
+
+    try:
+        return await gate_tusc_api.request_coalescer.idempotent_async(
+            idempotency_key,
+            webctrl_tusc_api._request_fingerprint(content),
+            lambda: _handle_register_account(content, ip_address),
+            webctrl_tusc_api._is_cacheable_response)
+    except IdempotencyKeyReusedError:
+        return webctrl_tusc_api.IdempotencyKeyReusedResponse
+
+
+async def _handle_register_account(content: dict, ip_address: str) -> dict:
+    # The rate limiter backends are quick local or database calls, they run in the default executor
+    rate_limit_error, reservations = await run_in_thread(webctrl_tusc_api._reserve_rate_limit, ip_address)
+    if rate_limit_error is not None:
+        return rate_limit_error
+
+    try:
+        res = await _register_account(content, ip_address, reservations)
+    except BaseException:
+        # See webctrl_tusc_api._handle_register_account, this includes the request being cancelled
+        await run_in_thread(webctrl_tusc_api._release_rate_limit, reservations)
+        raise
+
+    if 'error' in res:
+        await run_in_thread(webctrl_tusc_api._release_rate_limit, reservations)
+
+    return res
+
+
+async def _register_account(content: dict, ip_address: str, reservations: list) -> dict:
+    if not general_cfg['disable_recaptcha'] and \
+            not await captcha_verifier.verify_async(content.get('recaptcha_response'), ip_address):
+        return webctrl_tusc_api.FailedCaptchaResponse
+
+    registration = webctrl_tusc_api._registration_fields(content)
+    if registration is None:
+        return webctrl_tusc_api.MissingFieldsResponse
+
+    account_name, public_key, referrer = registration
+    if tusc_api_cfg['registration_jobs_enabled']:
+        return await _queue_registration(account_name, public_key, referrer, ip_address, reservations)
+    return await gate_tusc_api_async.register_account(account_name, public_key, referrer)
+
+
+async def _queue_registration(account_name: str,
+                              public_key: str,
+                              referrer: str,
+                              ip_address: str,
+                              reservations: list) -> dict:
+    validation_error = await run_in_thread(gate_tusc_api.check_registration_request, account_name, public_key)
+    if validation_error is not None:
+        return validation_error
+
+    job_id = registration_jobs.new_job_id()
+    try:
+        queued = await async_db.enqueue_registration_job(job_id, account_name, public_key, referrer, ip_address,
+                                                         reservations, tusc_api_cfg['registration_jobs_max_queued'])
+    except:
+        logger.exception('Failed to queue registration job')
+        return gate_tusc_api.DefaultErrorResponse
+
+    return webctrl_tusc_api._queued_registration_response(job_id, queued)
+
+
+@tusc_api.route('/wallet/register_account/<job_id>', methods=["GET"])
+async def register_account_job(job_id):
+    try:
+        job = await async_db.get_registration_job(job_id)
+    except:
+        logger.exception('Failed to get registration job')
+        return gate_tusc_api.DefaultErrorResponse
+
+    return webctrl_tusc_api._registration_job_response(job)
+
+
+@tusc_api.route('/stats', methods=["GET"])
+async def stats():
+    res = webctrl_tusc_api.stats_cache.get("stats")
+    if res is None:
+        # One query per cache period, like stats_cache.get_or_load in webctrl_tusc_api
+        async with _get_stats_lock():
+            res = webctrl_tusc_api.stats_cache.get("stats")
+            if res is None:
+                res = await async_db.get_stats() or None
+                if res is None:
+                    return gate_tusc_api.DefaultErrorResponse
+                webctrl_tusc_api.stats_cache.set("stats", res)
+    return res
+
+
+def _get_stats_lock() -> asyncio.Lock:
+    global stats_lock
+    if stats_lock is None:
+        stats_lock = asyncio.Lock()
+    return stats_lock
+
+
+@tusc_api.route('/metrics', methods=["GET"])
+async def metrics_endpoint():
+    unauthorized = _check_token(general_cfg['metrics_api_tokens'], 'metrics')
+    if unauthorized is not None:
+        return unauthorized
+    return await run_in_thread(metrics.render_metrics), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+
+@tusc_api.route('/health', methods=["GET"])
+async def health():
+    return gate_tusc_api.health()
+
+
+def _check_token(tokens: typing.List[str], endpoint: str) -> typing.Optional[tuple]:
+    return webctrl_tusc_api._unauthorized_response(request.headers.get('Authorization'), tokens, endpoint,
+                                                   get_real_ip())
+
+
+@tusc_api.route('/registrations', methods=["GET"])
+async def registrations():
+    unauthorized = _check_token(tusc_api_cfg['registrations_api_tokens'], 'registrations')
+    if unauthorized is not None:
+        return unauthorized
+
+    try:
+        created_from, created_to, after, limit = webctrl_tusc_api._registrations_page_args(request.args)
+    except registration_export.InvalidExportRequestError as e:
+        return {"error": str(e)}, 400
+
+    try:
+        rows = await async_db.get_registrations_page(created_from, created_to, after, limit)
+    except:
+        logger.exception('Failed to get registrations page')
+        return gate_tusc_api.DefaultErrorResponse
+
+    return {"result": registration_export.page_result(rows, limit)}
+
+
+@tusc_api.route('/registrations/export', methods=["GET"])
+async def export_registrations():
+    unauthorized = _check_token(tusc_api_cfg['registrations_api_tokens'], 'registrations')
+    if unauthorized is not None:
+        return unauthorized
+
+    try:
+        created_from, created_to, export_format = webctrl_tusc_api._export_args(request.args)
+    except registration_export.InvalidExportRequestError as e:
+        return {"error": str(e)}, 400
+
+    logger.info('Exporting registrations as %s for %s', export_format, get_real_ip())
+    pages = async_db.iter_registration_pages(created_from, created_to,
+                                             tusc_api_cfg['registrations_export_batch_size'])
+    return Response(_export_chunks(export_format, pages),
+                    mimetype=registration_export.CONTENT_TYPES[export_format],
+                    headers=webctrl_tusc_api._export_headers(export_format))
+
+
+async def _export_chunks(export_format: str, pages: typing.AsyncIterator[list]) -> typing.AsyncIterator[bytes]:
+    yield registration_export.format_header(export_format).encode()
+    try:
+        async for rows in pages:
+            yield registration_export.format_rows(export_format, rows).encode()
+    except:
+        logger.exception('Registrations export failed part way')
+
+
+async def close_clients():
+    await captcha_verifier.close()
+    await gate_tusc_api_async.close()
+
+
+logger.debug('loaded')